@@ -5,15 +5,56 @@ from math import tan, atan
 #from numpy import correlate
 import sys
 sys.path.append('C:\\Users\\tkammerer\\AppData\\Local\\Continuum\\Anaconda2\\Lib\\site-packages')
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, sosfiltfilt
 from scipy.stats import linregress
+import numpy as np
+import Calibration
+import Templates
+
+"""
+Butterworth filter designs, as {(order, cutoff, filter type): FilterDesign}, so that each is only designed once
+"""
+filterDesigns = dict()
+
+"""
+A Butterworth filter, kept as its coefficients and its second-order sections, which are run forwards and backwards
+cutoff is a fraction of the Nyquist frequency, or a (low, high) pair of them for a bandpass filter
+Waveforms of padLength samples or fewer are too short to be filtered
+"""
+class FilterDesign():
+    def __init__(self, order, cutoff, filterType):
+        self.order = order
+        self.cutoff = cutoff
+        self.filterType = filterType
+        self.b, self.a = butter(order, cutoff, filterType)
+        self.sos = butter(order, cutoff, filterType, output = 'sos')
+        self.padLength = 3*(2*len(self.sos)+1-min((self.sos[:, 2] == 0).sum(), (self.sos[:, 5] == 0).sum()))
+
+    """
+    Filters values along axis
+    """
+    def run(self, values, axis = -1):
+        return sosfiltfilt(self.sos, values, axis = axis)
+
+"""
+Returns the Butterworth filter design of order, cutoff and filterType, designing it the first time it is asked for
+"""
+def findFilterDesign(order, cutoff, filterType):
+    key = (int(order), cutoff, filterType)
+    if key not in filterDesigns:
+        filterDesigns[key] = FilterDesign(*key)
+    return filterDesigns[key]
+
 class Analysis():
     """
     Defines the Analysis dataset as self.values, and the master display as self.master
+    self.diagnostics holds the BottomreturnDiagnostics of the last bottom return isolated
+    The dataset is held as a float64 array, so every filter works on the whole array at once
     """
     def __init__(self, data, master = None):
         self.master = master
-        self.values = data
+        self.values = np.asarray(data, dtype = np.float64)
+        self.diagnostics = None
 
     """
     Finds the slope to the right of a given sample value
@@ -26,34 +67,30 @@ class Analysis():
     Finds the global maximum and minimum of a dataset
     """
     def findGlobalExtrema(self):
-        return self.findInvertedData(max(self.values))[0], self.findInvertedData(min(self.values))[0]
+        return int(np.argmax(self.values)), int(np.argmin(self.values))
 
     """
     Finds all maxima and minima of a dataset
+    Compares the sign of the slope on either side of every sample in one pass
     """
     def findExtrema(self, minTest = 1, maxTest = None):
         if maxTest == None:
             maxTest = len(self.values) - 1
-        maxima = list()
-        minima = list()
         if maxTest <= minTest:
-            return maxima, minima
-        for x in range(minTest, maxTest):
-            if self.differentiate(x) < 0 and self.differentiate(x-1) >= 0 or self.differentiate(x) <= 0 and self.differentiate(x-1) > 0:
-                maxima.append(x)
-            if self.differentiate(x) > 0 and self.differentiate(x-1) <= 0 or self.differentiate(x) >= 0 and self.differentiate(x-1) < 0:
-                minima.append(x)
+            return np.zeros(0, dtype = int), np.zeros(0, dtype = int)
+        #slopes[x+1] is the slope to the right of sample x, with slopes[0] wrapping around like differentiate(-1)
+        slopes = np.concatenate(([self.values[0] - self.values[-1]], np.diff(self.values)))
+        right = slopes[minTest+1:maxTest+1]
+        left = slopes[minTest:minTest+len(right)]
+        maxima = np.flatnonzero((right < 0) & (left >= 0) | (right <= 0) & (left > 0)) + minTest
+        minima = np.flatnonzero((right > 0) & (left <= 0) | (right >= 0) & (left < 0)) + minTest
         return maxima, minima
 
     """
     For a given y-value, returns all x-values which satisfy the inverse waveform
     """
     def findInvertedData(self, resultantValue):
-        xVal = list()
-        for n in range(len(self.values)):
-            if self.values[n] == resultantValue:
-                xVal.append(n)
-        return xVal
+        return np.flatnonzero(self.values == resultantValue)
 
     """
     Finds the mean of the dataset between a minimum and maximum x-value
@@ -61,29 +98,16 @@ class Analysis():
     def findMean(self, minTest = 0, maxTest = None):
         if maxTest == None:
             maxTest = len(self.values)
-        mean = sum(self.values[minTest:maxTest])/float(maxTest-minTest)
+        #summed in sample order so filtered layers match those written before the array path
+        mean = sum(self.values[minTest:maxTest].tolist())/float(maxTest-minTest)
         return mean
-    
+
     """
     Returns a dataset which has been vertically translated such that it's mean value is 0
     """
     def zeroShift(self):
-        mean = sum(self.values)/len(self.values)
-        values = list()
-        for n in range(len(self.values)):
-            values.append(self.values[n]-mean)
-        return values
+        return self.values - self.values.sum()/len(self.values)
     
-    """
-    Finds the maximum value of a 2-dimensional array
-    """
-    def twoDMax(self, twoDimensionalArray):
-        a = twoDimensionalArray
-        maxes = list()
-        for n in range(len(a)):
-            maxes.append(max(a[n]))
-        return max(maxes)
-
     """
     Note: all filters are denoted as 'apply' + filterName
     """
@@ -97,12 +121,30 @@ class Analysis():
     """
     Returns the dataset after it has been run through a lowpass filter
     """
-    def applyLowpass(self, start, requestData = False):
-        if len(self.values) <= 18:
-            return [0, 0], 0, list()
+    def applyLowpass(self, start, requestData = False, order = 5, cutoff = .1):
+        return self.applyButterworth(start, findFilterDesign(order, cutoff, 'lowpass'))
+
+    """
+    Returns the dataset after it has been run through a highpass filter
+    """
+    def applyHighpass(self, start, requestData = False, order = 5, cutoff = .1):
+        return self.applyButterworth(start, findFilterDesign(order, cutoff, 'highpass'))
+
+    """
+    Returns the dataset after it has been run through a bandpass filter passing from low to high
+    """
+    def applyBandpass(self, start, requestData = False, order = 5, low = .05, high = .2):
+        return self.applyButterworth(start, findFilterDesign(order, (low, high), 'bandpass'))
+
+    """
+    Runs the dataset through a filter design
+    Datasets too short for the design become [0, 0] starting at 0
+    """
+    def applyButterworth(self, start, design):
+        if len(self.values) <= design.padLength:
+            return np.zeros(2), 0, list()
         else:
-            b, a = butter(5, .1, 'lowPass')
-            return filtfilt(b, a, self.values), start, list()
+            return design.run(self.values), start, list()
 
     """
     Isolates the bottom return of a bathymetric LIDAR waveform
@@ -112,157 +154,186 @@ class Analysis():
         derivative = Analysis(reduced).applyDerivative(0)[0]
         derivative = Analysis(derivative).applyDerivative(0)[0]
         smoothDer = Analysis(derivative).applyLowpass(0)[0]
-        maxima, minima = Analysis(smoothDer).findExtrema()
-        minimums = [maxima[0], maxima[0]]
-        for m in minima:
-            if m > 250:
-                break
-            if self.values[m] > .01*max(self.values):
-                if smoothDer[m] < smoothDer[minimums[1]]:
-                    if smoothDer[m] < smoothDer[minimums[0]]:
-                        minimums[1] = int(minimums[0])
-                        minimums[0] = int(m)
-                    else:
-                        minimums[1] = int(m)
-        if minimums[1] < minimums[0]:
-            bottomReturn = int(minimums[0])
-        else:
-            bottomReturn = int(minimums[1])
-        for n in range(len(maxima)):
-            if maxima[n] > bottomReturn:
-                break
-        leading = int(maxima[n-1])
         """
         Decompress the waveform
         """
-        values = Analysis(self.applyLogAmp(0)[0]).applyNoise_Reduction(0)[0]
-        """
-        Find the intersection point between the waveform and a 10% threshold of the bottom return
-        """
-        for n in range(bottomReturn, len(values)):
-            if .1*values[bottomReturn] > values[n]:
-                endPoint = n
-                break
-        """
-        Create line from intersection point and minimum
-        """
-        clear = False
-        while not clear:
-            m = (values[leading]-values[endPoint])/(leading-endPoint)
-            b = values[leading]-m*leading
-            clear = True
-            for n in range(bottomReturn, leading, -1):
-                if values[n] < m*n+b:
-                    leading+=1
-                    clear = False
-                    break
-        """
-        Move intersection point to closest intersection between line and waveform
-        """
-        for n in range(bottomReturn, endPoint):
-            if values[n] < m*n+b:
-                endPoint = n
-                break
+        decompressed = Analysis(self.applyLogAmp(0)[0]).applyNoise_Reduction(0)[0]
+        return self.isolateRawBottomreturn(smoothDer, decompressed)
+
+    """
+    Isolates the bottom return of a raw waveform, given its smoothed second derivative and its decompressed values
+    Waveforms whose bottom return cannot be found become [0, 0] starting at 0, with the reason in self.diagnostics
+    """
+    def isolateRawBottomreturn(self, smoothDer, decompressed):
+        fit = self.detectBottomreturn(smoothDer, decompressed)
+        if fit == None:
+            return np.zeros(2), 0, [0, 0, 0]
+        leading, endPoint, m, b = fit
         """
         Highlight minimum, intersection point, and line
         """
         if self.master != None:
-            self.master.addHighlightPoint(bottomReturn, self.values[bottomReturn], 'red')
+            self.master.addHighlightPoint(self.diagnostics.bottomReturn, self.values[self.diagnostics.bottomReturn], 'red')
             self.master.addHighlightPoint(leading, self.values[leading], 'purple')
             self.master.addHighlightPoint(endPoint, self.values[endPoint], 'pink')
         """
         Generate new values by subtracting the line from the waveform
         """
-        returnValues = list()
-        for x in range(leading, endPoint+1):
-            returnValues.append(values[x]-(m*x+b))
-        try:
-            return returnValues, leading, [max(returnValues), len(returnValues), leading]
-        except ValueError:
-            return [0, 0], 0, [0, 0, 0]
-        
+        returnValues = decompressed[leading:endPoint+1] - (m*np.arange(leading, endPoint+1)+b)
+        return self.packBottomreturn(returnValues, leading)
 
     def applyBottomreturn_Isolation(self, start, requestData = False):
         derivative, s, d = self.applyDerivative(0)
         derivative, s, d = Analysis(derivative).applyDerivative(0)
         smoothDer, s, d = Analysis(derivative).applyLowpass(0)
-        maxima, minima = Analysis(smoothDer).findExtrema()
-        minimums = [maxima[0], maxima[0]]
-        for m in minima:
-            if m > 250:
-                break
-            if self.values[m] > .01*max(self.values):
-                if smoothDer[m] < smoothDer[minimums[1]]:
-                    if smoothDer[m] < smoothDer[minimums[0]]:
-                        minimums[1] = int(minimums[0])
-                        minimums[0] = int(m)
-                    else:
-                        minimums[1] = int(m)
-        if minimums[1] < minimums[0]:
-            bottomReturn = int(minimums[0])
-        else:
-            bottomReturn = int(minimums[1])
-        for n in range(len(maxima)):
-            if maxima[n] > bottomReturn:
-                break
-        starting = int(maxima[n-1])
-        if self.master != None:
-            self.master.addHighlightPoint(bottomReturn, self.values[bottomReturn], 'red')
+        return self.isolateBottomreturn(smoothDer)
+
+    """
+    Isolates the bottom return of a noise reduced waveform, given its smoothed second derivative
+    Waveforms whose bottom return cannot be found become [0, 0] starting at 0, with the reason in self.diagnostics
+    """
+    def isolateBottomreturn(self, smoothDer):
+        fit = self.detectBottomreturn(smoothDer, self.values)
+        if fit == None:
+            return np.zeros(2), 0, [0, 0, 0]
+        leading, endPoint, m, b = fit
         """
-        Detect the leading edge
+        Highlight minimum, intersection point, and line
         """
-        leading = int(starting)
+        if self.master != None:
+            self.master.addHighlightPoint(self.diagnostics.bottomReturn, self.values[self.diagnostics.bottomReturn], 'red')
+            self.master.addHighlightPoint(leading, self.values[leading], 'purple')
+            self.master.addHighlightPoint(endPoint, self.values[endPoint], 'pink')
+            self.master.addHighlightLine(0, b, -b/m, 0)
         """
-        Find the intersection point between the waveform and a 10% threshold of the bottom return
+        Generate new values by subtracting the line from the waveform
         """
-        for n in range(bottomReturn, len(self.values)):
-            if .1*self.values[bottomReturn] > self.values[n]:
-                endPoint = n
-                break
+        values = self.values[leading:endPoint+1] - (m*np.arange(leading, endPoint+1)+b)
+        return self.packBottomreturn(values, leading)
+
+    """
+    Returns an isolated bottom return with its peak, length and leading edge
+    """
+    def packBottomreturn(self, values, leading):
+        if len(values) == 0:
+            self.diagnostics.fallback = 'empty bottom return'
+            return np.zeros(2), 0, [0, 0, 0]
+        return values, leading, [float(values.max()), len(values), leading]
+
+    """
+    Finds the bottom return in the smoothed second derivative and fits a line under it in values
+    Records what was found in self.diagnostics
+    Returns the leading edge, the end point, and the slope and intercept of the line, or None if there is no bottom return
+    """
+    def detectBottomreturn(self, smoothDer, values):
+        self.diagnostics = BottomreturnDiagnostics()
+        bottomReturn, leading = self.findBottomreturn(smoothDer)
+        if bottomReturn == None:
+            self.diagnostics.fallback = 'no maxima'
+            return None
+        self.diagnostics.bottomReturn = bottomReturn
+        self.diagnostics.leadingMaximum = leading
+        return self.fitBottomreturn(values, bottomReturn, leading)
+
+    """
+    Picks the bottom return out of the minima of the smoothed second derivative of the waveform
+    The bottom return is the later of the two deepest minima within the first 250 samples which lie above 1% of the
+    waveform's peak, with the first maximum standing in for both until deeper minima are found
+    Returns the bottom return and the maximum of the smoothed second derivative preceding it,
+    or None for both if the smoothed second derivative has no maxima
+    """
+    def findBottomreturn(self, smoothDer):
+        smoothDer = np.asarray(smoothDer)
+        maxima, minima = Analysis(smoothDer).findExtrema()
+        if len(maxima) == 0:
+            return None, None
+        candidates = minima[minima <= 250]
+        candidates = candidates[self.values[candidates] > .01*self.values.max()]
         """
-        Create line from intersection point and minimum
+        Ties go to the first maximum, then to the earliest minimum
         """
-        clear = False
-        while not clear:
-            m = (self.values[leading]-self.values[endPoint])/(leading-endPoint)
-            b = self.values[leading]-m*leading
-            clear = True
-            for n in range(bottomReturn, leading, -1):
-                if self.values[n] < m*n+b:
-                    leading+=1
-                    clear = False
-                    break
+        depths = np.concatenate((smoothDer[[maxima[0], maxima[0]]], smoothDer[candidates]))
+        order = np.lexsort((np.arange(len(depths)), depths))
+        bottomReturn = int(np.concatenate(([maxima[0], maxima[0]], candidates))[order[:2]].max())
+        n = min(int(np.searchsorted(maxima, bottomReturn, 'right')), len(maxima)-1)
+        return bottomReturn, int(maxima[n-1])
+
+    """
+    Fits a line under the bottom return of values, from the leading edge to where values falls below 10% of the bottom return
+    The leading edge moves forward from leading to the first sample whose line clears the waveform up to the bottom return,
+    with every candidate line tested at once
+    Returns the leading edge, the end point, and the slope and intercept of the line, or None if no line can be fitted
+    """
+    def fitBottomreturn(self, values, bottomReturn, leading):
+        values = np.asarray(values, dtype = np.float64)
+        if bottomReturn >= len(values) or leading >= len(values):
+            self.diagnostics.fallback = 'bottom return outside waveform'
+            return None
         """
-        Move intersection point to closest intersection between line and waveform
+        Find the intersection point between the waveform and a 10% threshold of the bottom return
         """
-        for n in range(bottomReturn, endPoint):
-            if self.values[n] < m*n+b:
-                endPoint = n
-                break
+        below = np.flatnonzero(values[bottomReturn:] < .1*values[bottomReturn])
+        if len(below) == 0:
+            self.diagnostics.fallback = 'no end point'
+            return None
+        endPoint = bottomReturn+int(below[0])
+        self.diagnostics.endPoint = endPoint
         """
-        Highlight minimum, intersection point, and line
+        Create lines from candidate leading edges to the intersection point, and keep the first which stays under the waveform
+        Candidates are tested in blocks, each twice the size of the last, as most lines clear within a few samples
+        A leading edge reaching the intersection point would give a vertical line
         """
-        if self.master != None:
-            self.master.addHighlightPoint(leading, self.values[leading], 'purple')
-            self.master.addHighlightPoint(endPoint, self.values[endPoint], 'pink')
-            self.master.addHighlightLine(0, b, -b/m, 0)
+        last = max(bottomReturn, leading)
+        if leading < endPoint:
+            last = min(last, endPoint-1)
+        first, size, chosen = leading, 8, None
+        samples = np.arange(leading+1, bottomReturn+1)
+        while chosen == None and first <= last and first != endPoint:
+            leadings = np.arange(first, min(first+size, last+1))
+            m = (values[leadings]-values[endPoint])/(leadings-endPoint)
+            b = values[leadings]-m*leadings
+            crossing = (samples > leadings[:, None]) & (values[samples] < m[:, None]*samples+b[:, None])
+            clear = np.flatnonzero(~crossing.any(axis = 1))
+            if len(clear) != 0:
+                chosen = int(clear[0])
+            else:
+                first, size = first+size, 2*size
+        if chosen == None:
+            self.diagnostics.iterations = min(first, last+1)-leading
+            self.diagnostics.fallback = 'vertical line'
+            return None
+        self.diagnostics.iterations = int(leadings[chosen])-leading+1
+        leading, m, b = int(leadings[chosen]), m[chosen].item(), b[chosen].item()
+        self.diagnostics.leading = leading
         """
-        Generate new values by subtracting the line from the waveform
+        Move intersection point to closest intersection between line and waveform
         """
-        values = list()
-        for x in range(leading, endPoint+1):
-            values.append(self.values[x]-(m*x+b))
-        try:
-            return values, leading, [max(values), len(values), leading]
-        except ValueError:
-            return [0, 0], 0, [0, 0, 0]
+        crossing = np.flatnonzero(values[bottomReturn:endPoint] < m*np.arange(bottomReturn, endPoint)+b)
+        if len(crossing) != 0:
+            endPoint = bottomReturn+int(crossing[0])
+        self.diagnostics.endPoint = endPoint
+        return leading, endPoint, m, b
 
     """
     Applies a Christmas Tree filter to the bottomreturn of a bathymetric LIDAR waveform
     """
     def applyChristmas_Tree(self, start, requestData = False):
+        values, startingPoint, fit = self.isolateChristmas_Tree()
+        if fit == None:
+            return [0, 0], 0, findEmptyChristmas_TreeData()
+        if not requestData:
+            return values, startingPoint+start, list()
+        xrcovs = Templates.crossCovariance(Templates.activeTemplates, np.array([values]), np.array([len(values)]))[0]
+        return values, startingPoint+start, findChristmas_TreeData(values, xrcovs, fit)
+
+    """
+    Fits lines to both sides of the christmas tree and takes the waveform from the lines
+    Returns the new values, where they start, and the slopes and r values of the lines,
+    or None for all three if the waveform has no christmas tree
+    """
+    def isolateChristmas_Tree(self):
         if len(self.values) < 6:
-            return [0, 0], 0, [0, 0, 0, 0, 0, 0, 0]
+            return None, None, None
         maximum, minimum = self.findGlobalExtrema()
         maxVal = self.values[maximum]
         if self.master != None:
@@ -276,7 +347,7 @@ class Analysis():
                     linePoints[1].append([n, self.values[n]])
         slope, intercept, r_value = [0, 0], [0, 0], [0, 0]
         if len(linePoints[0]) < 2 or len(linePoints[1]) < 2:
-            return [0, 0], 0, [0, 0, 0, 0, 0, 0, 0]
+            return None, None, None
         for n in range(2):
             if len(linePoints[n]) > 2:
                 slope[n], intercept[n], r_value[n], p_value, std_err = linregress(linePoints[n])
@@ -285,7 +356,7 @@ class Analysis():
                 intercept[n] = linePoints[n][0][1]-slope[n]*linePoints[n][0][0]
                 r_value[n] = 1.0
         if slope[0] == slope[1]:
-            return [0, 0], 0, [0, 0, 0, 0, 0, 0, 0]
+            return None, None, None
         intersection = (intercept[1]-intercept[0])/(slope[0]-slope[1])
         if self.master!= None:
             self.master.addHighlightLine(linePoints[0][0][0], intercept[0]+slope[0]*linePoints[0][0][0], linePoints[1][len(linePoints[1])-1][0], intercept[0]+slope[0]*linePoints[1][len(linePoints[1])-1][0])
@@ -294,7 +365,7 @@ class Analysis():
                 for m in range(len(linePoints[n])):
                     self.master.addHighlightPoint(linePoints[n][m][0], linePoints[n][m][1])
         if intersection < 0 or intersection > len(self.values):
-            return [0, 0], 0, [0, 0, 0, 0, 0, 0, 0]
+            return None, None, None
         for x in range(int(intersection), 0, -1):
             if intercept[0]+slope[0]*x - self.values[x] <= .01:
                 startingPoint = x
@@ -313,102 +384,252 @@ class Analysis():
         except UnboundLocalError:
             pass
         if len(values) <= 2:
-            return [0, 0], 0, [0, 0, 0, 0, 0, 0, 0]
-        if not requestData:
-            return values, startingPoint+start, list()
-        else:
-            standard = [0,34.59591151,181.0065031,390.1960062,668.0224207,1019.288653,1447.788669,1956.362735,2546.959288,3220.701341,3977.955599,4818.402784,5591,4703.829564,3895.474605,3163.559533,2505.355592,1917.838918,1397.744873,941.618485,545.8609216,206.7719882,-3.42E-12]
-            xrcov = self.xcov(standard, values)
-            return values, startingPoint+start, list([max(values), len(values), xrcov, slope[0], slope[1], pow(r_value[0],2), pow(r_value[1],2)])
+            return None, None, None
+        return values, startingPoint, (slope, r_value)
 
     """
     Determines the cross-covariance between two datasets: a and b
+    Returns the greatest covariance over every lag, as Templates.crossCovariance does
     """
     def xcov(self, a, b):
-        a = Analysis(a).zeroShift()
-        b = Analysis(b).zeroShift()
-        length = 2*max([len(a), len(b)])-1
-        output = list()
-        for n in range(length):
-            addList = list()
-            for m in range(abs((length-1)/2-n)):
-                addList.append(0)
-            if n <= (length+1)/2:
-                c = self.correlate(addList + a, b + addList)
-            else:
-                c = self.correlate(a + addList, addList + b)
-            output.append(c)
-        return self.twoDMax(output)
-        
-    def correlate(self, a, b):
-        amean, bmean = 0, 0
-        for n in a:
-            amean += n
-        amean /= len(a)
-        for n in b:
-            bmean += n
-        bmean /= len(b)
-        cov = 0
-        for n in range(len(a)):
-            cov += (a[n]-amean)*(b[n]-bmean)
-        cov /= len(a)
-        return cov
-        
+        return Templates.crossCovariance([Templates.Template('', a)], np.array([b], dtype = np.float64), np.array([len(b)]))[0, 0]
 
     """
     Amplifies a bathymetric LIDAR waveform from it's compressed state to original intensity reception
-    """
-    def applyLogAmp(self, start, requestData = False):
-        if max(self.values) > 255:
-            return [0, 0], 0, list()
-        logAmp = [0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,
-                  0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.644,0.67,0.697,0.723,0.75,0.776,
-                  0.803,0.829,0.856,0.882,0.909,0.936,0.962,0.989,1.015,1.056,1.104,1.152,1.2,
-                  1.248,1.296,1.344,1.393,1.441,1.489,1.537,1.585,1.633,1.681,1.741,1.813,1.885,
-                  1.958,2.03,2.102,2.174,2.246,2.319,2.391,2.463,2.535,2.608,2.68,2.752,2.829,
-                  2.926,3.023,3.12,3.217,3.314,3.411,3.508,3.605,3.702,3.799,3.896,3.993,4.09,
-                  4.187,4.284,4.381,4.478,4.621,4.824,5.026,5.229,5.432,5.634,5.837,6.039,6.242,
-                  6.445,6.647,6.85,7.053,7.255,7.469,7.712,7.956,8.199,8.442,8.685,8.928,9.171,
-                  9.415,9.658,9.901,10.144,10.387,10.63,10.874,11.117,11.36,11.603,11.968,12.414,
-                  12.86,13.306,13.752,14.198,14.644,15.09,15.536,15.982,16.428,16.874,17.32,17.766,
-                  18.212,18.755,19.607,20.46,21.313,22.165,23.018,23.87,24.723,25.576,26.428,
-                  27.281,28.133,28.986,29.89,30.925,31.961,32.997,34.032,35.068,36.103,37.139,
-                  38.174,39.21,40.245,41.281,42.316,43.352,44.387,45.423,47.088,48.811,50.534,
-                  52.256,53.979,55.701,57.424,59.146,60.869,62.591,64.314,66.037,67.759,69.491,
-                  71.494,73.497,75.5,77.503,79.506,81.509,83.512,85.515,87.518,89.521,91.524,
-                  93.527,95.53,97.533,99.536,101.982,104.897,107.811,110.725,113.64,116.554,119.469,
-                  122.383,125.298,128.212,131.126,134.041,136.955,139.87,142.816,145.828,148.841,
-                  151.853,154.866,157.878,160.891,163.903,166.916,169.928,172.941,175.953,178.966,
-                  181.979,184.991,186.214,187.213,188.212,189.211,190.21,191.209,192.207,193.206,
-                  194.205,195.204,196.203,197.202,198.201,199.2,200.198,201.1,201.814,202.528,203.242,
-                  203.956,204.67,205.384,206.098,206.811,207.525,208.125,208.125,208.125,208.125,
-                  208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125]
-        values = list()
-        for val in self.values:
-            values.append(val*logAmp[int(val)])
-        return values, start, list()
+    table names the Calibration table used, and outside how samples outside it are handled, as in Calibration.outsideModes
+    The number of samples outside the table is the additional data
+    """
+    def applyLogAmp(self, start, requestData = False, table = 'standard', outside = 'reject'):
+        values, beyond = Calibration.findTable(table).decompress(self.values, outside)
+        if outside == 'reject' and beyond != 0:
+            return np.zeros(2), 0, [int(beyond)]
+        return values, start, [int(beyond)]
 
     """
     Attempts to reduce the background noise of a waveform
+    Waveforms of 200 samples or fewer have no samples to take the noise from, and are left as they are
     """
     def applyNoise_Reduction(self, start, requestData = False):
-        bottomMean = self.findMean(200)
-        values = list()
-        for n in range(len(self.values)):
-            values.append(self.values[n]-bottomMean)
-        return values, start, list()
+        bottomMean = 0
+        if len(self.values) > 200:
+            bottomMean = self.findMean(200)
+        return self.values-bottomMean, start, list()
 
     """
     Returns a dataset of the waveform's derivative over time
     """
     def applyDerivative(self, start, requestData = False):
-        values = list()
-        for x in range(len(self.values)-1):
-            values.append(self.differentiate(x))
-        return values, start+.5, list()
+        return np.diff(self.values), start+.5, list()
 
     def applyIncrease(self, start, requestData = False):
-        values = list()
-        for n in self.values:
-            values.append(n+100)
-        return values, start, list()
\ No newline at end of file
+        return self.values+100, start, list()
+
+"""
+Record of how the bottom return of a waveform was found
+bottomReturn, leadingMaximum, leading and endPoint are the detected indices, iterations is the number of candidate
+leading edges tried, and fallback names why no bottom return was found, or is None if one was
+"""
+class BottomreturnDiagnostics():
+    def __init__(self):
+        self.bottomReturn = None
+        self.leadingMaximum = None
+        self.leading = None
+        self.endPoint = None
+        self.iterations = 0
+        self.fallback = None
+
+"""
+Returns the additional data of a christmas tree: its peak, length, XRCOV, the slopes of its sides and their R2 values,
+then its XRCOV against every other template in use
+"""
+def findChristmas_TreeData(values, xrcovs, fit):
+    slope, r_value = fit
+    return list([max(values), len(values), xrcovs[0], slope[0], slope[1], pow(r_value[0],2), pow(r_value[1],2)]) + list(xrcovs[1:])
+
+"""
+Returns the additional data of a waveform without a christmas tree
+"""
+def findEmptyChristmas_TreeData():
+    return [0, 0, 0, 0, 0, 0, 0] + [0]*len(Templates.findTemplateColumns())
+
+"""
+Packs a list of waveforms of differing lengths into a zero padded (N, samples) array
+Returns the array and the length of each row
+"""
+def padRows(rows, width = None):
+    lengths = np.array([len(row) for row in rows], dtype = int)
+    if width == None:
+        width = max(lengths.max() if len(lengths) else 0, 2)
+    values = np.zeros((len(rows), width))
+    for n in range(len(rows)):
+        values[n, :lengths[n]] = rows[n]
+    return values, lengths
+
+class BatchAnalysis():
+    """
+    Defines a block of waveforms as the (N, samples) array self.values, and the number of samples in each row as self.lengths
+    Rows shorter than the block are padded with zeros, which every filter ignores
+    Filters are denoted as 'apply' + filterName, like Analysis, but take and return a start per row,
+    and return the filtered rows, their lengths, their starts, and an (N, columns) array of their additional data
+    Bottom return filters collect the BottomreturnDiagnostics of every row in self.diagnostics
+    """
+    def __init__(self, data, lengths = None):
+        if isinstance(data, np.ndarray) and data.ndim == 2:
+            self.values = np.asarray(data, dtype = np.float64)
+            if lengths is None:
+                lengths = np.full(len(data), data.shape[1], dtype = int)
+            self.lengths = np.asarray(lengths, dtype = int)
+        else:
+            self.values, self.lengths = padRows(data)
+        self.mask = np.arange(self.values.shape[1]) < self.lengths[:, None]
+        self.diagnostics = list()
+
+    """
+    Returns the rows of the block as a list of Analysis objects
+    """
+    def rows(self):
+        return [Analysis(self.values[n, :self.lengths[n]]) for n in range(len(self.lengths))]
+
+    """
+    Returns each waveform length in the block, and the indices of the rows of that length
+    """
+    def findLengthGroups(self):
+        groups = list()
+        for length in np.unique(self.lengths):
+            groups.append((int(length), np.flatnonzero(self.lengths == length)))
+        return groups
+
+    def starts(self, start):
+        return np.zeros(len(self.lengths)) + start
+
+    def noData(self, columns = 0):
+        return np.zeros((len(self.lengths), columns))
+
+    def applyNone(self, start, requestData = False):
+        return self.values, self.lengths, np.zeros(len(self.lengths)), self.noData()
+
+    def applyLowpass(self, start, requestData = False, order = 5, cutoff = .1):
+        return self.applyButterworth(start, findFilterDesign(order, cutoff, 'lowpass'))
+
+    def applyHighpass(self, start, requestData = False, order = 5, cutoff = .1):
+        return self.applyButterworth(start, findFilterDesign(order, cutoff, 'highpass'))
+
+    def applyBandpass(self, start, requestData = False, order = 5, low = .05, high = .2):
+        return self.applyButterworth(start, findFilterDesign(order, (low, high), 'bandpass'))
+
+    """
+    Runs a filter design along every row, filtering rows of the same length together
+    Rows too short for the design become [0, 0] starting at 0, as in Analysis.applyButterworth
+    """
+    def applyButterworth(self, start, design):
+        values = np.zeros(self.values.shape)
+        lengths = self.lengths.copy()
+        starts = self.starts(start)
+        for length, rows in self.findLengthGroups():
+            if length <= design.padLength:
+                lengths[rows] = 2
+                starts[rows] = 0
+            else:
+                values[rows, :length] = design.run(self.values[rows, :length], axis = 1)
+        return values, lengths, starts, self.noData()
+
+    """
+    Decompresses every row with one lookup into a Calibration table, as Analysis.applyLogAmp does
+    """
+    def applyLogAmp(self, start, requestData = False, table = 'standard', outside = 'reject'):
+        values, beyond = Calibration.findTable(table).decompress(self.values, outside, self.mask)
+        lengths = self.lengths.copy()
+        starts = self.starts(start)
+        if outside == 'reject':
+            rejected = beyond != 0
+            values[rejected] = 0
+            lengths[rejected] = 2
+            starts[rejected] = 0
+        return values, lengths, starts, beyond[:, None].astype(np.float64)
+
+    """
+    Subtracts the mean of samples 200 onwards from every row, leaving rows of 200 samples or fewer as they are
+    The mean is summed in sample order so each row matches Analysis.applyNoise_Reduction
+    """
+    def applyNoise_Reduction(self, start, requestData = False):
+        bottomMeans = np.zeros(len(self.lengths))
+        if self.values.shape[1] > 200:
+            sums = np.add.accumulate(self.values[:, 200:]*self.mask[:, 200:], axis = 1)
+            tailed = np.flatnonzero(self.lengths > 200)
+            bottomMeans[tailed] = sums[tailed, self.lengths[tailed]-201]/(self.lengths[tailed]-200.)
+        values = (self.values-bottomMeans[:, None])*self.mask
+        return values, self.lengths.copy(), self.starts(start), self.noData()
+
+    def applyDerivative(self, start, requestData = False):
+        lengths = np.maximum(self.lengths-1, 0)
+        values = np.diff(self.values, axis = 1)*(np.arange(self.values.shape[1]-1) < lengths[:, None])
+        return values, lengths, self.starts(start)+.5, self.noData()
+
+    def applyIncrease(self, start, requestData = False):
+        return (self.values+100)*self.mask, self.lengths.copy(), self.starts(start), self.noData()
+
+    """
+    Smooths the second derivative of every row as one block
+    """
+    def findSmoothDerivatives(self, values, lengths):
+        derivative = BatchAnalysis(values, lengths).applyDerivative(0)
+        derivative = BatchAnalysis(derivative[0], derivative[1]).applyDerivative(0)
+        smoothDer = BatchAnalysis(derivative[0], derivative[1]).applyLowpass(0)
+        return smoothDer[0], smoothDer[1]
+
+    """
+    Isolates the bottom return of every row, taking the derivatives and lowpass filter of the block at once
+    The returns are padded into a new block, with the bottom return peak, length and leading edge of every row
+    """
+    def applyBottomreturn_Isolation(self, start, requestData = False):
+        smoothDer, smoothLengths = self.findSmoothDerivatives(self.values, self.lengths)
+        isolated = list()
+        for n in range(len(self.lengths)):
+            row = Analysis(self.values[n, :self.lengths[n]])
+            isolated.append(row.isolateBottomreturn(smoothDer[n, :smoothLengths[n]]))
+            self.diagnostics.append(row.diagnostics)
+        return self.packIsolated(isolated)
+
+    """
+    Isolates the bottom return of every raw row, decompressing and noise reducing the block at once
+    """
+    def applyRaw_Bottomreturn_Isolation(self, start, requestData = False):
+        reduced = self.applyNoise_Reduction(0)
+        smoothDer, smoothLengths = self.findSmoothDerivatives(reduced[0], reduced[1])
+        decompressed = self.applyLogAmp(0)
+        decompressed = BatchAnalysis(decompressed[0], decompressed[1]).applyNoise_Reduction(0)
+        isolated = list()
+        for n in range(len(self.lengths)):
+            row = Analysis(self.values[n, :self.lengths[n]])
+            isolated.append(row.isolateRawBottomreturn(smoothDer[n, :smoothLengths[n]], decompressed[0][n, :decompressed[1][n]]))
+            self.diagnostics.append(row.diagnostics)
+        return self.packIsolated(isolated)
+
+    """
+    Isolates the christmas tree of every row, then cross-covaries all of them against every template in use at once
+    Rows without a christmas tree become [0, 0] starting at 0, as in Analysis.applyChristmas_Tree
+    """
+    def applyChristmas_Tree(self, start, requestData = False):
+        isolated = [row.isolateChristmas_Tree() for row in self.rows()]
+        fitted = [n for n in range(len(isolated)) if isolated[n][2] != None]
+        xrcovs = np.zeros((len(isolated), len(Templates.activeTemplates)))
+        if requestData and len(fitted) != 0:
+            trees, lengths = padRows([isolated[n][0] for n in fitted])
+            xrcovs[fitted] = Templates.crossCovariance(Templates.activeTemplates, trees, lengths)
+        starts = self.starts(start)
+        results = list()
+        for n in range(len(isolated)):
+            values, startingPoint, fit = isolated[n]
+            if fit == None:
+                results.append(([0, 0], 0, findEmptyChristmas_TreeData() if requestData else list()))
+            elif requestData:
+                results.append((values, startingPoint+starts[n], findChristmas_TreeData(values, xrcovs[n], fit)))
+            else:
+                results.append((values, startingPoint+starts[n], list()))
+        return self.packIsolated(results)
+
+    def packIsolated(self, isolated):
+        values, lengths = padRows([result[0] for result in isolated])
+        starts = np.array([result[1] for result in isolated], dtype = np.float64)
+        data = np.array([result[2] for result in isolated], dtype = np.float64).reshape(len(isolated), -1)
+        return values, lengths, starts, data
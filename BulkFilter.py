@@ -0,0 +1,302 @@
+"""
+Headless engine for bulk filtering a waveform database file
+Splits the file into chunks of waveforms, filters the chunks in a pool of processes,
+and writes the filtered waveforms and their additional data in the original waveform order
+A chain of filters runs as one job: each waveform passes through every filter in memory, unrounded,
+and only the layers asked for are written
+Jobs are checkpointed, so a job which is stopped carries on from its last checkpoint when run again
+"""
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+from Analysis import Analysis, BatchAnalysis
+from WaveformStore import RecordReader, formatValue, parseRecord
+from Filters import findFilter, formatFiltersApplied, parseFilter
+import Calibration
+import Templates
+import ResultCache
+from Checkpoint import Checkpoint
+
+"""
+Number of waveforms handed to a process at a time
+"""
+chunkSize = 500
+
+"""
+Minimum number of seconds between two calls of a progress callback
+"""
+progressInterval = .25
+
+"""
+Number of bytes buffered when reading a database file and when writing filtered files
+"""
+bufferSize = 1 << 20
+
+"""
+Calls a progress callback with (waveforms done, total waveforms), at most once every progressInterval seconds
+The final update is always passed on
+"""
+class Progress():
+    def __init__(self, callback, total, interval = progressInterval):
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.lastCall = 0
+        self.lastDone = None
+
+    def update(self, done):
+        if self.callback == None or done == self.lastDone:
+            return
+        if done >= self.total or time.time()-self.lastCall >= self.interval:
+            self.lastCall = time.time()
+            self.lastDone = done
+            self.callback(done, self.total)
+
+"""
+Writes a filtered waveform as a database line, or an empty string if the filter returned no values
+Values are rounded to 2 decimals unless exact is set, when they are written so that they read back unchanged
+"""
+def formatRecord(values, start, exact = False):
+    if len(values) == 0:
+        return ''
+    if exact:
+        return ''.join((','.join([repr(value) for value in np.asarray(values, dtype = np.float64).tolist()]), ':', repr(float(start)), '\n'))
+    return ''.join((','.join([str(round(value, 2)) for value in np.asarray(values).tolist()]), ':', formatValue(start), '\n'))
+
+"""
+Writes the additional data of a filtered waveform as a .csv line
+"""
+def formatData(data):
+    if len(data) == 0:
+        return ''
+    return ''.join((','.join([formatValue(value) for value in data]), '\n'))
+
+"""
+Splits the waveforms of a file into chunks of (byte offset, number of waveforms)
+The last line offset belongs to the filters applied line, which is not part of any chunk
+"""
+def splitChunks(lineOffsets, size = chunkSize):
+    chunks = list()
+    for n in range(0, len(lineOffsets)-1, size):
+        chunks.append((int(lineOffsets[n]), min(size, len(lineOffsets)-1-n)))
+    return chunks
+
+"""
+Applies filterType, with any parameters it is named with, to a list of (values, start) waveforms
+Uses the filter's batch implementation when it has one, and applies it one waveform at a time otherwise
+Returns a list of (values, start, additional data)
+"""
+def applyFilter(records, filterType, requestData = False):
+    if len(records) == 0:
+        return list()
+    filterType, parameters = parseFilter(filterType)
+    filterType = findFilter(filterType)
+    if filterType.batch != None:
+        block = BatchAnalysis([record[0] for record in records])
+        starts = np.array([record[1] for record in records], dtype = np.float64)
+        values, lengths, starts, data = filterType.batch(block, starts, requestData, **parameters)
+        return [(values[n, :lengths[n]], starts[n], data[n].tolist()) for n in range(len(records))]
+    results = list()
+    for values, start in records:
+        results.append(filterType.single(Analysis(values), start, requestData, **parameters))
+    return results
+
+"""
+Applies the filters of chain in turn to a list of (values, start) waveforms, passing each filter's output to the next
+Waveforms a filter returns no values for are dropped from the rest of the chain, as they are from a filtered file
+requests holds, for every filter of chain, whether its additional data is wanted
+Returns a list of the results of every filter, each a list of (values, start, additional data)
+"""
+def applyChain(records, chain, requests):
+    stages = list()
+    for filterType, requestData in zip(chain, requests):
+        results = applyFilter(records, filterType, requestData)
+        stages.append(results)
+        records = [(values, start) for values, start, data in results if len(values) != 0]
+    return stages
+
+"""
+Applies chain to an iterable of (values, start) waveforms, size waveforms at a time
+writes holds, for every filter of chain, whether its database lines, its .csv lines and its exact database lines are wanted
+Yields the database lines, the .csv lines and the exact database lines of every filter, and the number of waveforms of each block
+"""
+def filterRecords(records, chain, writes, size = chunkSize):
+    records = iter(records)
+    while True:
+        block = list(islice(records, size))
+        if len(block) == 0:
+            return
+        stageLines, stageDataLines, stageExactLines = list(), list(), list()
+        for results, (writeLines, writeData, writeExact) in zip(applyChain(block, chain, [write[1] for write in writes]), writes):
+            lines, dataLines, exactLines = list(), list(), list()
+            for values, start, data in results:
+                if writeLines:
+                    lines.append(formatRecord(values, start))
+                if writeData:
+                    dataLines.append(formatData(data))
+                if writeExact:
+                    exactLines.append(formatRecord(values, start, True))
+            stageLines.append(''.join(lines))
+            stageDataLines.append(''.join(dataLines))
+            stageExactLines.append(''.join(exactLines))
+        yield stageLines, stageDataLines, stageExactLines, len(block)
+
+"""
+Reads count waveforms from sourcePath, starting at the byte offset, and applies chain to them,
+with the templates of the files at templates and the LogAmp tables of the files at tables in use
+Returns the database lines, the .csv lines and the exact database lines of every filter, and the number of waveforms of the chunk
+Run by the worker processes
+"""
+def filterChunk(sourcePath, offset, count, chain, writes, templates = tuple(), tables = tuple()):
+    Templates.useTemplates(templates)
+    Calibration.useTables(tables)
+    openedFile = open(sourcePath, 'rb', bufferSize)
+    openedFile.seek(offset)
+    result = next(filterRecords(RecordReader(openedFile, count), chain, writes, count))
+    openedFile.close()
+    return result
+
+"""
+Applies chain to a list of (values, start) waveforms
+writes holds, for every filter of chain, whether its database lines and its .csv lines are wanted
+Returns, for every waveform, its database line and .csv line for every filter they are wanted for, in chain order,
+with empty lines for filters the waveform was dropped before
+"""
+def findRecordLines(records, chain, writes):
+    recordLines = [list() for record in records]
+    alive = range(len(records))
+    for results, (writeLines, writeData) in zip(applyChain(records, chain, [write[1] for write in writes]), writes):
+        written = dict(zip(alive, results))
+        for n in range(len(records)):
+            values, start, data = written.get(n, (tuple(), 0, tuple()))
+            if writeLines:
+                recordLines[n].append(formatRecord(values, start))
+            if writeData:
+                recordLines[n].append(formatData(data))
+        alive = [n for n, (values, start, data) in zip(alive, results) if len(values) != 0]
+    return recordLines
+
+"""
+Reads the waveforms of sourcePath starting at the byte offsets, and applies chain to them,
+with the templates of the files at templates and the LogAmp tables of the files at tables in use
+Returns the lines of every waveform, as findRecordLines does
+Run by the worker processes
+"""
+def filterRecordsAt(sourcePath, offsets, chain, writes, templates = tuple(), tables = tuple()):
+    Templates.useTemplates(templates)
+    Calibration.useTables(tables)
+    openedFile = open(sourcePath, 'rb', bufferSize)
+    records = list()
+    for offset in offsets:
+        openedFile.seek(offset)
+        records.append(parseRecord(openedFile.readline()))
+    openedFile.close()
+    return findRecordLines(records, chain, writes)
+
+"""
+Filters chunks in a pool of worker processes, yielding their results in order
+At most two chunks per process are in flight, so finished chunks cannot pile up waiting to be written
+"""
+def filterChunksParallel(sourcePath, chunks, chain, writes, workers, templates = tuple(), tables = tuple()):
+    executor = ProcessPoolExecutor(max_workers = workers)
+    pending = deque()
+    try:
+        for offset, count in chunks:
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(filterChunk, sourcePath, offset, count, chain, writes, templates, tables))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown()
+
+"""
+Applies the filters of chain in turn to every waveform of the database file at sourcePath,
+whose line offsets are lineOffsets
+outputs holds, for every filter of chain, (savePath, dataPath, dataColumns) or (savePath, dataPath, dataColumns, exactPath):
+the filter's output is written to savePath, its additional data to dataPath as a .csv with a header of dataColumns,
+and its output unrounded to exactPath, each skipped when None
+workers sets the number of processes used, defaulting to one per core, and progress is called with
+(waveforms done, total waveforms) as blocks finish
+templates holds the paths of the template files christmas trees are cross-covaried against besides the standard one,
+and tables the paths of the Calibration tables LogAmp can be given besides the standard one
+A single process streams the file through one buffered handle; several processes each read whole chunks
+Either way the filtered files are written a block at a time, and only a bounded number of blocks is held in memory
+The files are written as (path).partial and checkpointed as blocks finish, and only replace the old files once done;
+a job stopped partway carries on from its last checkpoint if it is run again on the same unchanged file
+"""
+def runFilterChain(sourcePath, lineOffsets, chain, outputs, workers = None, progress = None, templates = tuple(), tables = tuple()):
+    if workers == None:
+        workers = cpu_count()
+    Templates.useTemplates(templates)
+    Calibration.useTables(tables)
+    paths = list()
+    for output in outputs:
+        paths.extend([path for path in output[:2]+output[3:4] if path != None])
+    checkpoint = Checkpoint(paths, ResultCache.findFileKey(sourcePath, chain), buffering = bufferSize)
+    done = checkpoint.start()
+    chunks = splitChunks(lineOffsets[done:])
+    tracker = Progress(progress, len(lineOffsets)-1)
+    openedFiles = iter(checkpoint.files)
+    saveFiles, dataFiles, exactFiles, writes = list(), list(), list(), list()
+    for output in outputs:
+        savePath, dataPath, dataColumns = output[:3]
+        saveFile, dataFile, exactFile = None, None, None
+        if savePath != None:
+            saveFile = next(openedFiles)
+        if dataPath != None:
+            dataFile = next(openedFiles)
+            if len(dataColumns) != 0 and not checkpoint.resumed:
+                dataFile.write(''.join((','.join(dataColumns), '\n')))
+        if len(output) > 3 and output[3] != None:
+            exactFile = next(openedFiles)
+        saveFiles.append(saveFile)
+        dataFiles.append(dataFile)
+        exactFiles.append(exactFile)
+        writes.append((saveFile != None, dataFile != None, exactFile != None))
+    sourceFile = open(sourcePath, 'rb', bufferSize)
+    parallel = workers > 1 and len(chunks) > 1
+    if parallel:
+        results = filterChunksParallel(sourcePath, chunks, chain, writes, workers, templates, tables)
+    else:
+        sourceFile.seek(int(lineOffsets[done]))
+        reader = RecordReader(sourceFile)
+        results = filterRecords(reader, chain, writes)
+    for stageLines, stageDataLines, stageExactLines, count in results:
+        for n in range(len(chain)):
+            if saveFiles[n] != None:
+                saveFiles[n].write(stageLines[n])
+            if dataFiles[n] != None:
+                dataFiles[n].write(stageDataLines[n])
+            if exactFiles[n] != None:
+                exactFiles[n].write(stageExactLines[n])
+        done += count
+        if checkpoint.due():
+            checkpoint.save(done)
+        tracker.update(done)
+    if parallel:
+        sourceFile.seek(int(lineOffsets[len(lineOffsets)-1]))
+        filtersApplied = sourceFile.readline()
+    else:
+        filtersApplied = reader.filtersApplied
+    sourceFile.close()
+    for n in range(len(chain)):
+        if filtersApplied != None:
+            filtersApplied = formatFiltersApplied(filtersApplied, chain[n])
+        for openedFile in (saveFiles[n], exactFiles[n]):
+            if openedFile != None and filtersApplied != None:
+                openedFile.write(filtersApplied)
+    checkpoint.finish()
+    tracker.update(done)
+
+"""
+Applies filterType to every waveform of the database file at sourcePath, whose line offsets are lineOffsets,
+and writes the filtered file to savePath
+If dataPath is given, the additional data of every waveform is written to it as a .csv with a header of dataColumns
+workers, progress, templates and tables are as for runFilterChain
+"""
+def runBulkFilter(sourcePath, lineOffsets, filterType, savePath, dataPath = None, dataColumns = tuple(), workers = None, progress = None, templates = tuple(), tables = tuple()):
+    runFilterChain(sourcePath, lineOffsets, [filterType], [(savePath, dataPath, dataColumns)], workers, progress, templates, tables)
@@ -0,0 +1,131 @@
+"""
+LogAmp decompression tables, which give the factor a raw waveform's compressed intensity is multiplied by
+to bring it back to the intensity originally received
+The standard table is always available; tables calibrated for other sensors are read from .txt files in
+calibration or waveform_data/(databaseName)/calibration, hold one table as 'value,value,...,value',
+and are chosen by file name, as 'LogAmp[table=(file name)]'
+"""
+import os
+import numpy as np
+
+"""
+Standard decompression table, indexed by the compressed intensity (0-255)
+"""
+standardLogAmpTable = np.array([0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.617,
+                                0.617,0.617,0.617,0.617,0.617,0.617,0.617,0.644,0.67,0.697,0.723,0.75,0.776,
+                                0.803,0.829,0.856,0.882,0.909,0.936,0.962,0.989,1.015,1.056,1.104,1.152,1.2,
+                                1.248,1.296,1.344,1.393,1.441,1.489,1.537,1.585,1.633,1.681,1.741,1.813,1.885,
+                                1.958,2.03,2.102,2.174,2.246,2.319,2.391,2.463,2.535,2.608,2.68,2.752,2.829,
+                                2.926,3.023,3.12,3.217,3.314,3.411,3.508,3.605,3.702,3.799,3.896,3.993,4.09,
+                                4.187,4.284,4.381,4.478,4.621,4.824,5.026,5.229,5.432,5.634,5.837,6.039,6.242,
+                                6.445,6.647,6.85,7.053,7.255,7.469,7.712,7.956,8.199,8.442,8.685,8.928,9.171,
+                                9.415,9.658,9.901,10.144,10.387,10.63,10.874,11.117,11.36,11.603,11.968,12.414,
+                                12.86,13.306,13.752,14.198,14.644,15.09,15.536,15.982,16.428,16.874,17.32,17.766,
+                                18.212,18.755,19.607,20.46,21.313,22.165,23.018,23.87,24.723,25.576,26.428,
+                                27.281,28.133,28.986,29.89,30.925,31.961,32.997,34.032,35.068,36.103,37.139,
+                                38.174,39.21,40.245,41.281,42.316,43.352,44.387,45.423,47.088,48.811,50.534,
+                                52.256,53.979,55.701,57.424,59.146,60.869,62.591,64.314,66.037,67.759,69.491,
+                                71.494,73.497,75.5,77.503,79.506,81.509,83.512,85.515,87.518,89.521,91.524,
+                                93.527,95.53,97.533,99.536,101.982,104.897,107.811,110.725,113.64,116.554,119.469,
+                                122.383,125.298,128.212,131.126,134.041,136.955,139.87,142.816,145.828,148.841,
+                                151.853,154.866,157.878,160.891,163.903,166.916,169.928,172.941,175.953,178.966,
+                                181.979,184.991,186.214,187.213,188.212,189.211,190.21,191.209,192.207,193.206,
+                                194.205,195.204,196.203,197.202,198.201,199.2,200.198,201.1,201.814,202.528,203.242,
+                                203.956,204.67,205.384,206.098,206.811,207.525,208.125,208.125,208.125,208.125,
+                                208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125,208.125])
+
+calibrationFolder = 'calibration'
+tableExtension = '.txt'
+
+"""
+Ways samples outside a table can be handled:
+clip: they are clipped to the table's range before being decompressed
+flag: they become 0, and the rest of the waveform is decompressed
+reject: the whole waveform becomes [0, 0] starting at 0
+Whichever is used, the number of samples outside the table is reported for every waveform
+"""
+outsideModes = ('clip', 'flag', 'reject')
+
+class LogAmpTable():
+    def __init__(self, name, values):
+        self.name = name
+        self.values = np.asarray(values, dtype = np.float64)
+        self.top = len(self.values)-1
+
+    """
+    Decompresses a waveform, or an (N, samples) block whose rows are the samples in mask
+    Returns the decompressed values, with samples outside the table clipped, or set to 0 if outside is 'flag',
+    and the number of samples outside the table in the waveform or in every row
+    """
+    def decompress(self, values, outside = 'clip', mask = None):
+        values = np.asarray(values, dtype = np.float64)
+        beyond = (values < 0) | (values > self.top)
+        if mask is not None:
+            beyond &= mask
+        clipped = np.clip(values, 0, self.top)
+        decompressed = clipped*self.values[clipped.astype(int)]
+        if outside == 'flag':
+            decompressed[beyond] = 0
+        return decompressed, beyond.sum(axis = -1)
+
+standardTable = LogAmpTable('standard', standardLogAmpTable)
+
+"""
+Tables read from files, as {path: (modification time, table)}, so that each file is only read once
+"""
+loadedTables = dict()
+
+"""
+Tables LogAmp can be given, as {table name: LogAmpTable}
+"""
+activeTables = {standardTable.name: standardTable}
+
+"""
+Reads a table file, named after the file
+"""
+def readTable(path):
+    mtime = os.path.getmtime(path)
+    if path not in loadedTables or loadedTables[path][0] != mtime:
+        tableFile = open(path)
+        line = tableFile.readline()
+        tableFile.close()
+        values = np.fromstring(line.split(':')[0], dtype = np.float64, sep = ',')
+        if len(values) == 0:
+            raise ValueError('{} holds no table'.format(path))
+        name = os.path.basename(path)
+        loadedTables[path] = (mtime, LogAmpTable(name[:len(name)-len(tableExtension)], values))
+    return loadedTables[path][1]
+
+"""
+Returns the paths of the table files of the root directory and, if given, of a database
+"""
+def findTablePaths(dirName, databaseName = None):
+    folders = [os.path.join(dirName, calibrationFolder)]
+    if databaseName != None:
+        folders.append(os.path.join(dirName, 'waveform_data', databaseName, calibrationFolder))
+    paths = list()
+    for folder in folders:
+        if os.path.isdir(folder):
+            for file in sorted(os.listdir(folder)):
+                if file.endswith(tableExtension):
+                    paths.append(os.path.join(folder, file))
+    return paths
+
+"""
+Makes the standard table and the tables of the files at paths the ones LogAmp can be given,
+a database's tables replacing the root directory's tables of the same name
+"""
+def useTables(paths = tuple()):
+    global activeTables
+    activeTables = {standardTable.name: standardTable}
+    for path in paths:
+        table = readTable(path)
+        activeTables[table.name] = table
+
+"""
+Returns the table named name
+"""
+def findTable(name):
+    if name not in activeTables:
+        raise ValueError('There is no LogAmp table {}'.format(name))
+    return activeTables[name]
@@ -0,0 +1,152 @@
+"""
+Checkpoints of long running bulk jobs, so that a job which is stopped partway carries on where it stopped when run again
+A job writes each of its files as (path).partial, and every checkpointInterval seconds flushes them to disk and records,
+in (first path).ckpt, the number of waveforms done, the length of every file, and any state it needs to carry on
+A job run again with the same key cuts its files back to their checkpointed lengths and carries on from there
+Finished files replace the old ones by renaming, so no file is ever seen half written
+"""
+import os
+import json
+import time
+import hashlib
+
+partialExtension = '.partial'
+checkpointExtension = '.ckpt'
+
+"""
+Minimum number of seconds between two checkpoints of a job
+"""
+checkpointInterval = 30
+
+"""
+Returns the path a file is written to until it is finished
+"""
+def partialPathFor(path):
+    return ''.join((path, partialExtension))
+
+"""
+Returns the path of the checkpoint of a job whose first file is path
+"""
+def checkpointPathFor(path):
+    return ''.join((path, checkpointExtension))
+
+"""
+Replaces path with the file at newPath
+Renaming over a file replaces it in one step, except on Windows, where the old file has to be removed first
+"""
+def replaceFile(newPath, path):
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(newPath, path)
+
+"""
+Writes text to path in one step, so that the file is either left as it was or wholly replaced
+"""
+def writeAtomic(path, text):
+    openedFile = open(partialPathFor(path), 'wb')
+    openedFile.write(text)
+    openedFile.flush()
+    os.fsync(openedFile.fileno())
+    openedFile.close()
+    replaceFile(partialPathFor(path), path)
+
+"""
+Returns the key of a job named name, which changes whenever any of the files at paths does or any of values differs
+"""
+def findJobKey(name, paths, values = tuple()):
+    digest = hashlib.sha1(name)
+    for path in paths:
+        digest.update(repr((os.path.realpath(path), os.path.getsize(path), os.path.getmtime(path))))
+    for value in values:
+        digest.update(value)
+    return digest.hexdigest()
+
+"""
+Checkpoints of a job writing the files at paths, which only carries on from a checkpoint saved under the same key
+Files are opened with mode and buffering as open takes them
+"""
+class Checkpoint():
+    def __init__(self, paths, key, interval = checkpointInterval, mode = 'w', buffering = -1):
+        self.paths = list(paths)
+        self.partialPaths = [partialPathFor(path) for path in self.paths]
+        self.path = checkpointPathFor(self.paths[0])
+        self.key = key
+        self.interval = interval
+        self.mode = mode
+        self.buffering = buffering
+        self.files = list()
+        self.resumed = False
+        self.state = None
+        self.lastSave = 0
+
+    """
+    Returns the last checkpoint saved under the same key, or None if there is none or its files are shorter than it records
+    """
+    def read(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            checkpointFile = open(self.path, 'rb')
+            checkpoint = json.load(checkpointFile)
+            checkpointFile.close()
+        except (IOError, ValueError):
+            return None
+        if checkpoint.get('key') != self.key or checkpoint.get('paths') != [os.path.realpath(path) for path in self.paths]:
+            return None
+        for path, size in zip(self.partialPaths, checkpoint['sizes']):
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                return None
+        return checkpoint
+
+    """
+    Opens the files, cut back to the last checkpoint of the job if there is one, or else empty
+    Returns the number of waveforms done at the checkpoint, after which the job's state is in state
+    """
+    def start(self):
+        checkpoint = self.read()
+        self.resumed = checkpoint != None
+        self.files = list()
+        if not self.resumed:
+            for path in self.partialPaths:
+                self.files.append(open(path, self.mode, self.buffering))
+            self.state = None
+            self.lastSave = time.time()
+            return 0
+        for path, size in zip(self.partialPaths, checkpoint['sizes']):
+            openedFile = open(path, self.mode.replace('w', 'r+'), self.buffering)
+            openedFile.truncate(size)
+            openedFile.seek(0, os.SEEK_END)
+            self.files.append(openedFile)
+        self.state = checkpoint['state']
+        self.lastSave = time.time()
+        return checkpoint['done']
+
+    """
+    Returns whether a checkpoint is due
+    """
+    def due(self):
+        return time.time()-self.lastSave >= self.interval
+
+    """
+    Records that the first done waveforms are finished, with the state the job needs to carry on from them,
+    which must be JSON serialisable
+    The files are flushed to disk first, so a checkpoint never records more than they hold
+    """
+    def save(self, done, state = None):
+        for openedFile in self.files:
+            openedFile.flush()
+            os.fsync(openedFile.fileno())
+        writeAtomic(self.path, json.dumps({'key': self.key, 'paths': [os.path.realpath(path) for path in self.paths],
+                                           'done': done, 'sizes': [openedFile.tell() for openedFile in self.files], 'state': state}))
+        self.lastSave = time.time()
+
+    """
+    Closes the files, replaces the old files with them, and removes the checkpoint
+    """
+    def finish(self):
+        for openedFile in self.files:
+            openedFile.close()
+        for partialPath, path in zip(self.partialPaths, self.paths):
+            replaceFile(partialPath, path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
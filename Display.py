@@ -1,10 +1,49 @@
 import Tkinter as tk
+from collections import OrderedDict
+import numpy as np
 from Analysis import Analysis
+from Filters import runFilter
 scaleDistances = [1, 2, 3, 4, 5, 10, 15, 20, 25, 30, 40, 50, 100, 150, 200, 250, 300, 400, 500, 1000,
                   2000, 3000, 4000, 5000, 10000, 15000, 20000, 25000, 30000, 40000, 50000, 100000, 150000,
                   200000, 250000, 300000, 400000, 500000, 1000000, 1500000, 2000000, 2500000, 3000000,
                   4000000, 5000000, 10000000, 15000000, 20000000, 25000000, 30000000, 40000000, 50000000,
                   1000000000, 150000000, 200000000, 250000000, 300000000, 400000000, 500000000, 10000000000]
+
+"""
+Extrema of the waveforms displayed most recently, as {(length, sampled values): (values, maxima, minima, global maximum)},
+so that undoing, redoing, pasting or reloading a waveform does not search it again
+Holds at most extremaCacheSize waveforms, forgetting the least recently displayed first
+"""
+extremaCache = OrderedDict()
+extremaCacheSize = 32
+
+"""
+Number of values a waveform's cache key is sampled from
+"""
+extremaKeySamples = 64
+
+"""
+Returns the local maxima, local minima and global maximum of an analyser's dataset, searching it only if it is not cached
+Waveforms sharing a key are told apart by comparing their values
+"""
+def findCachedExtrema(analyser):
+    values = analyser.values
+    key = (len(values), values[::max(1, len(values)/extremaKeySamples)].tobytes())
+    if key in extremaCache and np.array_equal(extremaCache[key][0], values):
+        extrema = extremaCache.pop(key)
+    else:
+        extremaCache.pop(key, None)
+        maxima, minima = analyser.findExtrema()
+        if len(values) == 0:
+            maximum = 0
+        else:
+            maximum = analyser.findGlobalExtrema()[0]
+        extrema = (values, maxima, minima, maximum)
+        if len(extremaCache) >= extremaCacheSize:
+            extremaCache.popitem(last = False)
+    extremaCache[key] = extrema
+    return extrema[1:]
+
 class Display():
     def __init__(self, master, windowHeight, windowWidth, winX, winY):
         self.master = master
@@ -303,17 +342,13 @@ class Display():
     """
     def updateWaveformData(self, data):
         self.data = data
-        self.values = data[2]
+        self.analyser = Analysis(data[2], self)
+        self.values = self.analyser.values
         self.start = data[3]
-        self.analyser = Analysis(self.values, self)
-        self.maxima, self.minima = self.analyser.findExtrema()
+        self.maxima, self.minima, maximum = findCachedExtrema(self.analyser)
         self.waveType = data[0]
         self.waveNum = data[1]
         self.filtersApplied = data[4]
-        try:
-            maximum = self.analyser.findGlobalExtrema()[0]
-        except ValueError:
-            maximum = 0
         self.graphHeight = 1.25*self.values[maximum]
         self.zoomLevel = 1
         self.bL = [0, 0]
@@ -329,12 +364,25 @@ class Display():
 
     """
     Portal to analyser for applying single filters
-    """
-    def applyFilter(self, filterName):
-        returnedValues = list()
-        exec('returnedValues = self.analyser.apply{}(self.start, True)'.format(filterName))
+    If a ResultCache.ResultCache and key are given, results are kept in it with the highlights the filter added,
+    so filtering the same waveform the same way again only reads them back
+    """
+    def applyFilter(self, filterName, cache = None, key = None):
+        cached = None
+        if cache != None:
+            cached = cache.load(key)
+        if cached == None:
+            highlights = (len(self.hPoints), len(self.hLines), len(self.hLinesRaw))
+            returnedValues = runFilter(self.analyser, filterName, self.start, True)
+            cached = (returnedValues, self.hPoints[highlights[0]:], self.hLines[highlights[1]:], self.hLinesRaw[highlights[2]:])
+            if cache != None:
+                cache.store(key, cached)
+        else:
+            self.hPoints.extend(cached[1])
+            self.hLines.extend(cached[2])
+            self.hLinesRaw.extend(cached[3])
         self.updateWaveform()
-        return returnedValues
+        return cached[0]
 
     """
     Overlays another waveform onto the primary waveform
@@ -0,0 +1,223 @@
+"""
+The filters which can be applied to waveforms, and the rules for which of them can follow one another
+Every filter is registered once, with what it requires and excludes, its additional data, its parameters,
+and the functions that apply it, and is called directly through the registry
+Filters with parameters are named as 'filter[parameter=value;parameter=value]', and are recorded that way,
+with every parameter, in the filters applied line
+New filters are added by calling registerFilter when their module is imported
+"""
+from collections import OrderedDict
+from Analysis import Analysis, BatchAnalysis
+from Calibration import findTable, outsideModes
+from Templates import findTemplateColumns
+
+"""
+A filter which can be applied to waveforms
+
+name: filter name
+          e.g.-Lowpass
+requires: tuples of filters, all of one of which must have been applied in order to apply filter
+          e.g.-Christmas_Tree filter requires a waveform filtered with a Bottomreturn_Isolation or a Raw_Bottomreturn_Isolation
+excludes: filters which cannot have been applied in order to apply filter
+          e.g.-Bottomreturn_Isolation filter requires a waveform which has not been filtered with a Bottomreturn_Isolation
+dataColumns: names of datatypes stored in a .csv file if, when bulk filtering, additional data is stored
+parameters: (parameter name, default value) of every parameter of the filter, in the order they are recorded
+single: function(analyser, start, requestData, **parameters) applying the filter to the dataset of an Analysis,
+        returning its values, start and additional data
+batch: function(block, starts, requestData, **parameters) applying the filter to a whole BatchAnalysis block,
+       returning its values, lengths, starts and additional data, or None if the filter has no batch implementation
+check: function(parameters) raising a ValueError for parameters the filter cannot take, or None
+cost: rough time the filter takes per waveform, relative to a Derivative
+"""
+class Filter():
+    def __init__(self, name, requires, excludes, dataColumns, parameters, single, batch, check, cost):
+        self.name = name
+        self.requires = tuple([frozenset(required) for required in requires])
+        self.excludes = frozenset(excludes)
+        self.dataColumns = tuple(dataColumns)
+        self.parameters = tuple(parameters)
+        self.single = single
+        self.batch = batch
+        self.check = check
+        self.cost = cost
+
+    """
+    Returns whether the filter can be applied to a waveform that has had the set of filter names applied applied
+    """
+    def canFollow(self, applied):
+        if not applied.isdisjoint(self.excludes):
+            return False
+        for required in self.requires:
+            if required <= applied:
+                return True
+        return False
+
+"""
+Registered filters, as {filter name: Filter}, in the order they are offered
+"""
+filterRegistry = OrderedDict()
+
+"""
+Names of the filters which can follow each set of filters applied, as {frozenset of filter names: list of filter names}
+"""
+availableFilters = dict()
+
+"""
+Registers a filter, replacing any filter of the same name
+single and batch default to the Analysis and BatchAnalysis methods 'apply' + name, batch to None if there is none
+Returns the Filter
+"""
+def registerFilter(name, requires = (tuple(),), excludes = tuple(), dataColumns = tuple(), parameters = tuple(), single = None, batch = None, check = None, cost = 1):
+    if single == None:
+        single = getattr(Analysis, 'apply{}'.format(name))
+    if batch == None:
+        batch = getattr(BatchAnalysis, 'apply{}'.format(name), None)
+    filterRegistry[name] = Filter(name, requires, excludes, dataColumns, parameters, single, batch, check, cost)
+    availableFilters.clear()
+    return filterRegistry[name]
+
+"""
+Returns the registered filter named name
+"""
+def findFilter(name):
+    if name not in filterRegistry:
+        raise ValueError('There is no filter {}'.format(name))
+    return filterRegistry[name]
+
+"""
+Checks the parameters of a Butterworth filter: an order of at least 1, and frequencies between 0 and 1
+"""
+def checkButterworth(parameters):
+    for key in parameters:
+        if key == 'order' and parameters[key] < 1:
+            raise ValueError('Butterworth filters need an order of at least 1')
+        if key != 'order' and not 0 < parameters[key] < 1:
+            raise ValueError('Butterworth filters need a {} between 0 and 1'.format(key))
+    if 'low' in parameters and parameters['low'] >= parameters['high']:
+        raise ValueError('Bandpass filters need a low below their high')
+
+"""
+Checks the parameters of LogAmp: a table in use, and one of the ways of handling samples outside it
+"""
+def checkLogAmp(parameters):
+    findTable(parameters['table'])
+    if parameters['outside'] not in outsideModes:
+        raise ValueError('LogAmp handles samples outside its table by {}, not {}'.format(', '.join(outsideModes), parameters['outside']))
+
+registerFilter('Lowpass', excludes = ['Christmas_Tree'], parameters = (('order', 5), ('cutoff', .1)), check = checkButterworth, cost = 4)
+registerFilter('Highpass', excludes = ['Christmas_Tree'], parameters = (('order', 5), ('cutoff', .1)), check = checkButterworth, cost = 4)
+registerFilter('Bandpass', excludes = ['Christmas_Tree'], parameters = (('order', 5), ('low', .05), ('high', .2)), check = checkButterworth, cost = 4)
+registerFilter('Raw_Bottomreturn_Isolation', excludes = ('LogAmp', 'Bottomreturn_Isolation', 'Raw_Bottomreturn_Isolation', 'Derivative'),
+               dataColumns = ('BR peak', 'BR length', 'Leading Edge'), cost = 30)
+registerFilter('Bottomreturn_Isolation', requires = [['Noise_Reduction']], excludes = ('Bottomreturn_Isolation', 'Raw_Bottomreturn_Isolation', 'Derivative'),
+               dataColumns = ('BR peak', 'BR length', 'Leading Edge'), cost = 20)
+registerFilter('Christmas_Tree', requires = [['Bottomreturn_Isolation'], ['Raw_Bottomreturn_Isolation']], excludes = ('Christmas_Tree', 'Derivative'),
+               dataColumns = ('CT peak', 'CT length', 'XRCOV', 'slope left', 'slope right', 'R2 left', 'R2 right'), cost = 20)
+registerFilter('LogAmp', excludes = ('Bottomreturn_Isolation', 'Christmas_Tree', 'Lowpass', 'Highpass', 'Bandpass', 'Derivative', 'LogAmp'),
+               dataColumns = ('Outside table',), parameters = (('table', 'standard'), ('outside', 'reject')), check = checkLogAmp)
+registerFilter('Noise_Reduction', excludes = ('Bottomreturn_Isolation', 'Christmas_Tree', 'Derivative'), cost = 2)
+registerFilter('Derivative')
+registerFilter('None')
+registerFilter('Increase')
+
+"""
+Returns the name of a filter, without its parameters
+"""
+def findFilterName(filterType):
+    return filterType.split('[')[0]
+
+"""
+Reads a filter named as 'filter' or 'filter[parameter=value;parameter=value]'
+Returns the filter's name and a dictionary of every one of its parameters, those left out taking their defaults
+Raises a ValueError for parameters the filter does not have or values it cannot take
+"""
+def parseFilter(filterType):
+    name = findFilterName(filterType)
+    parameters = dict()
+    if name in filterRegistry:
+        parameters = dict(filterRegistry[name].parameters)
+    if '[' in filterType:
+        if not filterType.endswith(']'):
+            raise ValueError('{} is missing a ]'.format(filterType))
+        for setting in filterType[len(name)+1:len(filterType)-1].split(';'):
+            if len(setting) == 0:
+                continue
+            key, equals, value = setting.partition('=')
+            if key not in parameters:
+                raise ValueError('{} has no parameter {}'.format(name, key))
+            try:
+                parameters[key] = type(parameters[key])(value)
+            except ValueError:
+                raise ValueError('{} is not a valid {} for {}'.format(value, key, name))
+    if name in filterRegistry and filterRegistry[name].check != None:
+        filterRegistry[name].check(parameters)
+    return name, parameters
+
+"""
+Names a filter with every one of its parameters, or with its name alone if it takes none
+"""
+def formatFilter(name, parameters):
+    if name not in filterRegistry or len(filterRegistry[name].parameters) == 0:
+        return name
+    return '{}[{}]'.format(name, ';'.join(['{}={}'.format(key, parameters[key]) for key, default in filterRegistry[name].parameters]))
+
+"""
+Returns the names of the filters which can be applied to a waveform that has had filtersApplied applied
+Each set of filters applied is only checked against the registry once
+"""
+def findAvailableFilters(filtersApplied):
+    applied = frozenset([findFilterName(filterType) for filterType in filtersApplied])
+    if applied not in availableFilters:
+        availableFilters[applied] = [filterType.name for filterType in filterRegistry.values() if filterType.canFollow(applied)]
+    return list(availableFilters[applied])
+
+"""
+Returns the names of the datatypes stored in a .csv file when bulk filtering with filterType
+Filters with an XRCOV also store one for every other template in use
+"""
+def findDataColumns(filterType):
+    filterType = findFilterName(filterType)
+    dataColumns = tuple()
+    if filterType in filterRegistry:
+        dataColumns = filterRegistry[filterType].dataColumns
+    if 'XRCOV' in dataColumns:
+        dataColumns += findTemplateColumns()
+    return dataColumns
+
+"""
+Applies filterType, with any parameters it is named with, to the dataset of an Analysis
+Returns the filtered values, their start and their additional data
+"""
+def runFilter(analyser, filterType, start, requestData = False):
+    name, parameters = parseFilter(filterType)
+    return findFilter(name).single(analyser, start, requestData, **parameters)
+
+"""
+Returns the filters applied line that follows the waveforms of a file which has had filterType applied
+"""
+def formatFiltersApplied(line, filterType):
+    if filterType == 'None':
+        return line
+    filterType = formatFilter(*parseFilter(filterType))
+    data = line.split(',')
+    written = False
+    output = list()
+    for m in range(len(data)):
+        if data[m] == filterType:
+            written = True
+        if data[m] != 'None':
+            output.append(''.join((data[m], ',')))
+    if not written:
+        output.append(filterType)
+    return ''.join(output)
+
+"""
+Checks that every filter of chain can be applied after the ones before it, starting from the filters applied line
+Raises a ValueError naming the first filter which cannot, or whose parameters are not valid
+"""
+def checkFilterChain(filtersApplied, chain):
+    for filterType in chain:
+        parseFilter(filterType)
+        if findFilterName(filterType) not in findAvailableFilters(filtersApplied.split(',')):
+            raise ValueError('{} cannot be applied after {}'.format(filterType, filtersApplied))
+        filtersApplied = formatFiltersApplied(filtersApplied, filterType)
@@ -0,0 +1,408 @@
+"""
+Batch processing of waveform databases without a display
+Sorts and ingests raw files, runs filter chains, writes additional data .csvs, builds density profiles,
+and trains, cross-validates and runs support vector machines, using only modules which do not import Tkinter
+
+Usable as a library, or from the command line:
+    python Headless.py [--root dir] setup
+    python Headless.py [--root dir] databases
+    python Headless.py [--root dir] filter database layer Noise_Reduction,Bottomreturn_Isolation,Christmas_Tree saveName
+        [--data] [--workers n] [--keep 1,2] [--templates template.txt,template.txt] [--tables sensor.txt,sensor.txt]
+        [--cache] [--cache-limit MB] [--incremental]
+    python Headless.py [--root dir] filter database layer "Bandpass[order=4;low=0.02;high=0.3]" saveName
+    python Headless.py [--root dir] filter database raw_data "LogAmp[table=sensor;outside=clip]" saveName --data
+    python Headless.py [--root dir] density database layer
+    python Headless.py [--root dir] svm sampleDatabase sampleFile database outputName --features "file.csv:column,column" [--workers n] [--model name] [--no-cache]
+        [--backend rbf|linear|sgd|nystroem|forest] [--max-samples n] [--balanced]
+    python Headless.py [--root dir] search sampleDatabase sampleFile name --features "file.csv:column,column" [--backend rbf [--backend forest]]
+        [--folds 5] [--random n] [--min-columns n] [--workers n] [--max-samples n] [--balanced] [--no-cache]
+    python Headless.py [--root dir] models
+    python Headless.py [--root dir] classify model database outputName [--workers n] [--no-cache]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import BulkFilter
+import Calibration
+import Checkpoint
+import Incremental
+import Ingest
+import ModelSelection
+import ResultCache
+import SvmModel
+import Templates
+from Filters import checkFilterChain, findDataColumns, findFilterName
+from WaveformStore import LineIndex, RecordReader
+
+moduleDirName = os.path.realpath(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Most bytes an unrounded value or start takes in a layer, with the comma, colon or line end after it
+"""
+exactValueSize = 25
+
+"""
+Makes the SVM and waveform_data folders of a root directory, and turns every raw .txt in it into a new database
+Returns the names of the databases
+"""
+def setupFileSorting(dirName):
+    for folder in (('SVM',), ('SVM', 'formulae'), ('SVM', 'samples'), ('SVM', 'returns'), ('waveform_data',)):
+        if not os.path.exists(os.path.join(dirName, *folder)):
+            os.makedirs(os.path.join(dirName, *folder))
+    for file in os.listdir(dirName):
+        if file.endswith('.txt'):
+            databaseName = file[:len(file) - 4]
+            if os.path.exists(os.path.join(dirName, 'waveform_data', databaseName)):
+                n = 0
+                while os.path.exists(os.path.join(dirName, 'waveform_data', '_'.join((file[:len(file) - 4], str(n))))):
+                    n+=1
+                databaseName = '_'.join((file[:len(file) - 4], str(n)))
+            os.makedirs(os.path.join(dirName, 'waveform_data', databaseName))
+            os.makedirs(os.path.join(dirName, 'waveform_data', databaseName, 'additional_data'))
+            os.makedirs(os.path.join(dirName, 'SVM', 'samples', databaseName))
+            processRaw(os.path.join(dirName, file), os.path.join(dirName, 'waveform_data', databaseName, 'raw_data.txt'))
+    return findDatabases(dirName)
+
+"""
+Processes raw .txt data files by spliting the lines by commas,
+removing the first two elements, and appending a :0 to each line,
+which signifies that the waveform's start is offset by 0 nanoseconds
+The file is streamed and converted in parallel by Ingest, which also saves the new file's line index
+"""
+def processRaw(oldPath, newPath):
+    records, size, seconds = Ingest.runIngest(oldPath, newPath)
+    print ' '.join((os.path.basename(oldPath), Ingest.formatThroughput(records, size, seconds)))
+    os.remove(oldPath)
+
+def findDatabases(dirName):
+    return list(os.listdir(os.path.join(dirName, 'waveform_data')))
+
+"""
+Returns the layers of a database, as a dictionary of {layer name: path of its .txt}
+"""
+def openDatabase(dirName, databaseName):
+    database = dict()
+    for file in os.listdir(os.path.join(dirName, 'waveform_data', databaseName)):
+        if file.endswith('.txt'):
+            database[file[:len(file) - 4]] = os.path.join(dirName, 'waveform_data', databaseName, file)
+    return database
+
+"""
+Returns the path of the .txt of the layer dataType of a database
+"""
+def findLayer(dirName, databaseName, dataType):
+    database = openDatabase(dirName, databaseName)
+    if dataType not in database:
+        raise ValueError('{} has no layer {}'.format(databaseName, dataType))
+    return database[dataType]
+
+"""
+Returns the filters applied line of a database file
+"""
+def readFiltersApplied(path, lineOffsets = None):
+    if lineOffsets is None:
+        lineOffsets = LineIndex(path).offsets
+    openedFile = open(path, 'rb')
+    openedFile.seek(int(lineOffsets[len(lineOffsets)-1]))
+    line = openedFile.readline()
+    openedFile.close()
+    return line
+
+"""
+Applies the filters of chain to the layer dataType of a database as one job, each waveform passing through
+every filter in memory without being rounded in between
+Filters may be named with parameters, as 'Lowpass[order=5;cutoff=0.1]'
+The last filter's output is saved as the layer saveName; earlier filters' outputs are only saved, as
+(saveName)_(step)_(filter name), for the steps, numbered from 1, in keep
+If storeData is set, filters with additional data write it to additional_data/(layer)_data.csv,
+whether or not their layer is saved
+templates holds the paths of the template files christmas trees are cross-covaried against besides the standard one,
+defaulting to those of the SVM directory and the database
+tables holds the paths of the Calibration tables LogAmp can be given besides the standard one,
+defaulting to those of the calibration folders of the root directory and the database
+workers and progress are passed on to BulkFilter.runFilterChain
+cache is a ResultCache.ResultCache to use, or None, the default, to use none
+The layers and additional data written are linked into the cache, along with the unrounded output of every step
+but the last, which is only written if it would fit in the cache;
+a chain whose first steps were run on the same layer before starts from the last of them which is cached,
+and only runs the steps after it, so its results are the same as if it had run in full
+If incremental is set, the cache is not used; instead the layers are refiltered in place, only filtering the waveforms
+which are new or have changed since they were last written incrementally, and an unfinished run carries on where it stopped
+Returns the names of the layers written
+"""
+def runFilterChain(dirName, databaseName, dataType, chain, saveName, storeData = False, workers = None, progress = None, keep = tuple(), templates = None, cache = None, incremental = False, tables = None):
+    databasePath = os.path.join(dirName, 'waveform_data', databaseName)
+    sourcePath = findLayer(dirName, databaseName, dataType)
+    if templates == None:
+        templates = Templates.findTemplatePaths(dirName, databaseName)
+    Templates.useTemplates(templates)
+    if tables == None:
+        tables = Calibration.findTablePaths(dirName, databaseName)
+    Calibration.useTables(tables)
+    lineOffsets = LineIndex(sourcePath).offsets
+    checkFilterChain(readFiltersApplied(sourcePath, lineOffsets), chain)
+    layers, outputs = list(), list()
+    for n in range(len(chain)):
+        if n == len(chain)-1:
+            layerName = saveName
+        else:
+            layerName = '_'.join((saveName, str(n+1), findFilterName(chain[n])))
+        savePath, dataPath, dataColumns = None, None, findDataColumns(chain[n])
+        if n == len(chain)-1 or n+1 in keep:
+            savePath = '.'.join((os.path.join(databasePath, layerName), 'txt'))
+            layers.append(layerName)
+        if storeData and len(dataColumns) != 0:
+            dataPath = '.'.join((os.path.join(databasePath, 'additional_data', '{}_data'.format(layerName)), 'csv'))
+        outputs.append((savePath, dataPath, dataColumns))
+    if incremental:
+        Incremental.runIncrementalChain(sourcePath, lineOffsets, chain, outputs, workers, progress, templates, tables)
+        return layers
+    if cache == None:
+        BulkFilter.runFilterChain(sourcePath, lineOffsets, chain, outputs, workers, progress, templates, tables)
+        return layers
+    keys = [ResultCache.findFileKey(sourcePath, chain[:n+1]) for n in range(len(chain))]
+    done = findCachedSteps(cache, keys, outputs)
+    for n in range(done):
+        for path, suffix in zip(outputs[n][:2], ('txt', 'csv')):
+            if path != None:
+                ResultCache.linkFile(cache.get('.'.join((keys[n], suffix))), path)
+    if done == len(chain):
+        if progress != None:
+            progress(len(lineOffsets)-1, len(lineOffsets)-1)
+        return layers
+    if done != 0:
+        sourcePath = cache.get('.'.join((keys[done-1], 'exact')))
+        lineOffsets = LineIndex(sourcePath).offsets
+    keepExact = len(chain)-done > 1 and cache.fits(findExactSize(sourcePath, lineOffsets))
+    runOutputs = list()
+    for n in range(done, len(chain)):
+        exactPath = None
+        if n != len(chain)-1 and keepExact:
+            exactPath = cache.tempPathFor('.'.join((keys[n], 'exact')))
+        runOutputs.append(outputs[n]+(exactPath,))
+    BulkFilter.runFilterChain(sourcePath, lineOffsets, chain[done:], runOutputs, workers, progress, templates, tables)
+    for n in range(done, len(chain)):
+        for path, suffix in zip((runOutputs[n-done][0], runOutputs[n-done][1], runOutputs[n-done][3]), ('txt', 'csv', 'exact')):
+            if path != None:
+                cache.add('.'.join((keys[n], suffix)), path)
+    return layers
+
+"""
+Returns the most bytes an unrounded layer filtered from the database file at path, whose line offsets are lineOffsets, can take,
+as filters never lengthen waveforms
+"""
+def findExactSize(path, lineOffsets):
+    openedFile = open(path, 'rb', BulkFilter.bufferSize)
+    values = 2*(len(lineOffsets)-1)
+    remaining = int(lineOffsets[len(lineOffsets)-1])
+    while remaining > 0:
+        block = openedFile.read(min(remaining, BulkFilter.bufferSize))
+        if len(block) == 0:
+            break
+        values += block.count(',')
+        remaining -= len(block)
+    openedFile.close()
+    return values*exactValueSize
+
+"""
+Returns the number of steps at the start of a chain whose outputs are all cached under keys:
+the layers and additional data asked for by outputs for every one of them and, unless they are the whole chain,
+the unrounded layer of the last of them, which the rest of the chain starts from
+"""
+def findCachedSteps(cache, keys, outputs):
+    for done in range(len(keys), 0, -1):
+        names = list()
+        if done != len(keys):
+            names.append('.'.join((keys[done-1], 'exact')))
+        for n in range(done):
+            for path, suffix in zip(outputs[n][:2], ('txt', 'csv')):
+                if path != None:
+                    names.append('.'.join((keys[n], suffix)))
+        if all([os.path.exists(cache.pathFor(name)) for name in names]):
+            return done
+    return 0
+
+"""
+Sums the values of every waveform of a database file at each sample time, each waveform placed at its own start
+Starts between samples are rounded to the nearest sample
+Returns the sums and the time of the first of them
+If a Checkpoint.Checkpoint is given, the sums so far are checkpointed, and carried on from its last checkpoint
+"""
+def findDensity(path, checkpoint = None):
+    density = np.zeros(0)
+    densityStart = None
+    openedFile = open(path, 'rb', BulkFilter.bufferSize)
+    done = 0
+    if checkpoint != None:
+        done = checkpoint.start()
+        if checkpoint.state != None:
+            density = np.array(checkpoint.state[0], dtype = np.float64)
+            densityStart = checkpoint.state[1]
+        openedFile.seek(int(LineIndex(path).offsets[done]))
+    for values, start in RecordReader(openedFile):
+        start = int(round(start))
+        if densityStart == None:
+            densityStart = start
+        if start < densityStart:
+            density = np.concatenate((np.zeros(densityStart-start), density))
+            densityStart = start
+        if len(density) < start-densityStart+len(values):
+            density = np.concatenate((density, np.zeros(start-densityStart+len(values)-len(density))))
+        density[start-densityStart:start-densityStart+len(values)] += values
+        done += 1
+        if checkpoint != None and checkpoint.due():
+            checkpoint.save(done, (density.tolist(), densityStart))
+    openedFile.close()
+    if densityStart == None:
+        densityStart = 0
+    return density.tolist(), densityStart
+
+"""
+Writes the density profile of the layer dataType of a database as the layer (dataType)_density
+The job is checkpointed, and carries on from its last checkpoint if it was stopped
+Returns the path of the new layer
+"""
+def writeDensity(dirName, databaseName, dataType):
+    sourcePath = findLayer(dirName, databaseName, dataType)
+    densityPath = os.path.join(dirName, 'waveform_data', databaseName, '{}_density.txt'.format(dataType))
+    checkpoint = Checkpoint.Checkpoint([densityPath], Checkpoint.findJobKey('Density', [sourcePath]))
+    densityData, densityStart = findDensity(sourcePath, checkpoint)
+    checkpoint.files[0].write(BulkFilter.formatRecord(densityData, densityStart))
+    checkpoint.files[0].write('Density')
+    checkpoint.finish()
+    return densityPath
+
+"""
+Reads a feature choice of the form 'file.csv:column,column' into the dictionary of column numbers used by SvmModel
+"""
+def parseFeatures(dirName, databaseName, choices):
+    usingSets = dict()
+    for choice in choices:
+        fileName, names = choice.split(':', 1)
+        usingSets[fileName] = SvmModel.findColumns(SvmModel.dataPathFor(dirName, databaseName, fileName), names.split(','))
+    return usingSets
+
+"""
+Trains a classifier of the backend named backend on a sample file and classifies every waveform of database with it
+The classifier is saved as the model modelName, defaulting to outputName, and is only trained again
+if that model was trained on another sample file, with other features, or with another backend or subsampling
+maxSamples and balanced are passed on to SvmModel.trainClassifier, and workers and progress to SvmModel.predictDatabase
+Returns the path of the classifications
+"""
+def runSvm(dirName, sampleDatabase, sampleName, databaseName, outputName, usingSets, progress = None, workers = None, modelName = None, backend = 'rbf', maxSamples = None, balanced = False):
+    if modelName == None:
+        modelName = outputName
+    clf, scales = SvmModel.findClassifier(dirName, sampleDatabase, sampleName, usingSets, modelName, backend, maxSamples, balanced)
+    return SvmModel.predictDatabase(dirName, databaseName, usingSets, scales, clf, outputName, progress, workers)
+
+"""
+Reads a comma separated list of step numbers
+"""
+def parseSteps(steps):
+    return [int(step) for step in steps.split(',') if len(step) != 0]
+
+"""
+Reads a comma separated list of paths, or None if there is none
+"""
+def parsePaths(paths):
+    if paths == None:
+        return None
+    return [path for path in paths.split(',') if len(path) != 0]
+
+def printProgress(done, total):
+    sys.stderr.write('\r{}/{}'.format(done, total))
+    if done >= total:
+        sys.stderr.write('\n')
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Processes waveform databases without a display')
+    parser.add_argument('--root', default = moduleDirName, help = 'root directory holding SVM and waveform_data')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.add_parser('setup', help = 'sort the root directory and ingest its raw .txt files')
+    commands.add_parser('databases', help = 'list the databases')
+    filterParser = commands.add_parser('filter', help = 'apply a chain of filters to a layer')
+    filterParser.add_argument('database')
+    filterParser.add_argument('layer')
+    filterParser.add_argument('chain', help = "comma separated filters, applied in order, each optionally with parameters as 'Lowpass[order=5;cutoff=0.1]'")
+    filterParser.add_argument('saveName')
+    filterParser.add_argument('--data', action = 'store_true', help = 'store additional data .csvs')
+    filterParser.add_argument('--workers', type = int, default = None)
+    filterParser.add_argument('--keep', default = '', help = 'comma separated steps, numbered from 1, whose layers are also saved')
+    filterParser.add_argument('--templates', default = None, help = 'comma separated template files, instead of those found in SVM/templates and the database')
+    filterParser.add_argument('--tables', default = None, help = 'comma separated LogAmp table files, instead of those found in calibration and the database')
+    filterParser.add_argument('--cache', action = 'store_true', help = 'use and fill the result cache of the root directory')
+    filterParser.add_argument('--cache-limit', type = float, default = ResultCache.cacheLimit/1e6, help = 'size limit of the result cache, in MB')
+    filterParser.add_argument('--incremental', action = 'store_true', help = 'only filter the waveforms which are new or have changed since the layers were last written with --incremental')
+    densityParser = commands.add_parser('density', help = 'write the density profile of a layer')
+    densityParser.add_argument('database')
+    densityParser.add_argument('layer')
+    svmParser = commands.add_parser('svm', help = 'train a support vector machine and classify a database')
+    svmParser.add_argument('sampleDatabase')
+    svmParser.add_argument('sampleFile')
+    svmParser.add_argument('database')
+    svmParser.add_argument('outputName')
+    svmParser.add_argument('--features', action = 'append', required = True, help = "'file.csv:column,column', repeatable")
+    svmParser.add_argument('--workers', type = int, default = None)
+    svmParser.add_argument('--model', default = None, help = 'name the classifier is saved as in SVM/formulae, defaulting to outputName')
+    svmParser.add_argument('--no-cache', dest = 'cache', action = 'store_false', help = 'do not keep parsed additional data in the result cache')
+    svmParser.add_argument('--backend', choices = SvmModel.classifierBackends.keys(), default = 'rbf', help = 'classifier to train, rbf being the slowest on many samples')
+    svmParser.add_argument('--max-samples', type = int, default = None, help = 'train on a stratified subsample of at most this many samples')
+    svmParser.add_argument('--balanced', action = 'store_true', help = 'train on as many samples of every classification')
+    searchParser = commands.add_parser('search', help = 'cross-validate classifiers over features and parameters, and save the best as a model')
+    searchParser.add_argument('sampleDatabase')
+    searchParser.add_argument('sampleFile')
+    searchParser.add_argument('name', help = 'name of the results table and model saved in SVM/formulae')
+    searchParser.add_argument('--features', action = 'append', required = True, help = "'file.csv:column,column', repeatable")
+    searchParser.add_argument('--backend', dest = 'backends', action = 'append', choices = SvmModel.classifierBackends.keys(), default = None, help = 'classifier to try, repeatable, defaulting to rbf')
+    searchParser.add_argument('--folds', type = int, default = ModelSelection.foldCount)
+    searchParser.add_argument('--random', type = int, default = None, help = 'try this many candidates drawn at random instead of every one')
+    searchParser.add_argument('--min-columns', type = int, default = None, help = 'also try every choice of at least this many of the feature columns')
+    searchParser.add_argument('--workers', type = int, default = None)
+    searchParser.add_argument('--max-samples', type = int, default = None, help = 'cross-validate on a stratified subsample of at most this many samples')
+    searchParser.add_argument('--balanced', action = 'store_true', help = 'cross-validate on as many samples of every classification')
+    searchParser.add_argument('--no-cache', dest = 'cache', action = 'store_false', help = 'do not keep parsed additional data and fold features in the result cache')
+    commands.add_parser('models', help = 'list the saved models')
+    classifyParser = commands.add_parser('classify', help = 'classify a database with a saved model')
+    classifyParser.add_argument('model')
+    classifyParser.add_argument('database')
+    classifyParser.add_argument('outputName')
+    classifyParser.add_argument('--workers', type = int, default = None)
+    classifyParser.add_argument('--no-cache', dest = 'cache', action = 'store_false', help = 'do not keep parsed additional data in the result cache')
+    args = parser.parse_args(argv)
+    try:
+        if args.command in ('svm', 'search', 'classify') and args.cache:
+            SvmModel.useFeatureCache(ResultCache.ResultCache(args.root))
+        if args.command == 'setup':
+            for databaseName in setupFileSorting(args.root):
+                print databaseName
+        elif args.command == 'databases':
+            for databaseName in findDatabases(args.root):
+                print databaseName
+        elif args.command == 'filter':
+            cache = None
+            if args.cache:
+                cache = ResultCache.ResultCache(args.root, int(args.cache_limit*1e6))
+            for layerName in runFilterChain(args.root, args.database, args.layer, args.chain.split(','), args.saveName, args.data, args.workers, printProgress, parseSteps(args.keep), parsePaths(args.templates), cache, args.incremental, parsePaths(args.tables)):
+                print layerName
+        elif args.command == 'density':
+            print writeDensity(args.root, args.database, args.layer)
+        elif args.command == 'svm':
+            usingSets = parseFeatures(args.root, args.sampleDatabase, args.features)
+            print runSvm(args.root, args.sampleDatabase, args.sampleFile, args.database, args.outputName, usingSets, printProgress, args.workers, args.model, args.backend, args.max_samples, args.balanced)
+        elif args.command == 'search':
+            usingSets = parseFeatures(args.root, args.sampleDatabase, args.features)
+            for path in ModelSelection.searchModels(args.root, args.sampleDatabase, args.sampleFile, usingSets, args.name, args.backends or ['rbf'], args.folds,
+                                                    args.random, args.min_columns, args.max_samples, args.balanced, printProgress, args.workers):
+                print path
+        elif args.command == 'models':
+            for modelName in SvmModel.findModels(args.root):
+                print modelName
+        elif args.command == 'classify':
+            print SvmModel.predictWithModel(args.root, args.database, args.model, args.outputName, printProgress, args.workers)
+    except (ValueError, IOError, OSError) as error:
+        parser.error(str(error))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Incremental bulk filtering: refiltering a layer into files written by an earlier incremental run only filters
+the waveforms of the source that are new or have changed, and copies the lines of the rest from the old files
+Every run keeps a provenance file next to its last layer, recording the filters and filter code used,
+the checksum of every source waveform, and the length of the lines each waveform gave in every file written
+The new files are built as (path).partial files, and the provenance of every block is saved as soon as its lines are,
+so a run which is killed carries on from its last block when it is run again
+Provenance layout: magic, header length (uint64), JSON header, then one row of int64 per source waveform:
+its checksum, and the length of its line in every file
+"""
+import os
+import json
+import zlib
+import struct
+from collections import deque
+from itertools import izip
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+import BulkFilter
+import ResultCache
+from Checkpoint import partialPathFor, replaceFile
+from Filters import formatFiltersApplied
+
+provenanceMagic = 'WFPROV01'
+provenanceVersion = 1
+provenanceExtension = '.prov'
+
+"""
+Returns the path of the provenance kept alongside a layer
+"""
+def provenancePathFor(path):
+    return ''.join((path, provenanceExtension))
+
+"""
+Returns the checksum of every waveform line of a database file, ignoring line endings
+"""
+def findRecordChecksums(sourcePath, lineOffsets):
+    checksums = np.zeros(len(lineOffsets)-1, dtype = np.int64)
+    sourceFile = open(sourcePath, 'rb', BulkFilter.bufferSize)
+    for n in range(len(checksums)):
+        checksums[n] = zlib.crc32(sourceFile.readline().rstrip('\r\n')) & 0xffffffff
+    sourceFile.close()
+    return checksums
+
+"""
+Reads a provenance file
+Returns its header and its complete rows, or None for both if it is missing or not a provenance file
+"""
+def readProvenance(path):
+    if not os.path.exists(path):
+        return None, None
+    try:
+        provenanceFile = open(path, 'rb')
+        if provenanceFile.read(len(provenanceMagic)) != provenanceMagic:
+            provenanceFile.close()
+            return None, None
+        headerLength = struct.unpack('<Q', provenanceFile.read(8))[0]
+        header = json.loads(provenanceFile.read(headerLength))
+        rows = np.fromfile(provenanceFile, dtype = '<i8').astype(np.int64)
+        provenanceFile.close()
+        if header['version'] != provenanceVersion:
+            return None, None
+        width = 1+len(header['files'])
+        return header, rows[:len(rows)-len(rows)%width].reshape(-1, width)
+    except (IOError, ValueError, KeyError, struct.error):
+        return None, None
+
+"""
+Starts a provenance file with its header, returning it opened for its rows to be appended
+"""
+def startProvenance(path, header):
+    header = json.dumps(header)
+    provenanceFile = open(path, 'wb')
+    provenanceFile.write(provenanceMagic)
+    provenanceFile.write(struct.pack('<Q', len(header)))
+    provenanceFile.write(header)
+    provenanceFile.flush()
+    return provenanceFile
+
+"""
+Returns whether the files of a provenance header each hold at least the lines of its rows
+"""
+def filesMatch(header, rows, paths):
+    for n in range(len(paths)):
+        if not os.path.exists(paths[n]) or os.path.getsize(paths[n]) < header['starts'][n]+rows[:, n+1].sum():
+            return False
+    return True
+
+"""
+Filters the waveforms of blocks, the lists of the byte offsets of those to filter, in a pool of worker processes,
+yielding their lines in order
+"""
+def filterBlocksParallel(sourcePath, blocks, chain, writes, workers, templates, tables):
+    executor = ProcessPoolExecutor(max_workers = workers)
+    pending = deque()
+    try:
+        for offsets in blocks:
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(BulkFilter.filterRecordsAt, sourcePath, offsets, chain, writes, templates, tables))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown()
+
+"""
+Applies the filters of chain to the database file at sourcePath, whose line offsets are lineOffsets, as
+BulkFilter.runFilterChain does, filtering only the waveforms that are new or have changed since the files of outputs
+were last written by this function with the same filters, filter code, templates and LogAmp tables
+outputs holds, for every filter of chain, (savePath, dataPath, dataColumns), and the last filter must have a savePath,
+next to which the provenance is kept
+workers, progress, templates and tables are as for BulkFilter.runFilterChain
+Returns the number of waveforms filtered and the number whose lines were copied
+"""
+def runIncrementalChain(sourcePath, lineOffsets, chain, outputs, workers = None, progress = None, templates = tuple(), tables = tuple()):
+    if workers == None:
+        workers = cpu_count()
+    BulkFilter.Templates.useTemplates(templates)
+    BulkFilter.Calibration.useTables(tables)
+    paths, headers, writes = list(), list(), list()
+    for savePath, dataPath, dataColumns in outputs:
+        if savePath != None:
+            paths.append(savePath)
+            headers.append('')
+        if dataPath != None:
+            paths.append(dataPath)
+            headers.append('' if len(dataColumns) == 0 else ''.join((','.join(dataColumns), '\n')))
+        writes.append((savePath != None, dataPath != None))
+    starts = [len(header) for header in headers]
+    provenancePath = provenancePathFor(outputs[len(outputs)-1][0])
+    sourceFile = open(sourcePath, 'rb')
+    sourceFile.seek(int(lineOffsets[len(lineOffsets)-1]))
+    filtersApplied = sourceFile.readline()
+    sourceFile.close()
+    header = {'version': provenanceVersion, 'chain': ResultCache.findChainDigest(chain).hexdigest(), 'filtersApplied': filtersApplied,
+              'files': [os.path.realpath(path) for path in paths], 'starts': starts}
+    checksums = findRecordChecksums(sourcePath, lineOffsets)
+    oldHeader, oldRows = readProvenance(provenancePath)
+    if oldHeader == None or oldHeader['chain'] != header['chain'] or oldHeader['files'] != header['files'] or not filesMatch(oldHeader, oldRows, paths):
+        oldRows = np.zeros((0, 1+len(paths)), dtype = np.int64)
+    """
+    Carry on from the blocks of an unfinished run, whose partial files are cut back to the lines of its saved rows
+    """
+    partialHeader, doneRows = readProvenance(partialPathFor(provenancePath))
+    partialPaths = [partialPathFor(path) for path in paths]
+    if partialHeader != header or len(doneRows) > len(checksums) or not filesMatch(header, doneRows, partialPaths) or (doneRows[:, 0] != checksums[:len(doneRows)]).any():
+        doneRows = np.zeros((0, 1+len(paths)), dtype = np.int64)
+    provenanceFile = startProvenance(partialPathFor(provenancePath), header)
+    provenanceFile.write(doneRows.astype('<i8').tobytes())
+    partialFiles = list()
+    for n in range(len(paths)):
+        if len(doneRows) == 0:
+            partialFile = open(partialPaths[n], 'wb')
+            partialFile.write(headers[n])
+        else:
+            partialFile = open(partialPaths[n], 'r+b')
+            partialFile.truncate(starts[n]+doneRows[:, n+1].sum())
+            partialFile.seek(0, os.SEEK_END)
+        partialFiles.append(partialFile)
+    """
+    Waveforms whose checksum matches the old provenance have their lines copied, and the rest are filtered
+    """
+    oldFiles = [open(path, 'rb') for path in paths] if len(oldRows) != 0 else list()
+    oldOffsets = np.cumsum(np.concatenate((np.array([starts]), oldRows[:, 1:]))[:len(oldRows)], axis = 0)
+    reused = (np.arange(len(checksums)) < len(oldRows))
+    reused[:len(oldRows)] &= oldRows[:len(checksums), 0] == checksums[:len(oldRows)]
+    blocks = range(len(doneRows), len(checksums), BulkFilter.chunkSize)
+    toFilter = [[int(lineOffsets[n]) for n in range(start, min(start+BulkFilter.chunkSize, len(checksums))) if not reused[n]] for start in blocks]
+    if workers > 1 and sum([len(offsets) != 0 for offsets in toFilter]) > 1:
+        results = filterBlocksParallel(sourcePath, toFilter, chain, writes, workers, templates, tables)
+    else:
+        results = (BulkFilter.filterRecordsAt(sourcePath, offsets, chain, writes, templates, tables) for offsets in toFilter)
+    tracker = BulkFilter.Progress(progress, len(checksums))
+    filtered = 0
+    for start, recordLines in izip(blocks, results):
+        recordLines = iter(recordLines)
+        stop = min(start+BulkFilter.chunkSize, len(checksums))
+        rows = np.zeros((stop-start, 1+len(paths)), dtype = np.int64)
+        rows[:, 0] = checksums[start:stop]
+        for n in range(start, stop):
+            if reused[n]:
+                lines = list()
+                for m in range(len(paths)):
+                    oldFiles[m].seek(int(oldOffsets[n, m]))
+                    lines.append(oldFiles[m].read(int(oldRows[n, m+1])))
+            else:
+                lines = next(recordLines)
+                filtered += 1
+            for m in range(len(paths)):
+                partialFiles[m].write(lines[m])
+                rows[n-start, m+1] = len(lines[m])
+        for partialFile in partialFiles:
+            partialFile.flush()
+        provenanceFile.write(rows.astype('<i8').tobytes())
+        provenanceFile.flush()
+        tracker.update(stop)
+    for oldFile in oldFiles:
+        oldFile.close()
+    """
+    Finish the layers with their filters applied lines, and replace the old files
+    """
+    m = 0
+    for n in range(len(chain)):
+        filtersApplied = formatFiltersApplied(filtersApplied, chain[n])
+        if outputs[n][0] != None:
+            partialFiles[m].write(filtersApplied)
+        m += writes[n][0]+writes[n][1]
+    for partialFile in partialFiles:
+        partialFile.close()
+    provenanceFile.close()
+    for n in range(len(paths)):
+        replaceFile(partialPaths[n], paths[n])
+    replaceFile(partialPathFor(provenancePath), provenancePath)
+    tracker.update(len(checksums))
+    return filtered, len(checksums)-len(doneRows)-filtered
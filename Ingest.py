@@ -0,0 +1,123 @@
+"""
+Headless ingest of raw instrument .txt files into waveform database files
+Raw lines are 'field,field,value,value,...,value'; database lines drop the first two fields and add a start of 0
+Splits the raw file into byte ranges on line boundaries, converts the ranges in a pool of processes,
+and writes the converted lines in order while recording their line offsets, which are saved as the file's index
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+from BulkFilter import Progress, bufferSize
+from WaveformStore import LineIndex
+
+"""
+Number of bytes of the raw file handed to a process at a time
+"""
+rangeSize = 1 << 24
+
+"""
+Converts a raw line, with or without its line ending, to a database line without a line ending
+"""
+def convertLine(line):
+    fields = line.rstrip('\r\n').split(',', 2)
+    if len(fields) < 3:
+        return ':0'
+    return ''.join((fields[2], ':0'))
+
+"""
+Splits a raw file of size bytes into (byte offset, number of bytes) ranges that start and end on line boundaries
+"""
+def splitRanges(rawPath, size, length = rangeSize):
+    ranges = list()
+    openedFile = open(rawPath, 'rb')
+    start = 0
+    while start < size:
+        openedFile.seek(min(start+length, size)-1)
+        openedFile.readline()
+        end = min(openedFile.tell(), size)
+        ranges.append((start, end-start))
+        start = end
+    openedFile.close()
+    return ranges
+
+"""
+Reads length bytes of a raw file from the byte offset and converts their lines
+Returns the database lines, written with lineEnding, and the length in bytes of each of them
+Run by the worker processes
+"""
+def convertRange(rawPath, offset, length, lineEnding = os.linesep):
+    openedFile = open(rawPath, 'rb')
+    openedFile.seek(offset)
+    lines = openedFile.read(length).split('\n')
+    openedFile.close()
+    if lines[len(lines)-1] == '':
+        lines.pop()
+    lines = [convertLine(line) for line in lines]
+    lengths = np.array([len(line) for line in lines], dtype = np.int64)+len(lineEnding)
+    if len(lines) == 0:
+        return '', lengths
+    return ''.join((lineEnding.join(lines), lineEnding)), lengths
+
+"""
+Converts ranges in a pool of worker processes, yielding their results in order
+At most two ranges per process are in flight, so converted ranges cannot pile up waiting to be written
+"""
+def convertRangesParallel(rawPath, ranges, workers):
+    executor = ProcessPoolExecutor(max_workers = workers)
+    pending = deque()
+    try:
+        for offset, length in ranges:
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(convertRange, rawPath, offset, length))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown()
+
+"""
+Returns a line reporting the number of waveforms and bytes ingested in seconds, per second
+"""
+def formatThroughput(records, size, seconds):
+    seconds = max(seconds, 1e-6)
+    return 'Ingested {0} waveforms ({1:.1f} MB) in {2:.2f} s: {3:.0f} waveforms/s, {4:.1f} MB/s'.format(
+        records, size/1e6, seconds, records/seconds, size/1e6/seconds)
+
+"""
+Converts the raw file at rawPath to a database file at savePath, ending it with a 'None' filters applied line,
+and saves the database file's line index
+workers sets the number of processes used, defaulting to one per core, and progress is called with
+(bytes done, total bytes) as ranges finish
+Returns the number of waveforms, the number of bytes read and the seconds taken
+"""
+def runIngest(rawPath, savePath, workers = None, progress = None):
+    if workers == None:
+        workers = cpu_count()
+    startTime = time.time()
+    size = os.path.getsize(rawPath)
+    ranges = splitRanges(rawPath, size)
+    tracker = Progress(progress, size)
+    if workers > 1 and len(ranges) > 1:
+        results = convertRangesParallel(rawPath, ranges, workers)
+    else:
+        results = (convertRange(rawPath, offset, length) for offset, length in ranges)
+    saveFile = open(savePath, 'wb', bufferSize)
+    lineOffsets = list()
+    written = 0
+    done = 0
+    for n, (lines, lengths) in enumerate(results):
+        saveFile.write(lines)
+        lineOffsets.append(np.cumsum(lengths)-lengths+written)
+        written += len(lines)
+        done += ranges[n][1]
+        tracker.update(done)
+    saveFile.write('None')
+    saveFile.close()
+    lineOffsets.append(np.array([written], dtype = np.int64))
+    lineOffsets = np.concatenate(lineOffsets)
+    LineIndex(savePath, lineOffsets)
+    tracker.update(size)
+    return len(lineOffsets)-1, size, time.time()-startTime
@@ -0,0 +1,258 @@
+"""
+Model selection for SvmModel classifiers, without a display: k-fold cross-validation of every candidate of a grid
+or random search over the chosen feature columns, the classifier backends and their parameters
+The samples are split into stratified folds once, and the feature matrices of the folds are built once for all of the candidates,
+and kept in the SvmModel.featureCache, if there is one, as .npy files which the worker processes memory map
+Every fold of every candidate is fitted and scored in a pool of processes
+The results are written as a table to SVM/formulae/(name).csv, best candidate first, and the best candidate
+is trained on every sample and saved as the model name
+"""
+import os
+import time
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+import Checkpoint
+import SvmModel
+
+resultsExtension = '.csv'
+
+"""
+Number of folds the samples are split into
+"""
+foldCount = 5
+
+"""
+Seed of the split into folds and of random searches
+"""
+searchSeed = 0
+
+"""
+Parameters searched for every backend, as {backend name: OrderedDict of {parameter: values}}
+Grid searches try every combination of the values, and random searches draw parameters whose values are all floats
+log uniformly between the least and greatest of them, and the rest from their values
+"""
+parameterGrids = {'rbf': OrderedDict([('C', [.1, 1., 10., 100.]), ('gamma', [.01, .1, 1., 10.])]),
+                  'linear': OrderedDict([('C', [.01, .1, 1., 10.])]),
+                  'sgd': OrderedDict([('alpha', [1e-5, 1e-4, 1e-3, 1e-2])]),
+                  'nystroem': OrderedDict([('nystroem__gamma', [.01, .1, 1., 10.]), ('linearsvc__C', [.1, 1., 10.])]),
+                  'forest': OrderedDict([('min_samples_leaf', [1, 4, 16]), ('max_features', ['sqrt', 'log2'])])}
+
+"""
+Fold matrices memory mapped by this process, as {path: array}
+"""
+loadedFolds = dict()
+
+"""
+Returns the path of the results table of a search
+"""
+def resultsPathFor(dirName, name):
+    return os.path.join(dirName, 'SVM', SvmModel.formulaeFolder, ''.join((name, resultsExtension)))
+
+"""
+Returns every choice of at least minColumns of the columns of usingSets, as usingSets of their own, most columns first
+minColumns defaults to every column, so that only the columns chosen are tried
+"""
+def findFeatureSubsets(usingSets, minColumns = None):
+    columns = [(key, column) for key in sorted(usingSets.keys()) for column in usingSets[key]]
+    if minColumns == None:
+        minColumns = len(columns)
+    subsets = list()
+    for size in range(len(columns), max(minColumns, 1)-1, -1):
+        for chosen in itertools.combinations(columns, size):
+            subset = OrderedDict([(key, list()) for key in sorted(usingSets.keys())])
+            for key, column in chosen:
+                subset[key].append(column)
+            subsets.append(subset)
+    return subsets
+
+"""
+Returns the candidates of a search, as (usingSets, backend name, {parameter: value})
+Every candidate of the grid over the feature subsets, backends and parameterGrids is tried,
+or, if iterations is given, that many different candidates drawn at random
+"""
+def findCandidates(usingSets, backends, minColumns = None, iterations = None):
+    subsets = findFeatureSubsets(usingSets, minColumns)
+    if iterations == None:
+        return [(subset, backend, dict(zip(parameterGrids[backend].keys(), values))) for subset in subsets for backend in backends
+                for values in itertools.product(*parameterGrids[backend].values())]
+    random = np.random.RandomState(searchSeed)
+    candidates = list()
+    tried = set()
+    for n in range(10*iterations):
+        if len(candidates) == iterations:
+            break
+        subset = subsets[random.randint(len(subsets))]
+        backend = backends[random.randint(len(backends))]
+        parameters = dict()
+        for key, values in parameterGrids[backend].items():
+            if all([isinstance(value, float) for value in values]):
+                parameters[key] = float(np.exp(random.uniform(np.log(min(values)), np.log(max(values)))))
+            else:
+                parameters[key] = values[random.randint(len(values))]
+        candidate = repr((sorted(subset.items()), backend, sorted(parameters.items())))
+        if candidate not in tried:
+            tried.add(candidate)
+            candidates.append((subset, backend, parameters))
+    return candidates
+
+"""
+Returns the position of every column of usingSets in the features SvmModel.readFeatures returns, as {(.csv name, column): position}
+"""
+def findPositions(usingSets):
+    positions = dict()
+    for key in sorted(usingSets.keys()):
+        for column in usingSets[key]:
+            positions[(key, column)] = len(positions)
+    return positions
+
+"""
+Splits the samples of a sample file, or the subsample of them findSubsample chooses, into folds stratified by classification
+Returns, for every fold, its training features and classifications and its test features and classifications
+The features are arrays, or the paths of .npy files in the SvmModel.featureCache, if there is one,
+where they are only built the first time the same samples, features and folds are asked for
+"""
+def findFolds(dirName, sampleDatabase, sampleName, usingSets, scales, folds = foldCount, maxSamples = None, balanced = False):
+    samplePath = os.path.join(dirName, 'SVM', 'samples', sampleDatabase, sampleName)
+    waveforms, classifications = SvmModel.readSamples(samplePath)
+    if maxSamples != None or balanced:
+        chosen = SvmModel.findSubsample(classifications, maxSamples, balanced)
+        waveforms = [waveforms[n] for n in chosen]
+        classifications = [classifications[n] for n in chosen]
+    classifications = np.asarray(classifications)
+    splits = list(StratifiedKFold(n_splits = folds, shuffle = True, random_state = searchSeed).split(np.zeros(len(classifications)), classifications))
+    cache = SvmModel.featureCache
+    features = None
+    if cache == None:
+        features = SvmModel.readFeatures(dirName, sampleDatabase, usingSets, scales, waveforms)
+        return [(features[train], classifications[train], features[test], classifications[test]) for train, test in splits]
+    keys = sorted([key for key in usingSets.keys() if len(usingSets[key]) != 0])
+    key = Checkpoint.findJobKey('Folds', [samplePath]+[SvmModel.dataPathFor(dirName, sampleDatabase, key) for key in keys],
+                                [repr([(key, usingSets[key], scales[key]) for key in keys]), repr((folds, maxSamples, balanced, searchSeed))])
+    foldData = list()
+    for n in range(len(splits)):
+        paths = list()
+        for part, rows in zip(('train', 'test'), splits[n]):
+            name = '{}-{}-{}.npy'.format(key, n, part)
+            path = cache.get(name)
+            if path == None:
+                if features is None:
+                    features = SvmModel.readFeatures(dirName, sampleDatabase, usingSets, scales, waveforms)
+                foldFile = open(cache.tempPathFor(name), 'wb')
+                np.save(foldFile, features[rows])
+                foldFile.close()
+                cache.add(name, cache.tempPathFor(name))
+                path = cache.pathFor(name)
+            paths.append(path)
+        foldData.append((paths[0], classifications[splits[n][0]], paths[1], classifications[splits[n][1]]))
+    return foldData
+
+"""
+Returns the features of a fold, memory mapping them the first time they are asked for if they are the path of a .npy file
+"""
+def loadFold(features):
+    if not isinstance(features, basestring):
+        return features
+    if features not in loadedFolds:
+        loadedFolds[features] = np.load(features, mmap_mode = 'r')
+    return loadedFolds[features]
+
+"""
+Fits a classifier of backend, with parameters, to the columns of the training features of a fold
+Returns its accuracy on the test features, and the seconds it took to fit
+Run by the worker processes, which already run one fold each, so the classifier itself is kept to one process
+"""
+def scoreFold(train, trainClassifications, test, testClassifications, columns, backend, parameters):
+    clf = SvmModel.makeClassifier(backend, parameters)
+    if 'n_jobs' in clf.get_params():
+        clf.set_params(n_jobs = 1)
+    start = time.time()
+    clf.fit(loadFold(train)[:, columns], trainClassifications)
+    fitTime = time.time()-start
+    return clf.score(loadFold(test)[:, columns], testClassifications), fitTime
+
+"""
+Scores every fold of tasks, the arguments of scoreFold, in a pool of worker processes, yielding their results in order
+At most two folds per process are in flight
+"""
+def scoreFoldsParallel(tasks, workers):
+    executor = ProcessPoolExecutor(max_workers = workers)
+    pending = deque()
+    try:
+        for task in tasks:
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(scoreFold, *task))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown()
+
+"""
+Formats the features of a candidate as 'file.csv:column;column file.csv:column'
+"""
+def formatFeatures(dirName, database, usingSets):
+    names = SvmModel.findColumnNames(dirName, database, usingSets)
+    return ' '.join(['{}:{}'.format(key, ';'.join([str(name) for name in names[key]])) for key in sorted(names.keys())])
+
+"""
+Formats the parameters of a candidate as 'parameter=value;parameter=value', in the order of parameterGrids
+"""
+def formatParameters(backend, parameters):
+    return ';'.join(['{}={}'.format(key, parameters[key]) for key in parameterGrids[backend].keys() if key in parameters])
+
+"""
+Cross-validates every candidate of a search over the columns of usingSets, the classifier backends named backends
+and their parameterGrids, on the sample file sampleName of sampleDatabase, split into folds
+A grid search tries every candidate, and a random search, if iterations is given, that many of them
+minColumns, maxSamples and balanced are as for findFeatureSubsets and SvmModel.findSubsample
+progress is called with (folds done, total folds), and workers sets the number of processes, defaulting to one per core
+Writes the results table, trains the best candidate on every sample and saves it as the model name
+Returns the paths of the results table and of the model
+"""
+def searchModels(dirName, sampleDatabase, sampleName, usingSets, name, backends = ('rbf',), folds = foldCount, iterations = None, minColumns = None,
+                 maxSamples = None, balanced = False, progress = None, workers = None):
+    if workers == None:
+        workers = cpu_count()
+    backends = list(backends)
+    for backend in backends:
+        if backend not in parameterGrids:
+            raise ValueError('There is no classifier backend {}'.format(backend))
+    usingSets = OrderedDict([(key, list(usingSets[key])) for key in sorted(usingSets.keys()) if len(usingSets[key]) != 0])
+    if len(usingSets) == 0:
+        raise ValueError('No additional data columns were chosen')
+    scales = SvmModel.findDatabaseScales(dirName, sampleDatabase, usingSets)
+    foldData = findFolds(dirName, sampleDatabase, sampleName, usingSets, scales, folds, maxSamples, balanced)
+    candidates = findCandidates(usingSets, backends, minColumns, iterations)
+    positions = findPositions(usingSets)
+    tasks = ((train, trainClassifications, test, testClassifications, [positions[(key, column)] for key in subset.keys() for column in subset[key]], backend, parameters)
+             for subset, backend, parameters in candidates for train, trainClassifications, test, testClassifications in foldData)
+    if workers > 1 and len(candidates)*len(foldData) > 1:
+        results = scoreFoldsParallel(tasks, workers)
+    else:
+        results = (scoreFold(*task) for task in tasks)
+    scores = np.zeros((len(candidates), len(foldData)))
+    fitTimes = np.zeros((len(candidates), len(foldData)))
+    for n, result in enumerate(results):
+        scores[n/len(foldData), n%len(foldData)], fitTimes[n/len(foldData), n%len(foldData)] = result
+        if progress != None:
+            progress(n+1, scores.size)
+    """
+    Write the table, best mean accuracy first and, of equal ones, least spread first, and save the best candidate
+    """
+    ranking = sorted(range(len(candidates)), key = lambda n: (-scores[n].mean(), scores[n].std()))
+    lines = ['Rank,Mean accuracy,Std accuracy,Fit seconds,Backend,Parameters,Features\n']
+    for rank in range(len(ranking)):
+        subset, backend, parameters = candidates[ranking[rank]]
+        lines.append('{},{:.6f},{:.6f},{:.4f},{},{},{}\n'.format(rank+1, scores[ranking[rank]].mean(), scores[ranking[rank]].std(), fitTimes[ranking[rank]].mean(),
+                                                              backend, formatParameters(backend, parameters), formatFeatures(dirName, sampleDatabase, subset)))
+    resultsPath = resultsPathFor(dirName, name)
+    if not os.path.exists(os.path.dirname(resultsPath)):
+        os.makedirs(os.path.dirname(resultsPath))
+    Checkpoint.writeAtomic(resultsPath, ''.join(lines))
+    subset, backend, parameters = candidates[ranking[0]]
+    clf, scales = SvmModel.trainClassifier(dirName, sampleDatabase, sampleName, subset, backend, maxSamples, balanced, parameters)
+    return resultsPath, SvmModel.saveModel(dirName, name, clf, scales, subset, sampleDatabase, sampleName, backend, maxSamples, balanced, parameters)
@@ -0,0 +1,249 @@
+"""
+Disk cache of filter results, so that a layer or waveform filtered the same way before is not filtered again
+Entries are files in (root directory)/cache, named by the SHA-1 of everything the result depends on:
+the filter chain with every parameter, the code of the filters and of reading and writing layers,
+the templates and LogAmp tables in use, and the input, which is a database file's path, size and modification time,
+with the waveform's number for the result of a single waveform, or a waveform's values and start
+for a waveform which is not read from a database file
+A changed input or changed filter code therefore never matches an old entry, which ages out instead
+Files already written elsewhere are linked into the cache rather than copied, and entries over the size limit are never added
+Once the cache is over its size limit, the least recently used entries are removed
+The last use of an entry is the modification time of an empty (entry).use file next to it, since the entry itself
+may be linked to a file outside the cache, whose time should not change
+"""
+import os
+import shutil
+import hashlib
+import cPickle
+import numpy as np
+import Calibration
+import Templates
+from Checkpoint import checkpointExtension, partialExtension, partialPathFor, replaceFile
+from Filters import formatFilter, parseFilter
+
+cacheFolder = 'cache'
+
+"""
+Size limit of a cache, in bytes
+"""
+cacheLimit = 1 << 30
+
+"""
+Modules whose code decides the results of filters, including how layers are read and written
+"""
+codeFiles = ('Analysis.py', 'BulkFilter.py', 'Calibration.py', 'Filters.py', 'Templates.py', 'WaveformStore.py')
+
+moduleDirName = os.path.realpath(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Digest of codeFiles, read the first time it is asked for
+"""
+codeVersion = None
+
+"""
+Returns the digest of the code of the filters
+"""
+def findCodeVersion():
+    global codeVersion
+    if codeVersion == None:
+        digest = hashlib.sha1()
+        for file in codeFiles:
+            codeFile = open(os.path.join(moduleDirName, file), 'rb')
+            digest.update(codeFile.read())
+            codeFile.close()
+        codeVersion = digest.hexdigest()
+    return codeVersion
+
+"""
+Returns a digest of chain, with every parameter of its filters, the code of the filters, and the templates and LogAmp tables in use
+"""
+def findChainDigest(chain):
+    digest = hashlib.sha1(findCodeVersion())
+    for filterType in chain:
+        digest.update(formatFilter(*parseFilter(filterType)))
+        digest.update(',')
+    for template in Templates.activeTemplates:
+        digest.update(template.name)
+        digest.update(template.values.tobytes())
+    for name in sorted(Calibration.activeTables.keys()):
+        digest.update(name)
+        digest.update(Calibration.activeTables[name].values.tobytes())
+    return digest
+
+"""
+Returns the key of the result of applying chain to a waveform
+"""
+def findWaveformKey(values, start, chain):
+    digest = findChainDigest(chain)
+    digest.update(np.asarray(values, dtype = np.float64).tobytes())
+    digest.update(repr(start))
+    return digest.hexdigest()
+
+"""
+Returns the key of the result of applying chain to a database file, which changes whenever the file does
+"""
+def findFileKey(path, chain):
+    digest = findChainDigest(chain)
+    digest.update(repr((os.path.realpath(path), os.path.getsize(path), os.path.getmtime(path))))
+    return digest.hexdigest()
+
+"""
+Returns the key of the result of applying chain to waveform number index, counted from 0, of a database file,
+which changes whenever the file does
+"""
+def findRecordKey(path, index, chain):
+    digest = findChainDigest(chain)
+    digest.update(repr((os.path.realpath(path), os.path.getsize(path), os.path.getmtime(path), index)))
+    return digest.hexdigest()
+
+"""
+Links newPath to the file at path, replacing any file there in one step, or copies it where files cannot be linked
+"""
+def linkFile(path, newPath):
+    partialPath = partialPathFor(newPath)
+    if os.path.exists(partialPath):
+        os.remove(partialPath)
+    try:
+        os.link(path, partialPath)
+    except (AttributeError, OSError):
+        shutil.copyfile(path, partialPath)
+    replaceFile(partialPath, newPath)
+
+"""
+A cache in the folder cacheFolder of a root directory, holding at most limit bytes
+Entries are named by a key and a suffix, and are looked up with get, which counts as a use
+"""
+class ResultCache():
+    def __init__(self, dirName, limit = cacheLimit):
+        self.folder = os.path.join(dirName, cacheFolder)
+        self.limit = limit
+        self.entries = None
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def pathFor(self, name):
+        return os.path.join(self.folder, name)
+
+    """
+    Reads the size and last use of every entry, the first time an entry is added
+    Line indexes of cached layers, last use files, unfinished entries and the checkpoints of the jobs writing them
+    are not entries themselves
+    """
+    def findEntries(self):
+        if self.entries == None:
+            self.entries = dict()
+            for name in os.listdir(self.folder):
+                if not name.endswith(('.idx', '.use', '.tmp', partialExtension, checkpointExtension)):
+                    self.entries[name] = [os.path.getsize(self.pathFor(name)), self.findLastUse(name)]
+        return self.entries
+
+    def usePathFor(self, name):
+        return self.pathFor('{}.use'.format(name))
+
+    """
+    Returns the time an entry was last used, which is when it was written if it has never been marked as used
+    """
+    def findLastUse(self, name):
+        usePath = self.usePathFor(name)
+        if os.path.exists(usePath):
+            return os.path.getmtime(usePath)
+        return os.path.getmtime(self.pathFor(name))
+
+    """
+    Marks an entry as just used
+    """
+    def markUsed(self, name):
+        usePath = self.usePathFor(name)
+        open(usePath, 'a').close()
+        os.utime(usePath, None)
+        if self.entries != None:
+            self.entries[name] = [os.path.getsize(self.pathFor(name)), os.path.getmtime(usePath)]
+
+    """
+    Returns whether an entry of size bytes can be added
+    """
+    def fits(self, size):
+        return size <= self.limit
+
+    """
+    Returns the path of an entry, marking it as just used, or None if it is not cached
+    """
+    def get(self, name):
+        path = self.pathFor(name)
+        if not os.path.exists(path):
+            return None
+        self.markUsed(name)
+        return path
+
+    """
+    Returns the path an entry is written to before it is added
+    """
+    def tempPathFor(self, name):
+        return self.pathFor('{}.tmp'.format(name))
+
+    """
+    Adds a file as an entry, linking it into the cache unless it was written to the entry's temporary path
+    A file over the size limit is not added, and is removed if it was written to the temporary path
+    Removes the least recently used entries if the cache is then over its limit
+    Returns whether the file was added
+    """
+    def add(self, name, path):
+        tempPath = self.tempPathFor(name)
+        if not self.fits(os.path.getsize(path)):
+            if path == tempPath:
+                os.remove(tempPath)
+            return False
+        entries = self.findEntries()
+        if path != tempPath:
+            linkFile(path, tempPath)
+        self.remove(name)
+        os.rename(tempPath, self.pathFor(name))
+        self.markUsed(name)
+        self.evict()
+        return True
+
+    """
+    Returns a cached Python object, or None if it is not cached
+    """
+    def load(self, name):
+        path = self.get(name)
+        if path == None:
+            return None
+        entryFile = open(path, 'rb')
+        try:
+            return cPickle.load(entryFile)
+        except (EOFError, cPickle.UnpicklingError):
+            return None
+        finally:
+            entryFile.close()
+
+    """
+    Caches a Python object
+    """
+    def store(self, name, value):
+        entryFile = open(self.tempPathFor(name), 'wb')
+        cPickle.dump(value, entryFile, cPickle.HIGHEST_PROTOCOL)
+        entryFile.close()
+        self.add(name, self.tempPathFor(name))
+
+    """
+    Removes an entry, its last use file and the line index of a cached layer
+    """
+    def remove(self, name):
+        for path in (self.pathFor(name), self.usePathFor(name), self.pathFor('{}.idx'.format(name))):
+            if os.path.exists(path):
+                os.remove(path)
+        if self.entries != None:
+            self.entries.pop(name, None)
+
+    """
+    Removes the least recently used entries until the cache is within its limit
+    """
+    def evict(self):
+        entries = self.findEntries()
+        total = sum([entry[0] for entry in entries.values()])
+        for name in sorted(entries.keys(), key = lambda name: entries[name][1]):
+            if total <= self.limit:
+                break
+            total -= entries[name][0]
+            self.remove(name)
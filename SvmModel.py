@@ -0,0 +1,478 @@
+"""
+Support vector machine classification of waveforms from their additional data, without a display
+Sample files in SVM/samples/(databaseName) are comma delimited, with the classification in the first column
+and the waveform number in the second
+Features are chosen as a dictionary of {additional data .csv name: list of column numbers}
+Classifiers are trained with one of classifierBackends, with its default parameters or chosen ones,
+on every sample or on a stratified subsample of them
+Each additional data .csv is parsed once into an array, shared by training and classifying, and can be cached on disk
+as a memory mapped .npy in a result cache
+Databases are classified a block of waveforms at a time, with one call of the classifier per block,
+and large databases are classified in a pool of processes
+Trained classifiers are saved as models in SVM/formulae, with their features, scales, sample database and
+a checksum of their sample file, and can classify other databases without being trained again
+Model layout: magic, header length (uint64), JSON header, then the pickled classifier, which is only read when it is used
+"""
+import os
+import json
+import struct
+import hashlib
+import cPickle
+from collections import OrderedDict, deque
+from itertools import izip
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+from sklearn import svm
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import make_pipeline
+import Checkpoint
+
+"""
+Number of waveforms classified with one call of the classifier, and between two calls of a progress callback
+"""
+blockSize = 10000
+
+"""
+Additional data .csvs parsed, as {path: (size, modification time, array)}, so that each is only parsed once until it changes
+"""
+loadedData = dict()
+
+"""
+ResultCache.ResultCache the parsed additional data .csvs are kept in, or None to keep them in memory only
+"""
+featureCache = None
+
+"""
+Classifier backends, as {backend name: function returning an unfitted classifier}
+rbf: kernel support vector machine, whose training time grows quadratically to cubically with the samples
+linear: linear support vector machine
+sgd: linear support vector machine fitted by stochastic gradient descent
+nystroem: linear support vector machine on a Nystroem approximation of the rbf kernel
+forest: random forest, trained on every core
+Every backend but rbf trains in about linear time, and all of them are seeded so that training can be repeated
+"""
+classifierBackends = OrderedDict([('rbf', lambda: svm.SVC(kernel = 'rbf')),
+                                  ('linear', lambda: svm.LinearSVC(random_state = 0)),
+                                  ('sgd', lambda: SGDClassifier(max_iter = 50, tol = 1e-3, random_state = 0)),
+                                  ('nystroem', lambda: make_pipeline(Nystroem(n_components = 500, random_state = 0), svm.LinearSVC(random_state = 0))),
+                                  ('forest', lambda: RandomForestClassifier(n_estimators = 100, n_jobs = -1, random_state = 0))])
+
+"""
+Seed of the random choice of samples when subsampling
+"""
+subsampleSeed = 0
+
+modelMagic = 'WFMODEL1'
+modelVersion = 2
+formulaeFolder = 'formulae'
+modelExtension = '.model'
+
+"""
+Returns the path of an additional data .csv of a database
+"""
+def dataPathFor(dirName, database, fileName):
+    return os.path.join(dirName, 'waveform_data', database, 'additional_data', fileName)
+
+"""
+Returns the column names of an additional data .csv
+"""
+def readColumns(dataPath):
+    dataFile = open(dataPath)
+    line = dataFile.readline()
+    dataFile.close()
+    return line[:len(line)-1].split(',')
+
+"""
+Returns the column numbers of the column names of an additional data .csv
+"""
+def findColumns(dataPath, names):
+    columns = readColumns(dataPath)
+    numbers = list()
+    for name in names:
+        if name not in columns:
+            raise ValueError('{} has no column {}'.format(os.path.basename(dataPath), name))
+        numbers.append(columns.index(name))
+    return numbers
+
+"""
+Reads a sample file
+Returns the waveform numbers and their classifications
+"""
+def readSamples(samplePath):
+    sampleFile = open(samplePath)
+    samples = sampleFile.readlines()
+    sampleFile.close()
+    waveforms = list()
+    classifications = list()
+    for n in range(len(samples)):
+        sample = samples[n].split(',')
+        classifications.append(sample[0])
+        waveforms.append(int(sample[1]))
+    return waveforms, classifications
+
+"""
+Keeps the additional data .csvs parsed from now on in a ResultCache.ResultCache, or only in memory if cache is None
+"""
+def useFeatureCache(cache):
+    global featureCache
+    featureCache = cache
+
+"""
+Parses the rows of an additional data .csv, without its header, into a (rows, columns) array
+The rows are parsed in one pass, and only parsed one at a time if that fails, so that a bad value raises a ValueError
+"""
+def parseData(dataPath):
+    dataFile = open(dataPath, 'rU')
+    header = dataFile.readline()
+    body = dataFile.read().rstrip('\n')
+    dataFile.close()
+    if len(body) == 0:
+        return np.zeros((0, len(header.split(','))))
+    rows = body.count('\n')+1
+    columns = body[:body.find('\n')].count(',')+1 if rows > 1 else body.count(',')+1
+    data = np.fromstring(body.replace('\n', ','), dtype = np.float64, sep = ',')
+    if len(data) != rows*columns:
+        data = [[float(value) for value in line.split(',')] for line in body.split('\n')]
+        if any([len(row) != columns for row in data]):
+            raise ValueError('{} has rows of different lengths'.format(os.path.basename(dataPath)))
+        data = np.array(data, dtype = np.float64)
+    return data.reshape(rows, columns)
+
+"""
+Returns the rows of an additional data .csv as a (rows, columns) array
+The .csv is only parsed the first time it is asked for, or once it has changed, and the featureCache,
+if there is one, keeps the array for later runs, which memory map it
+"""
+def readData(dataPath):
+    size, mtime = os.path.getsize(dataPath), os.path.getmtime(dataPath)
+    if dataPath in loadedData and loadedData[dataPath][:2] == (size, mtime):
+        return loadedData[dataPath][2]
+    data = None
+    if featureCache != None:
+        name = '{}.npy'.format(Checkpoint.findJobKey('Features', [dataPath]))
+        cachedPath = featureCache.get(name)
+        if cachedPath != None:
+            data = np.load(cachedPath, mmap_mode = 'r')
+    if data is None:
+        data = parseData(dataPath)
+        if featureCache != None:
+            cacheFile = open(featureCache.tempPathFor(name), 'wb')
+            np.save(cacheFile, data)
+            cacheFile.close()
+            featureCache.add(name, featureCache.tempPathFor(name))
+    loadedData[dataPath] = (size, mtime, data)
+    return data
+
+"""
+Returns the scale of every column of an additional data .csv, which stretches the column's range to a width of 4
+Columns holding a single value have a scale of 0
+"""
+def findScales(dataPath):
+    data = readData(dataPath)
+    if len(data) == 0:
+        return list()
+    ranges = data.max(axis = 0)-data.min(axis = 0)
+    scales = np.zeros(len(ranges))
+    scales[ranges != 0] = 4/ranges[ranges != 0]
+    return scales.tolist()
+
+"""
+Returns the scales of the additional data .csvs of a database used by usingSets, as {.csv name: scales}
+"""
+def findDatabaseScales(dirName, database, usingSets):
+    scales = dict()
+    for key in usingSets.keys():
+        if len(usingSets[key]) != 0:
+            scales[key] = findScales(dataPathFor(dirName, database, key))
+    return scales
+
+"""
+Returns the scaled features of the rows of the additional data .csvs of a database, as a (rows, features) array
+rows are numbered from 1, as waveforms are, and default to every row
+The .csvs are taken in order of their names, so the features are in the same order however usingSets was built
+"""
+def readFeatures(dirName, database, usingSets, scales, rows = None):
+    features = list()
+    for key in sorted(usingSets.keys()):
+        if len(usingSets[key]) != 0:
+            data = readData(dataPathFor(dirName, database, key))
+            if rows != None:
+                data = data[np.asarray(rows)-1]
+            features.append(data[:, usingSets[key]]*np.asarray(scales[key])[usingSets[key]])
+    if len(features) == 0:
+        raise ValueError('No additional data columns were chosen')
+    return np.hstack(features)
+
+"""
+Returns the indices, in order, of at most maxSamples samples with the given classifications, chosen at random
+Every classification keeps its share of the samples, and at least one of them, or, if balanced is set,
+as many samples as the others, up to its share of maxSamples
+"""
+def findSubsample(classifications, maxSamples = None, balanced = False):
+    classifications = np.asarray(classifications)
+    classes, counts = np.unique(classifications, return_counts = True)
+    if maxSamples == None:
+        maxSamples = len(classifications)
+    if balanced:
+        quotas = np.zeros(len(classes), dtype = int)+min(counts.min(), max(maxSamples//len(classes), 1))
+    else:
+        quotas = np.minimum(np.maximum(counts*min(maxSamples, len(classifications))//len(classifications), 1), counts)
+    random = np.random.RandomState(subsampleSeed)
+    chosen = [random.permutation(np.flatnonzero(classifications == classes[n]))[:quotas[n]] for n in range(len(classes))]
+    return np.sort(np.concatenate(chosen))
+
+"""
+Returns an unfitted classifier of the backend named backend, with parameters, as {parameter: value}, set
+Raises a ValueError for a backend that does not exist or parameters it does not have
+"""
+def makeClassifier(backend, parameters = None):
+    if backend not in classifierBackends:
+        raise ValueError('There is no classifier backend {}'.format(backend))
+    clf = classifierBackends[backend]()
+    if parameters:
+        clf.set_params(**parameters)
+    return clf
+
+"""
+Trains a classifier of the backend named backend, with parameters set, on the sample file sampleName of sampleDatabase
+If maxSamples or balanced is given, it is trained on the subsample of the samples findSubsample chooses
+Returns the classifier and the scales of the additional data .csvs it uses
+"""
+def trainClassifier(dirName, sampleDatabase, sampleName, usingSets, backend = 'rbf', maxSamples = None, balanced = False, parameters = None):
+    clf = makeClassifier(backend, parameters)
+    waveforms, classifications = readSamples(os.path.join(dirName, 'SVM', 'samples', sampleDatabase, sampleName))
+    if maxSamples != None or balanced:
+        chosen = findSubsample(classifications, maxSamples, balanced)
+        waveforms = [waveforms[n] for n in chosen]
+        classifications = [classifications[n] for n in chosen]
+    scales = findDatabaseScales(dirName, sampleDatabase, usingSets)
+    clf.fit(readFeatures(dirName, sampleDatabase, usingSets, scales, waveforms), classifications)
+    return clf, scales
+
+"""
+Returns the path of a saved model
+"""
+def modelPathFor(dirName, modelName):
+    return os.path.join(dirName, 'SVM', formulaeFolder, ''.join((modelName, modelExtension)))
+
+"""
+Returns the checksum of a sample file
+"""
+def findSampleChecksum(samplePath):
+    sampleFile = open(samplePath, 'rb')
+    checksum = hashlib.sha1(sampleFile.read()).hexdigest()
+    sampleFile.close()
+    return checksum
+
+"""
+Returns the names of the columns of usingSets in the additional data .csvs of a database
+"""
+def findColumnNames(dirName, database, usingSets):
+    names = dict()
+    for key in usingSets.keys():
+        if len(usingSets[key]) != 0:
+            columns = readColumns(dataPathFor(dirName, database, key))
+            names[key] = [columns[column] if column < len(columns) else None for column in usingSets[key]]
+    return names
+
+"""
+Saves a trained classifier as the model modelName, with its features, scales, the sample file it was trained on,
+and its backend, parameters and subsampling
+Returns the path of the model
+"""
+def saveModel(dirName, modelName, clf, scales, usingSets, sampleDatabase, sampleName, backend = 'rbf', maxSamples = None, balanced = False, parameters = None):
+    header = json.dumps({'version': modelVersion, 'usingSets': usingSets, 'scales': scales,
+                         'columns': findColumnNames(dirName, sampleDatabase, usingSets),
+                         'backend': backend, 'parameters': parameters or dict(), 'maxSamples': maxSamples, 'balanced': balanced,
+                         'sampleDatabase': sampleDatabase, 'sampleName': sampleName,
+                         'sampleChecksum': findSampleChecksum(os.path.join(dirName, 'SVM', 'samples', sampleDatabase, sampleName))})
+    modelPath = modelPathFor(dirName, modelName)
+    if not os.path.exists(os.path.dirname(modelPath)):
+        os.makedirs(os.path.dirname(modelPath))
+    Checkpoint.writeAtomic(modelPath, ''.join((modelMagic, struct.pack('<Q', len(header)), header, cPickle.dumps(clf, cPickle.HIGHEST_PROTOCOL))))
+    return modelPath
+
+"""
+A saved model, whose header is read when it is opened and whose classifier is only read the first time it is used
+"""
+class Model():
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.clf = None
+        modelFile = open(path, 'rb')
+        try:
+            if modelFile.read(len(modelMagic)) != modelMagic:
+                raise ValueError('{} is not a model'.format(path))
+            headerLength = struct.unpack('<Q', modelFile.read(8))[0]
+            header = json.loads(modelFile.read(headerLength))
+        except struct.error:
+            raise ValueError('{} is not a model'.format(path))
+        finally:
+            modelFile.close()
+        if header['version'] != modelVersion:
+            raise ValueError('{} is a model of another version'.format(path))
+        self.offset = len(modelMagic)+8+headerLength
+        self.usingSets = dict([(str(key), header['usingSets'][key]) for key in header['usingSets']])
+        self.scales = dict([(str(key), header['scales'][key]) for key in header['scales']])
+        self.columns = dict([(str(key), header['columns'][key]) for key in header['columns']])
+        self.sampleDatabase = str(header['sampleDatabase'])
+        self.sampleName = str(header['sampleName'])
+        self.sampleChecksum = str(header['sampleChecksum'])
+        self.backend = str(header.get('backend', 'rbf'))
+        self.parameters = dict([(str(key), value) for key, value in header.get('parameters', dict()).items()])
+        self.maxSamples = header.get('maxSamples')
+        self.balanced = header.get('balanced', False)
+
+    """
+    Returns the classifier, reading it the first time it is asked for
+    """
+    def getClassifier(self):
+        if self.clf == None:
+            modelFile = open(self.path, 'rb')
+            modelFile.seek(self.offset)
+            self.clf = cPickle.load(modelFile)
+            modelFile.close()
+        return self.clf
+
+    """
+    Returns whether the model was trained on the sample file as it is now
+    """
+    def isCurrent(self, dirName):
+        samplePath = os.path.join(dirName, 'SVM', 'samples', self.sampleDatabase, self.sampleName)
+        return os.path.exists(samplePath) and findSampleChecksum(samplePath) == self.sampleChecksum
+
+    """
+    Raises a ValueError if a database's additional data .csvs do not have the model's features in the same columns
+    """
+    def checkDatabase(self, dirName, database):
+        for key in self.usingSets.keys():
+            if len(self.usingSets[key]) != 0 and not os.path.exists(dataPathFor(dirName, database, key)):
+                raise ValueError('{} has no {}'.format(database, key))
+        if findColumnNames(dirName, database, self.usingSets) != self.columns:
+            raise ValueError('The features of {} are not those of the model {}'.format(database, os.path.basename(self.path)))
+
+"""
+Models opened, as {path: Model}, so that each is only read once until it changes
+"""
+loadedModels = dict()
+
+"""
+Opens the model modelName
+"""
+def loadModel(dirName, modelName):
+    path = modelPathFor(dirName, modelName)
+    if not os.path.exists(path):
+        raise ValueError('There is no model {}'.format(modelName))
+    if path not in loadedModels or loadedModels[path].mtime != os.path.getmtime(path):
+        loadedModels[path] = Model(path)
+    return loadedModels[path]
+
+"""
+Returns the names of the saved models
+"""
+def findModels(dirName):
+    folder = os.path.join(dirName, 'SVM', formulaeFolder)
+    if not os.path.isdir(folder):
+        return list()
+    return [file[:len(file)-len(modelExtension)] for file in sorted(os.listdir(folder)) if file.endswith(modelExtension)]
+
+"""
+Returns the classifier and scales of the model modelName if it was trained on the sample file as it is now
+with the same features, backend, parameters and subsampling, and otherwise trains them and saves them as modelName
+A model which cannot be read, or was saved by another version, is trained again
+"""
+def findClassifier(dirName, sampleDatabase, sampleName, usingSets, modelName, backend = 'rbf', maxSamples = None, balanced = False, parameters = None):
+    if modelName in findModels(dirName):
+        try:
+            model = loadModel(dirName, modelName)
+        except ValueError:
+            model = None
+        if model != None and (model.sampleDatabase, model.sampleName, model.usingSets, model.backend, model.parameters, model.maxSamples, model.balanced) == (sampleDatabase, sampleName, usingSets, backend, parameters or dict(), maxSamples, balanced) and model.isCurrent(dirName):
+            return model.getClassifier(), model.scales
+    clf, scales = trainClassifier(dirName, sampleDatabase, sampleName, usingSets, backend, maxSamples, balanced, parameters)
+    saveModel(dirName, modelName, clf, scales, usingSets, sampleDatabase, sampleName, backend, maxSamples, balanced, parameters)
+    return clf, scales
+
+"""
+Returns the key of a prediction job, which changes whenever its additional data .csvs, features, scales or classifier do
+"""
+def findPredictionKey(dirName, database, usingSets, scales, clf):
+    keys = sorted([key for key in usingSets.keys() if len(usingSets[key]) != 0])
+    values = [repr([(key, usingSets[key], scales[key]) for key in keys]), cPickle.dumps(clf, cPickle.HIGHEST_PROTOCOL)]
+    return Checkpoint.findJobKey('Predict', [dataPathFor(dirName, database, key) for key in keys], values)
+
+"""
+Classifies a block of features, the first of which is waveform number first
+If jobs is given, a classifier which runs jobs of its own, as the forest does, is kept to that many
+Returns the lines of their classifications
+Run by the worker processes
+"""
+def predictBlock(clf, features, first, jobs = None):
+    if jobs != None and 'n_jobs' in clf.get_params():
+        clf.set_params(n_jobs = jobs)
+    classifications = clf.predict(features)
+    return ''.join(['{},{}\n'.format(first+n, classifications[n]) for n in range(len(classifications))])
+
+"""
+Classifies the blocks of features starting at each of starts in a pool of worker processes, yielding their lines in order
+At most two blocks per process are in flight, so finished blocks cannot pile up waiting to be written
+Each process classifies with one job, as there is already one process per core
+"""
+def predictBlocksParallel(clf, features, starts, workers):
+    executor = ProcessPoolExecutor(max_workers = workers)
+    pending = deque()
+    try:
+        for start in starts:
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(predictBlock, clf, features[start:start+blockSize], start+1, 1))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown()
+
+"""
+Classifies every waveform of database and writes the classifications to SVM/returns/(outputName).csv
+progress is called with (waveforms done, total waveforms) every blockSize waveforms
+workers sets the number of processes used, defaulting to one per core, though a database of one block uses one
+The job is checkpointed, and carries on from its last checkpoint if it was stopped
+Returns the path of the classifications
+"""
+def predictDatabase(dirName, database, usingSets, scales, clf, outputName, progress = None, workers = None):
+    if workers == None:
+        workers = cpu_count()
+    features = readFeatures(dirName, database, usingSets, scales)
+    returnPath = os.path.join(dirName, 'SVM', 'returns', '{}.csv'.format(outputName))
+    checkpoint = Checkpoint.Checkpoint([returnPath], findPredictionKey(dirName, database, usingSets, scales, clf))
+    done = checkpoint.start()
+    returnFile = checkpoint.files[0]
+    if not checkpoint.resumed:
+        returnFile.write('Waveform,Classification\n')
+    starts = range(done, len(features), blockSize)
+    if workers > 1 and len(starts) > 1:
+        results = predictBlocksParallel(clf, features, starts, workers)
+    else:
+        results = (predictBlock(clf, features[start:start+blockSize], start+1) for start in starts)
+    for start, lines in izip(starts, results):
+        returnFile.write(lines)
+        done = min(start+blockSize, len(features))
+        if checkpoint.due():
+            checkpoint.save(done)
+        if progress != None and done != len(features):
+            progress(done, len(features))
+    checkpoint.finish()
+    if progress != None:
+        progress(len(features), len(features))
+    return returnPath
+
+"""
+Classifies every waveform of database with the saved model modelName, as predictDatabase does
+"""
+def predictWithModel(dirName, database, modelName, outputName, progress = None, workers = None):
+    model = loadModel(dirName, modelName)
+    model.checkDatabase(dirName, database)
+    return predictDatabase(dirName, database, model.usingSets, model.scales, model.getClassifier(), outputName, progress, workers)
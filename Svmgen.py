@@ -1,6 +1,7 @@
-from sklearn import svm
 import Tkinter as tk
 import os
+import ModelSelection
+import SvmModel
 """
 Note: files in SVM\samples\(databaseName) must be a comma delimited .txt or a .csv
       and their  first column is the classification, and the second column is the waveform number
@@ -66,11 +67,23 @@ class Svmgen():
         self.updateSamples()
         tk.Label(self.root, text = 'Use Data:').grid(row = 2, column = 0)
         self.generateFrames()
-        tk.Label(self.root, text = 'Output Name:').grid(row = 4, column = 0)
+        tk.Label(self.root, text = 'Classifier:').grid(row = 4, column = 0)
+        backend = tk.StringVar(self.root, SvmModel.classifierBackends.keys()[0])
+        tk.OptionMenu(self.root, backend, *SvmModel.classifierBackends.keys()).grid(row = 4, column = 1)
+        tk.Label(self.root, text = 'Output Name:').grid(row = 5, column = 0)
         output = tk.StringVar(self.root)
-        tk.Entry(self.root, textvariable = output).grid(row = 4, column = 1)
-        genButton = tk.Button(self.root, text = 'generate', command = lambda: self.generate(output.get(), self.sample.get()))
-        genButton.grid(row = 5, column = 0, columnspan = 2)
+        tk.Entry(self.root, textvariable = output).grid(row = 5, column = 1)
+        genButton = tk.Button(self.root, text = 'generate', command = lambda: self.generate(output.get(), self.sample.get(), backend.get()))
+        genButton.grid(row = 6, column = 0)
+        searchButton = tk.Button(self.root, text = 'search', command = lambda: self.search(output.get(), self.sample.get(), backend.get()))
+        searchButton.grid(row = 6, column = 1)
+        models = SvmModel.findModels(self.dirName)
+        if len(models) != 0:
+            tk.Label(self.root, text = 'Saved Model:').grid(row = 7, column = 0)
+            model = tk.StringVar(self.root, models[0])
+            tk.OptionMenu(self.root, model, *models).grid(row = 7, column = 1)
+            classifyButton = tk.Button(self.root, text = 'classify', command = lambda: self.classify(model.get(), output.get()))
+            classifyButton.grid(row = 8, column = 0, columnspan = 2)
 
     def updateSampleDatabase(self):
         self.updateSamples()
@@ -111,22 +124,29 @@ class Svmgen():
             pass
         self.pointFrames[fileName].grid(row = 3, column = 0, columnspan = 2)
 
-    def generate(self, outputName, sampleName):
+    def generate(self, outputName, sampleName, backend = 'rbf'):
         if len(outputName)==0:
             return
         self.root.destroy()
-        self.offsets = dict()
-        for file in os.listdir(os.path.join(self.dirName, 'waveform_data', self.sampleDatabase.get(), 'additional_data')):
-            if file.endswith('.csv'):
-                dataFile = open(os.path.join(self.dirName, 'waveform_data', self.sampleDatabase.get(), 'additional_data', file))
-                offset = 0
-                dataFile.seek(0)
-                self.offsets[file] = list()
-                for line in dataFile:
-                    self.offsets[file].append(offset)
-                    offset += len(line) + 1
-                self.offsets[file] = self.offsets[file][1:]
-                dataFile.close()
+        self.findUsingSets()
+        self.clf, self.scales = SvmModel.findClassifier(self.dirName, self.sampleDatabase.get(), sampleName, self.usingSets, outputName, backend)
+        self.predict(outputName)
+
+    def search(self, outputName, sampleName, backend = 'rbf'):
+        if len(outputName)==0:
+            return
+        self.root.destroy()
+        self.findUsingSets()
+        progress = self.openProgress('Searching Models...')
+        try:
+            ModelSelection.searchModels(self.dirName, self.sampleDatabase.get(), sampleName, self.usingSets, outputName, [backend], progress = progress)
+        finally:
+            self.progressMaster.destroy()
+        model = SvmModel.loadModel(self.dirName, outputName)
+        self.usingSets, self.scales, self.clf = model.usingSets, model.scales, model.getClassifier()
+        self.predict(outputName)
+
+    def findUsingSets(self):
         self.usingSets = dict()
         for key in self.dataPoints.keys():
             buttons = self.checks[key]
@@ -134,58 +154,35 @@ class Svmgen():
             for m in range(len(buttons)):
                 if buttons[m].get():
                     self.usingSets[key].append(m)
-        sampleFile = open(os.path.join(self.dirName, 'SVM', 'samples', self.sampleDatabase.get(), sampleName))
-        samples = sampleFile.readlines()
-        sampleFile.close()
-        pointList = list()
-        typeList = list()
-        for n in range(len(samples)):
-            pointList.append(list())
-            samples[n] = samples[n].split(',')
-            typeList.append(samples[n][0])
-            samples[n] = int(samples[n][1])
-        self.scales = dict()
-        for key in self.usingSets.keys():
-            if len(self.usingSets[key]) != 0:
-                dataFile = open(os.path.join(self.dirName, 'waveform_data', self.sampleDatabase.get(), 'additional_data', key))
-                dataLines = dataFile.readlines()[1:]
-                for m in range(len(dataLines)):
-                    dataLines[m] = dataLines[m].split(',')
-                    for l in range(len(dataLines[m])):
-                        dataLines[m][l] = float(dataLines[m][l])
-                data = zip(*dataLines)
-                self.scales[key] = list()
-                for m in range(len(data)):
-                    self.scales[key].append(4/(max(data[m])-min(data[m])))
-                for m in range(len(samples)):
-                    dataFile.seek(self.offsets[key][samples[m]-1])
-                    lineData = dataFile.readline().split(',')
-                    for l in range(len(self.usingSets[key])):
-                        pointList[m].append(float(lineData[self.usingSets[key][l]])*self.scales[key][self.usingSets[key][l]])
-                dataFile.close()
-        self.clf = svm.SVC(kernel = 'rbf')
-        self.clf.fit(pointList, typeList)
-        self.predict(outputName)
+
+    def classify(self, modelName, outputName):
+        if len(outputName)==0:
+            return
+        self.root.destroy()
+        progress = self.openProgress('Classifying...')
+        try:
+            SvmModel.predictWithModel(self.dirName, self.database, modelName, outputName, progress)
+        finally:
+            self.progressMaster.destroy()
 
     def predict(self, outputName):
-        file = open(os.path.join(self.dirName, 'SVM', 'returns', '{}.csv'.format(outputName)), 'w')
-        file.write('Waveform,Classification\n')
-        file.close()
-        dataLines = dict()
-        for n in range(len(self.usingSets.keys())):
-            key = self.usingSets.keys()[n]
-            dataFile = open(os.path.join(self.dirName, 'waveform_data', self.database, 'additional_data', key))
-            dataLines[key] = dataFile.readlines()[1:]
-            dataFile.close()
-        for lineNumber in range(len(dataLines[dataLines.keys()[0]])):
-            data = list()
-            for n in range(len(dataLines.keys())):
-                key = dataLines.keys()[n]
-                lineData = dataLines[key][lineNumber].split(',')
-                for m in range(len(self.usingSets[key])):
-                    data.append(float(lineData[self.usingSets[key][m]])*self.scales[key][self.usingSets[key][m]])
-            file = open(os.path.join(self.dirName, 'SVM\\returns', '{}.csv'.format(outputName)), 'a')
-            file.write('{},{}\n'.format(lineNumber+1, self.clf.predict([data])[0]))
-            file.close()
-            if lineNumber%100==0:
-                print lineNumber
\ No newline at end of file
+        progress = self.openProgress('Classifying...')
+        try:
+            SvmModel.predictDatabase(self.dirName, self.database, self.usingSets, self.scales, self.clf, outputName, progress)
+        finally:
+            self.progressMaster.destroy()
+
+    """
+    Opens a window showing how much of a job is done, as the bulk filter does
+    Returns the function the job reports its progress to
+    """
+    def openProgress(self, title):
+        self.progressMaster = tk.Tk(className = title)
+        progressBar = tk.Canvas(self.progressMaster, width = 150, height = 76)
+        progressBar.pack()
+        self.progressMaster.update()
+        def updateProgress(done, total):
+            progressBar.delete('all')
+            progressBar.create_text(75, 38, text = '/'.join((str(done), str(total))))
+            self.progressMaster.update()
+        return updateProgress
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Reference waveforms which isolated christmas trees are cross-covaried against for their XRCOV features
+Every template is zero shifted once, and its FFT is cached for each FFT size it is correlated at
+The standard template is always used, and gives the XRCOV column; other templates are read from .txt files in
+SVM/templates or waveform_data/(databaseName)/templates, hold one waveform as 'value,value,...,value',
+and each give an 'XRCOV (template name)' column after the christmas tree's usual columns
+"""
+import os
+import numpy as np
+
+"""
+Christmas tree shape used for the XRCOV column
+"""
+christmasTreeTemplate = np.array([0,34.59591151,181.0065031,390.1960062,668.0224207,1019.288653,1447.788669,1956.362735,
+                                  2546.959288,3220.701341,3977.955599,4818.402784,5591,4703.829564,3895.474605,3163.559533,
+                                  2505.355592,1917.838918,1397.744873,941.618485,545.8609216,206.7719882,-3.42E-12])
+
+templateFolder = 'templates'
+templateExtension = '.txt'
+
+class Template():
+    def __init__(self, name, values):
+        self.name = name
+        values = np.asarray(values, dtype = np.float64)
+        self.values = values - values.sum()/len(values)
+        self.total = self.values.sum()
+        self.spectra = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    """
+    Returns the FFT of the zero shifted template padded to fftSize, computing it the first time it is asked for
+    """
+    def getSpectrum(self, fftSize):
+        if fftSize not in self.spectra:
+            self.spectra[fftSize] = np.fft.rfft(self.values, fftSize)
+        return self.spectra[fftSize]
+
+standardTemplate = Template('standard', christmasTreeTemplate)
+
+"""
+Templates read from files, as {path: (modification time, template)}, so that each file is only read once
+"""
+loadedTemplates = dict()
+
+"""
+Templates the christmas tree features are taken against, the standard template first
+"""
+activeTemplates = [standardTemplate]
+
+"""
+Reads a template file, named after the file
+"""
+def readTemplate(path):
+    mtime = os.path.getmtime(path)
+    if path not in loadedTemplates or loadedTemplates[path][0] != mtime:
+        templateFile = open(path)
+        line = templateFile.readline()
+        templateFile.close()
+        values = np.fromstring(line.split(':')[0], dtype = np.float64, sep = ',')
+        if len(values) == 0:
+            raise ValueError('{} holds no template'.format(path))
+        name = os.path.basename(path)
+        loadedTemplates[path] = (mtime, Template(name[:len(name)-len(templateExtension)], values))
+    return loadedTemplates[path][1]
+
+"""
+Returns the paths of the template files of the SVM directory and, if given, of a database
+"""
+def findTemplatePaths(dirName, databaseName = None):
+    folders = [os.path.join(dirName, 'SVM', templateFolder)]
+    if databaseName != None:
+        folders.append(os.path.join(dirName, 'waveform_data', databaseName, templateFolder))
+    paths = list()
+    for folder in folders:
+        if os.path.isdir(folder):
+            for file in sorted(os.listdir(folder)):
+                if file.endswith(templateExtension):
+                    paths.append(os.path.join(folder, file))
+    return paths
+
+"""
+Makes the christmas tree features use the standard template and the templates of the files at paths
+"""
+def useTemplates(paths = tuple()):
+    global activeTemplates
+    activeTemplates = [standardTemplate] + [readTemplate(path) for path in paths]
+
+"""
+Returns the names of the additional data columns of the templates in use besides the standard template
+"""
+def findTemplateColumns():
+    return tuple(['XRCOV {}'.format(template.name) for template in activeTemplates[1:]])
+
+"""
+Cross-covaries every template against every row of an (N, samples) block, whose rows have the given lengths,
+both translated to a mean of 0
+At every lag the two are zero padded to a common length, and their covariance is taken over the padded length
+Returns an (N, templates) array of the greatest covariance over every lag
+Rows are correlated with FFTs, rows of the same length together, so a row gets the same result in any block,
+and the FFT of the rows is shared by every template correlated at the same FFT size
+"""
+def crossCovariance(templates, rows, lengths):
+    output = np.zeros((len(lengths), len(templates)))
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        if length == 0:
+            continue
+        b = rows[group, :length]
+        b = b - b.sum(axis = 1)[:, None]/length
+        bTotal = b.sum(axis = 1)[:, None]
+        spectra = dict()
+        for t in range(len(templates)):
+            size = max(len(templates[t]), length)
+            fftSize = 1 << int(2*size-2).bit_length()
+            if fftSize not in spectra:
+                spectra[fftSize] = np.conj(np.fft.rfft(b, fftSize, axis = 1))
+            correlation = np.fft.irfft(templates[t].getSpectrum(fftSize)*spectra[fftSize], fftSize, axis = 1)
+            lags = np.arange(-(size-1), size)
+            padded = size+np.abs(lags)
+            covariance = correlation[:, lags % fftSize]/padded - templates[t].total*bTotal/(padded*padded)
+            output[group, t] = covariance.max(axis = 1)
+    return output
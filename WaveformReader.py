@@ -7,6 +7,8 @@ import Tkinter as tk
 import os
 import sys
 import inspect
+import threading
+from multiprocessing import cpu_count
 
 fileName = inspect.getfile(inspect.currentframe())
 moduleDirName = os.path.realpath(os.path.dirname(fileName))
@@ -16,36 +18,17 @@ sys.path.append(os.path.join(moduleDirName, "numpy\\Lib\\site-packages\\numpy-1.
 from Display import Display
 from Analysis import Analysis
 from Svmgen import Svmgen
+from Filters import findAvailableFilters
 import FileExporter
+import Headless
+import WaveformStore
+import ResultCache
 
 standardWidth = 525 + 90
 standardHeight = 250 + 60
 screenSize = [2, 2]
 defaultOverlayColor = 'red'
 
-"""
-Tuple of filters which can be applied to waveforms
-
-All elements follow format:
-Element 1: filter name
-               e.g.-Lowpass
-Element 2: filters which must have been applied in order to apply filter
-               e.g.-Christmas_Tree filter requires a waveform filtered with a Bottomreturn_Isolation
-Element 3: filters which cannot have been applied in order to apply filter
-               e.g.-Bottomreturn_Isolation filter requires a waveform which has not been filtered with a Bottomreturn_Isolation
-Element 4: names of datatypes stored in a .csv file if, when bulk filtering, additional data is stored
-"""
-filters = (('Lowpass', tuple(), tuple(['Christmas_Tree']), tuple()),
-           ('Raw_Bottomreturn_Isolation', tuple(), ('LogAmp', 'Bottomreturn_Isolation', 'Raw_Bottomreturn_Isolation', 'Derivative'), ('BR peak', 'BR length', 'Leading Edge')),
-           ('Bottomreturn_Isolation', tuple(['Noise_Reduction']),('Bottomreturn_Isolation', 'Raw_Bottomreturn_Isolation', 'Derivative'), ('BR peak', 'BR length', 'Leading Edge')),
-           ('Christmas_Tree', tuple(['Bottomreturn_Isolation']), ('Christmas_Tree', 'Derivative'), ('CT peak', 'CT length', 'XRCOV', 'slope left', 'slope right', 'R2 left', 'R2 right')),
-           ('Christmas_Tree', tuple(['Raw_Bottomreturn_Isolation']), ('Christmas_Tree', 'Derivative'), ('CT peak', 'CT length', 'XRCOV', 'slope left', 'slope right', 'R2 left', 'R2 right')),
-           ('LogAmp', tuple(), ('Bottomreturn_Isolation', 'Christmas_Tree', 'Lowpass', 'Derivative', 'LogAmp'), tuple()),
-           ('Noise_Reduction', tuple(), ('Bottomreturn_Isolation', 'Christmas_Tree', 'Derivative'), tuple()),
-           ('Derivative', tuple(), tuple(), tuple()),
-           ('None', tuple(), tuple(), tuple()),
-           ('Increase', tuple(), tuple(), tuple()))
-
 """
 Master Class of program
 Used to:
@@ -59,6 +42,7 @@ Used to:
 class WaveformReader():
     def __init__(self, display = True):
         self.dirName = moduleDirName
+        self.cacheLimit = ResultCache.cacheLimit
         if os.path.exists(os.path.join(os.path.realpath(moduleDirName), 'memory', 'waveform_option_memory.txt')):
             execfile(os.path.join(os.path.realpath(moduleDirName), 'memory', 'waveform_option_memory.txt'))
         else:
@@ -79,16 +63,20 @@ class WaveformReader():
     """
     Sets up the file sorting system in the form:
     -WaveformReader
+        -calibration
         -SVM
             -formulae
             -returns
             -samples
+            -templates
         -waveform_data
             -databasename0
                 -additional_data
                     -filtered_data.csv
                     -anotherfilter_data.csv
                     ...
+                -calibration
+                -templates
                 -raw_data.txt
                 -filtered.txt
                 -anotherfilter.txt
@@ -102,49 +90,7 @@ class WaveformReader():
     called by __init__
     """
     def setupFileSorting(self):
-        if not os.path.exists(os.path.join(self.dirName, 'SVM')):
-            os.makedirs(os.path.join(self.dirName, 'SVM'))
-        if not os.path.exists(os.path.join(self.dirName, 'SVM', 'samples')):
-            os.makedirs(os.path.join(self.dirName, 'SVM', 'samples'))
-        if not os.path.exists(os.path.join(self.dirName, 'SVM', 'returns')):
-            os.makedirs(os.path.join(self.dirName, 'SVM', 'returns'))
-        if not os.path.exists(os.path.join(self.dirName, 'waveform_data')):
-            os.makedirs(os.path.join(self.dirName, 'waveform_data'))
-        for file in os.listdir(self.dirName):
-            if file.endswith('.txt'):
-                if os.path.exists(os.path.join(self.dirName, 'waveform_data', file[:len(file) - 4])):
-                    n = 0
-                    while True:
-                        if not os.path.exists(os.path.join(self.dirName, 'waveform_data', '_'.join((file[:len(file) - 4], str(n))))):
-                            os.makedirs(os.path.join(self.dirName, 'waveform_data', '_'.join((file[:len(file) - 4], str(n)))))
-                            os.makedirs(os.path.join(self.dirName, 'waveform_data', '_'.join((file[:len(file) - 4], str(n))), 'additional_data'))
-                            os.makedirs(os.path.join(self.dirName, 'SVM', 'samples', '_'.join((file[:len(file) - 4], str(n)))))
-                            self.processRaw(os.path.join(self.dirName, file), os.path.join(self.dirName, 'waveform_data', '_'.join((file[:len(file) - 4], str(n))), 'raw_data.txt'))
-                            break
-                        n+=1
-                else:
-                    os.makedirs(os.path.join(self.dirName, 'waveform_data', file[:len(file) - 4]))
-                    os.makedirs(os.path.join(self.dirName, 'waveform_data',file[:len(file) - 4], 'additional_data'))
-                    os.makedirs(os.path.join(self.dirName, 'SVM', 'samples', file[:len(file) - 4]))
-                    self.processRaw(os.path.join(self.dirName, file), os.path.join(self.dirName, 'waveform_data', file[:len(file) - 4], 'raw_data.txt'))
-        self.databaseOptions = list()
-        for dir in os.listdir(os.path.join(self.dirName, 'waveform_data')):
-            self.databaseOptions.append(dir)
-
-    """
-    Processes raw .txt data files by spliting the lines by commas,
-    removing the first two elements, and appending a :0 to each line,
-    which signifies that the waveform's start is offset by 0 nanoseconds
-    called by setupFileSorting
-    """
-    def processRaw(self, oldPath, newPath):
-        lines = open(oldPath, 'r').readlines()
-        saveFile = open(newPath, 'w')
-        for n in range(len(lines)):
-            saveFile.write(':'.join([','.join(lines[n].split(',')[2:])[:len(','.join(lines[n].split(',')[2:]))-1], '0\n']))
-        saveFile.write('None')
-        saveFile.close()
-        os.remove(oldPath)
+        self.databaseOptions = Headless.setupFileSorting(self.dirName)
 
     """
     Sets up a screenSize[0] x screenSize[1](width x height) array of waveform displays
@@ -176,6 +122,9 @@ class WaveformReader():
     def setupClassVariables(self):
         self.databases = dict()
         self.databaseLineOffsets = dict()
+        self.layerStores = dict()
+        self.layerImports = dict()
+        self.resultCache = None
         self.clipBoard = ['', 0, [0, 0], 0, '']
         self.extremaOn, self.gridOn = False, False
         self.actions = list()
@@ -224,6 +173,7 @@ class WaveformReader():
         #Create preference menu
         preferenceMenu = tk.Menu(menubar, tearoff = 0)
         preferenceMenu.add_command(label = 'Change Root Directory', command = self.openChangeRootDirectory)
+        preferenceMenu.add_command(label = 'Change Cache Limit', command = self.openChangeCacheLimit)
         #Format menubar
         menubar.add_cascade(label = 'File', menu = self.fileMenu)
         menubar.add_cascade(label = 'Edit', menu = self.editMenu)
@@ -324,17 +274,7 @@ class WaveformReader():
     """
     def updateOverlays(self, dataType, update, color):
         winX, winY = self.focused[0]-1, self.focused[1]-1
-        openedFile = open(self.databases[self.currentDatabase][dataType], 'r')
-        openedFile.seek(self.databaseLineOffsets[self.currentDatabase][dataType][update-1])
-        line = openedFile.readline()
-        openedFile.seek(self.databaseLineOffsets[self.currentDatabase][dataType][len(self.databaseLineOffsets[self.currentDatabase][dataType])-1])
-        openedFile.close()
-        data = line.split(',')
-        tempVar = data[len(data)-1].split(':')
-        data[len(data)-1] = tempVar[0]
-        start = int(tempVar[1])
-        for n in range(len(data)):
-            data[n] = float(data[n])
+        data, start, filtersApplied = self.readWaveform(dataType, update-1)
         screenData = self.screen[winX][winY].data
         oldAdditions = [list(self.screen[winX][winY].overlays), list(self.screen[winX][winY].hPoints), list(self.screen[winX][winY].hLinesRaw)]
         self.screen[winX][winY].addOverlay(data, start, color)
@@ -362,7 +302,6 @@ class WaveformReader():
             self.screen[self.secondaryFocused[0]-1][self.secondaryFocused[1]-1].addOverlay(data, start, defaultOverlayColor)
 
     def openBulkFilter(self):
-        global filters
         self.bulkFilterWin = tk.Tk(className = 'Run Filter')
         tk.Label(self.bulkFilterWin, text = 'Data Type = ').grid(row = 0, column = 0)
         dataType = tk.StringVar(self.bulkFilterWin)
@@ -381,24 +320,7 @@ class WaveformReader():
         line = selectedFile.readline()
         selectedFile.close()
         filtersApplied = line.split(',')
-        filterNames = list()
-        for a in range(len(filters)):
-            numberApplied = 0
-            for b in range(len(filters[a][1])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][1][b]:
-                        numberApplied += 1
-                        break
-            passing = True
-            for b in range(len(filters[a][2])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][2][b]:
-                        passing = False
-                        break
-                if not passing:
-                    break
-            if passing and numberApplied == len(filters[a][1]):
-                filterNames.append(filters[a][0])
+        filterNames = findAvailableFilters(filtersApplied)
         filterApplying = tk.StringVar(self.bulkFilterWin, filterNames[0])
         self.filterOptions = tk.OptionMenu(self.bulkFilterWin, filterApplying, *filterNames)
         self.filterOptions.grid(row = 1, column = 1)
@@ -407,8 +329,14 @@ class WaveformReader():
         tk.Label(self.bulkFilterWin, text = 'Save New Data as:').grid(row = 3, column = 0)
         fileEntry = tk.Entry(self.bulkFilterWin)
         fileEntry.grid(row = 3, column = 1)
-        actButton = tk.Button(self.bulkFilterWin, text = 'Apply', command = lambda: self.testRunBulkFilter(dataType.get(), filterApplying.get(), fileEntry.get(), fileReturn.get()))
-        actButton.grid(row = 4, column = 0, columnspan = 2)
+        tk.Label(self.bulkFilterWin, text = 'Processes:').grid(row = 4, column = 0)
+        workerEntry = tk.Entry(self.bulkFilterWin)
+        workerEntry.insert(0, cpu_count())
+        workerEntry.grid(row = 4, column = 1)
+        incremental = tk.BooleanVar(self.bulkFilterWin, False)
+        tk.Checkbutton(self.bulkFilterWin, text = 'Only Filter New or Changed Waveforms?', variable = incremental, onvalue = True, offvalue = False).grid(row = 5, column = 0, columnspan = 2)
+        actButton = tk.Button(self.bulkFilterWin, text = 'Apply', command = lambda: self.testRunBulkFilter(dataType.get(), filterApplying.get(), fileEntry.get(), fileReturn.get(), workerEntry.get(), incremental.get()))
+        actButton.grid(row = 6, column = 0, columnspan = 2)
         fileEntry.bind('<Return>', lambda e: actButton.invoke())
         actButton.bind('<Return>', lambda e: actButton.invoke())
         self.bulkFilterWin.mainloop()
@@ -419,36 +347,23 @@ class WaveformReader():
         line = selectedFile.readline()
         selectedFile.close()
         filtersApplied = line.split(',')
-        filterNames = list()
-        for a in range(len(filters)):
-            numberApplied = 0
-            for b in range(len(filters[a][1])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][1][b]:
-                        numberApplied += 1
-                        break
-            passing = True
-            for b in range(len(filters[a][2])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][2][b]:
-                        passing = False
-                        break
-                if not passing:
-                    break
-            if passing and numberApplied == len(filters[a][1]):
-                filterNames.append(filters[a][0])
+        filterNames = findAvailableFilters(filtersApplied)
         filterApplying.set(filterNames[0])
         self.filterOptions.destroy()
         self.filterOptions = tk.OptionMenu(self.bulkFilterWin, filterApplying, *filterNames)
         self.filterOptions.grid(row = 1, column = 1)
 
-    def testRunBulkFilter(self, dataType, filterType, fileName, fileReturns):
+    def testRunBulkFilter(self, dataType, filterType, fileName, fileReturns, workers, incremental = False):
+        try:
+            workers = max(int(workers), 1)
+        except ValueError:
+            workers = cpu_count()
         for file in os.listdir(os.path.join(self.dirName, 'waveform_data', self.currentDatabase)):
             if file[:len(file) - 4] == fileName:
                 self.overwriting = tk.Tk()
                 tk.Label(self.overwriting, text = 'File Already Exists').grid(row = 0, column = 0, columnspan = 2)
                 tk.Label(self.overwriting, text = 'Overwrite?').grid(row = 1, column = 0, columnspan = 2)
-                yes = tk.Button(self.overwriting, text = 'Yes', command = lambda: self.runBulkFilter(dataType, filterType, fileName, fileReturns))
+                yes = tk.Button(self.overwriting, text = 'Yes', command = lambda: self.runBulkFilter(dataType, filterType, fileName, fileReturns, workers, incremental))
                 yes.grid(row = 2, column = 0)
                 yes.bind('<Return>', lambda e: yes.invoke())
                 yes.focus_force()
@@ -457,10 +372,9 @@ class WaveformReader():
                 no.bind('<Return>', lambda e: no.invoke())
                 self.overwriting.mainloop()
                 return
-        self.runBulkFilter(dataType, filterType, fileName, fileReturns)
+        self.runBulkFilter(dataType, filterType, fileName, fileReturns, workers, incremental)
 
-    def runBulkFilter(self, dataType, filterType, fileName, fileReturns):
-        global filters
+    def runBulkFilter(self, dataType, filterType, fileName, fileReturns, workers = None, incremental = False):
         self.looping = False
         self.bulkFilterWin.destroy()
         try:
@@ -471,97 +385,21 @@ class WaveformReader():
         filterBar = tk.Canvas(filterBarMaster, width = 150, height = 76)
         filterBar.pack()
         filterBar.create_text(75, 38, text = '/'.join((str(0), str(len(self.databaseLineOffsets[self.currentDatabase][dataType])))))
-        saveFile = open('.'.join((os.path.join(self.dirName, 'waveform_data', self.currentDatabase, fileName), 'txt')), 'w+')
         filterBarMaster.update()
-        if fileReturns:
-            dataFile = open('.'.join((os.path.join(self.dirName, 'waveform_data', self.currentDatabase, 'additional_data', '{}_data'.format(fileName)), 'csv')), 'w+')
-            for n in range(len(filters)):
-                if filterType == filters[n][0]:
-                    filterNum = int(n)
-            for n in range(len(filters[filterNum][3])):
-                dataFile.write(filters[filterNum][3][n])
-                if n != len(filters[filterNum][3])-1:
-                    dataFile.write(',')
-                else:
-                    dataFile.write('\n')
-        for n in range(len(self.databaseLineOffsets[self.currentDatabase][dataType])):
+        def updateFilterBar(done, total):
             filterBar.delete('all')
-            filterBar.create_text(75, 38, text = '/'.join((str(n+1), str(len(self.databaseLineOffsets[self.currentDatabase][dataType])))))
+            filterBar.create_text(75, 38, text = '/'.join((str(done), str(total))))
             filterBarMaster.update()
-            openedFile = open(self.databases[self.currentDatabase][dataType], 'r')
-            openedFile.seek(self.databaseLineOffsets[self.currentDatabase][dataType][n])
-            line = openedFile.readline()
-            openedFile.close()
-            data = line.split(',')
-            if n != len(self.databaseLineOffsets[self.currentDatabase][dataType])-1:
-                tempVar = data[len(data)-1].split(':')
-                data[len(data)-1] = tempVar[0]
-                start = int(tempVar[1])
-                start
-                for n in range(len(data)):
-                    data[n] = float(data[n])
-                fileData, filterData = list(), list()
-                startPoint = 0
-                if not fileReturns:
-                    exec('filterData, startPoint, fileData = Analysis(data).apply{}(start)'.format(filterType))
-                else:
-                    exec('filterData, startPoint, fileData = Analysis(data).apply{}(start, True)'.format(filterType))
-                    for m in range(len(fileData)):
-                        dataFile.write(str(fileData[m]))
-                        if m != len(fileData) - 1:
-                            dataFile.write(',')
-                        else:
-                            dataFile.write('\n')
-                for m in range(len(filterData)):
-                    saveFile.write(str(round(filterData[m], 2)))
-                    if m != len(filterData) - 1:
-                        saveFile.write(',')
-                    else:
-                        saveFile.write(''.join((':', str(startPoint), '\n')))
-            else:
-                if filterType == 'None':
-                    saveFile.write(line)
-                else:
-                    written = False
-                    for m in range(len(data)):
-                        if data[m] == filterType:
-                            written = True
-                        if data[m] != 'None':
-                            saveFile.write(''.join((data[m], ',')))
-                    if not written:
-                        saveFile.write(filterType)
-        saveFile.close()
-        try:
-            dataFile.close()
-        except NameError:
-            pass
+        Headless.runFilterChain(self.dirName, self.currentDatabase, dataType, [filterType], fileName, fileReturns, workers, updateFilterBar, incremental = incremental)
         filterBarMaster.destroy()
         self.updateDatabase(self.currentDatabase)
         self.looping = True
         self.window.after(1, self.loop)
 
     def openSingleFilter(self):
-        global filters
         self.singleFilterWin = tk.Tk(className = 'Run Filter')
         filtersApplied = self.screen[self.focused[0]-1][self.focused[1]-1].filtersApplied
-        filterNames = list()
-        for a in range(len(filters)):
-            numberApplied = 0
-            for b in range(len(filters[a][1])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][1][b]:
-                        numberApplied += 1
-                        break
-            passing = True
-            for b in range(len(filters[a][2])):
-                for c in range(len(filtersApplied)):
-                    if filtersApplied[c] == filters[a][2][b]:
-                        passing = False
-                        break
-                if not passing:
-                    break
-            if passing and numberApplied == len(filters[a][1]):
-                filterNames.append(filters[a][0])
+        filterNames = findAvailableFilters(filtersApplied)
         filterName = tk.StringVar(self.singleFilterWin, filterNames[0])
         tk.Label(self.singleFilterWin, text = 'Filter: ').grid(row = 2, column = 0)
         tk.OptionMenu(self.singleFilterWin, filterName, *filterNames).grid(row = 2, column = 1, columnspan = 2)
@@ -588,7 +426,7 @@ class WaveformReader():
         self.singleFilterWin.destroy()
         xIn, yIn = self.focused[0]-1, self.focused[1]-1
         xOut, yOut = self.secondaryFocused[0]-1, self.secondaryFocused[1]-1
-        filterData, startPoint, filedata = self.screen[xIn][yIn].applyFilter(filterName)
+        filterData, startPoint, filedata = self.screen[xIn][yIn].applyFilter(filterName, self.findResultCache(), self.findSingleFilterKey(self.screen[xIn][yIn], filterName))
         filtersApplied = list(self.screen[xIn][yIn].filtersApplied)
         filtersApplied.append(filterName)
         oldData = list(self.screen[xOut][yOut].data)
@@ -605,6 +443,27 @@ class WaveformReader():
         else:
             self.appendAction([[[xOut, yOut], newData, oldData, newAdditions, oldAdditions], [[xIn, yIn], inNewData, inOldData, inNewAdditions, inOldAdditions]])
 
+    """
+    Returns the result cache of the root directory, opening it the first time it is needed
+    """
+    def findResultCache(self):
+        if self.resultCache == None:
+            self.resultCache = ResultCache.ResultCache(self.dirName, self.cacheLimit)
+        return self.resultCache
+
+    """
+    Returns the result cache key of applying a filter to a displayed waveform
+    A waveform read from a file of the current database is keyed by the file and its number,
+    and any other waveform, such as the result of a single filter, by its values and start
+    """
+    def findSingleFilterKey(self, display, filterName):
+        dataType, index = display.waveType, int(display.waveNum)-1
+        if dataType in self.databases[self.currentDatabase] and 0 <= index < len(self.databaseLineOffsets[self.currentDatabase][dataType])-1:
+            values, start, filtersApplied = self.readWaveform(dataType, index)
+            if start == display.start and values == display.values.tolist():
+                return ResultCache.findRecordKey(self.databases[self.currentDatabase][dataType], index, [filterName])
+        return ResultCache.findWaveformKey(display.values, display.start, [filterName])
+
     def changeWaveform(self):
         global showCoords
         self.changeWave = tk.Tk(className = 'Change Waveform')
@@ -638,18 +497,8 @@ class WaveformReader():
 
     def updateWaveformNum(self, dataType, update):
         winX, winY = self.focused[0]-1, self.focused[1]-1
-        openedFile = open(self.databases[self.currentDatabase][dataType], 'r')
-        openedFile.seek(self.databaseLineOffsets[self.currentDatabase][dataType][update-1])
-        line = openedFile.readline()
-        openedFile.seek(self.databaseLineOffsets[self.currentDatabase][dataType][len(self.databaseLineOffsets[self.currentDatabase][dataType])-1])
-        filtersApplied = openedFile.readline().split(',')
-        openedFile.close()
-        data = line.split(',')
-        tempVar = data[len(data)-1].split(':')
-        data[len(data)-1] = tempVar[0]
-        start = int(tempVar[1])
-        for n in range(len(data)):
-            data[n] = float(data[n])
+        data, start, filtersApplied = self.readWaveform(dataType, update-1)
+        filtersApplied = filtersApplied.split(',')
         oldData = list(self.screen[winX][winY].data)
         oldAdditions = [list(self.screen[winX][winY].overlays), list(self.screen[winX][winY].hPoints), list(self.screen[winX][winY].hLinesRaw)]
         newData = [dataType, update, data, start, filtersApplied]
@@ -657,6 +506,44 @@ class WaveformReader():
         newAdditions = [list(self.screen[winX][winY].overlays), list(self.screen[winX][winY].hPoints), list(self.screen[winX][winY].hLinesRaw)]
         self.appendAction([[[winX, winY], newData, oldData, newAdditions, oldAdditions]])
 
+    """
+    Returns the memory mapped store of a file in the current database, or None while it is being imported
+    or if it has none
+    A file opened without a current store has it imported in a background thread, so the display is never held up by it
+    Only files whose stores are smaller than them are imported, so the others are always read from the file itself
+    """
+    def openLayer(self, dataType):
+        if dataType not in self.layerStores[self.currentDatabase]:
+            path = self.databases[self.currentDatabase][dataType]
+            if path in self.layerImports and (self.layerImports[path].is_alive() or not os.path.exists(WaveformStore.storePathFor(path))):
+                return None
+            store = WaveformStore.findLayer(path)
+            if store == None:
+                self.layerImports[path] = threading.Thread(target = WaveformStore.importText, args = (path,), kwargs = {'compactOnly': True})
+                self.layerImports[path].daemon = True
+                self.layerImports[path].start()
+                return None
+            self.layerStores[self.currentDatabase][dataType] = store
+        return self.layerStores[self.currentDatabase][dataType]
+
+    """
+    Returns the values, start and filters applied of a waveform, numbered from 0, of a file in the current database,
+    read from its store, or from the file itself while the store is being imported
+    The values are copied out of the mapped store, so that a waveform never keeps the store file open
+    """
+    def readWaveform(self, dataType, index):
+        layer = self.openLayer(dataType)
+        if layer != None:
+            data, start = layer.getWaveform(index)
+            return data.tolist(), start, layer.filtersApplied
+        path = self.databases[self.currentDatabase][dataType]
+        lineOffsets = self.databaseLineOffsets[self.currentDatabase][dataType]
+        openedFile = open(path, 'rb')
+        openedFile.seek(int(lineOffsets[index]))
+        data, start = WaveformStore.parseRecord(openedFile.readline())
+        openedFile.close()
+        return data.tolist(), start, Headless.readFiltersApplied(path, lineOffsets).rstrip('\r\n')
+
     def openCreateDataDensityGraph(self):
         self.densityWin = tk.Tk(className = 'Graph Density')
         tk.Label(self.densityWin, text = 'Data Type = ').grid(row = 0, column = 0)
@@ -670,30 +557,7 @@ class WaveformReader():
 
     def createDataDensityGraph(self, dataType):
         self.densityWin.destroy()
-        densityData = list()
-        readFile = open(os.path.join(self.dirName, 'waveform_data', self.currentDatabase, '{}.txt'.format(str(dataType))))
-        first = readFile.readline().split(',')
-        densityStart = int(first[len(first)-1].split(':')[1])
-        fileLength = len(self.databaseLineOffsets[self.currentDatabase][dataType])
-        l = 0
-        for line in readFile:
-            if l < fileLength-2:
-                data = line.split(',')
-                tempVar = data[len(data)-1].split(':')
-                data[len(data)-1] = tempVar[0]
-                start = int(tempVar[1])
-                if start<densityStart:
-                    appension = list()
-                    for n in range(densityStart-start):
-                        appension.append(0)
-                    densityData = appension + densityData
-                    densityStart = int(start)
-                for n in range(len(data)):
-                    if len(densityData)-1 < n+start-densityStart:
-                        densityData.append(float(data[n]))
-                    else:
-                        densityData[n+start-densityStart]+=float(data[n])
-            l+=1
+        densityData, densityStart = Headless.findDensity(self.databases[self.currentDatabase][dataType])
         x, y = self.focused[0]-1, self.focused[1]-1
         self.screen[x][y].updateWaveformData(['{}_density'.format(dataType), 0, densityData, densityStart, ['Density']])
 
@@ -736,22 +600,16 @@ class WaveformReader():
         self.databaseMenu.invoke(name)
 
     def updateDatabase(self, databaseName):
-        '''Used to update the line spacings for the databases and define which databases have been updated'''
+        '''Used to update the line spacings for the databases, read from their saved line indexes, and define which databases have been updated'''
         database = dict()
         thisDatabaseLineOffsets = dict()
         for file in os.listdir(os.path.join(self.dirName, 'waveform_data', databaseName)):
             if file.endswith('.txt'):
                 database[file[:len(file) - 4]] = os.path.join(self.dirName, 'waveform_data', databaseName, file)
-                openedFile = open(os.path.join(self.dirName, 'waveform_data', databaseName, file))
-                fileLineOffsets = list()
-                offset = 0
-                for line in openedFile:
-                    fileLineOffsets.append(offset)
-                    offset += len(line) + 1
-                thisDatabaseLineOffsets[file[:len(file) - 4]] = fileLineOffsets
-                openedFile.close()
+                thisDatabaseLineOffsets[file[:len(file) - 4]] = WaveformStore.LineIndex(database[file[:len(file) - 4]]).offsets
         self.databases[databaseName] = database
         self.databaseLineOffsets[databaseName] = thisDatabaseLineOffsets
+        self.layerStores[databaseName] = dict()
         self.currentDatabase = databaseName
         self.databaseNameplate.config(text = ' '.join(('Current Database:', self.currentDatabase)))
         self.databaseSelectors[databaseName].switchMode()
@@ -797,9 +655,28 @@ class WaveformReader():
         self.window.destroy()
         self.__init__()
 
+    def openChangeCacheLimit(self):
+        self.cacheLimitChange = tk.Tk()
+        cacheLimitEntry = tk.StringVar(self.cacheLimitChange, str(self.cacheLimit/1e6))
+        tk.Label(self.cacheLimitChange, text = 'Cache Limit (MB):').grid(row = 0, column = 0)
+        tk.Entry(self.cacheLimitChange, textvariable = cacheLimitEntry, width = 30).grid(row = 1, column = 0)
+        tk.Button(self.cacheLimitChange, text = 'Update Cache Limit', command = lambda: self.changeCacheLimit(cacheLimitEntry.get())).grid(row = 2, column = 0)
+
+    def changeCacheLimit(self, newLimit):
+        self.cacheLimitChange.destroy()
+        try:
+            self.cacheLimit = max(int(float(newLimit)*1e6), 0)
+        except ValueError:
+            return
+        if self.resultCache != None:
+            self.resultCache.limit = self.cacheLimit
+            self.resultCache.evict()
+        self.updateMemory()
+
     def updateMemory(self):
         memoryFile = open(os.path.join(moduleDirName, 'memory', 'waveform_option_memory.txt'), 'w')
-        memoryFile.write('self.dirName = "{}"'.format(self.dirName))
+        memoryFile.write('self.dirName = "{}"\n'.format(self.dirName))
+        memoryFile.write('self.cacheLimit = {}'.format(self.cacheLimit))
         memoryFile.close()
 
     def updateUndoMenu(self):
@@ -913,4 +790,5 @@ class WaveformReader():
         def switchMode(self):
             self.menu.entryconfig(self.name, command = lambda: self.master.openDatabase(self.name))
 
-test = WaveformReader()
\ No newline at end of file
+if __name__ == '__main__':
+    test = WaveformReader()
\ No newline at end of file
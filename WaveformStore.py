@@ -0,0 +1,449 @@
+"""
+Reading and writing of waveform database files
+
+Text files hold one waveform per line, as 'value,value,...,value:start', followed by a line of the filters applied
+Stores are the binary equivalent: every waveform of a file in one contiguous sample buffer, the index of the first
+sample of each waveform, the start of each waveform, and a header holding the filters applied
+Store layout: magic, samples, offsets (int64, one more than the number of waveforms), starts, JSON header,
+header length (uint64), magic
+Values written with a few decimals are stored as integers scaled by a power of ten, recorded in the header as
+the number of decimals, and divided by it again when read, which gives exactly the value the text reads as
+Scaled stores keep the sample numbers of any values written as -0.0 (int64) after the starts, as scaling loses their sign
+The header also records how the text file wrote its values, starts and line endings, so that a store exports back
+to the text file it was imported from
+"""
+import os
+import mmap
+import json
+import zlib
+import struct
+import numpy as np
+from Checkpoint import partialPathFor, replaceFile
+
+magic = 'WFSTORE1'
+storeVersion = 4
+storeExtension = '.wfs'
+indexMagic = 'WFINDEX1'
+indexVersion = 1
+indexExtension = '.idx'
+
+"""
+Number of waveforms gathered before their samples are written to a store
+"""
+writeBlockSize = 1000
+
+"""
+Largest number of decimals of values stored as scaled integers
+"""
+maxDecimals = 6
+
+"""
+Number of bytes scanned at a time when finding the lines of a text file
+"""
+scanBlockSize = 1 << 24
+
+"""
+Number of bytes before the last indexed line compared when checking that a grown file was only appended to
+"""
+indexTailSize = 1 << 16
+
+"""
+Reads a waveform line of the form 'value,value,...,value:start'
+Returns the values as a float64 array and the start
+"""
+def parseRecord(line):
+    data, start = line.split(':')
+    start = float(start)
+    if start == int(start):
+        start = int(start)
+    return np.fromstring(data, dtype = np.float64, sep = ','), start
+
+"""
+Writes a number the way the filter returned it, dropping the decimal point of whole numbers held as floats
+"""
+def formatValue(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return str(float(value))
+
+"""
+Reads the waveforms of an opened database file in order, through the file's own buffer
+Iterating yields (values, start) for each waveform, stopping after count waveforms or at the filters applied line,
+which is kept as self.filtersApplied
+"""
+class RecordReader():
+    def __init__(self, openedFile, count = None):
+        self.openedFile = openedFile
+        self.count = count
+        self.filtersApplied = None
+
+    def __iter__(self):
+        if self.count == 0:
+            return
+        read = 0
+        for line in self.openedFile:
+            if ':' not in line:
+                self.filtersApplied = line
+                return
+            yield parseRecord(line)
+            read += 1
+            if read == self.count:
+                return
+
+"""
+Returns the byte offset of the start of every line of a buffer from the byte offset start onwards,
+scanning it a block at a time
+"""
+def findLineOffsets(buffer, size, start = 0):
+    if start >= size:
+        return np.zeros(0, dtype = np.int64)
+    offsets = [np.array([start], dtype = np.int64)]
+    for blockStart in range(start, size, scanBlockSize):
+        block = np.frombuffer(buffer[blockStart:min(blockStart+scanBlockSize, size)], dtype = np.uint8)
+        offsets.append(np.flatnonzero(block == 10).astype(np.int64)+blockStart+1)
+    offsets = np.concatenate(offsets)
+    if offsets[len(offsets)-1] == size:
+        offsets = offsets[:len(offsets)-1]
+    return offsets
+
+"""
+Returns the path of the line index kept alongside a text file
+"""
+def indexPathFor(path):
+    return ''.join((path, indexExtension))
+
+"""
+The byte offset of every line of a text file, kept in a sidecar file next to it with the size and modification time
+of the file, so that opening an unchanged file only compares the two
+If the file has grown and the bytes before its last indexed line are unchanged, only the lines from there on are scanned
+Offsets already known from writing the file, as in an ingest, are saved without scanning it
+Index layout: magic, header length (uint64), JSON header, padding to 8 bytes, offsets (int64)
+"""
+class LineIndex():
+    def __init__(self, path, offsets = None):
+        self.path = path
+        self.indexPath = indexPathFor(path)
+        self.size = os.path.getsize(path)
+        self.mtime = os.path.getmtime(path)
+        if offsets is not None:
+            self.offsets = np.asarray(offsets, dtype = np.int64)
+            self.writeIndex()
+            return
+        header, offsets = self.readIndex()
+        if header != None and header['size'] == self.size and header['mtime'] == self.mtime:
+            self.offsets = offsets
+            return
+        if header != None and header['size'] < self.size and len(offsets) != 0 and self.findTail(offsets[len(offsets)-1]) == header['tail']:
+            self.offsets = np.concatenate((offsets[:len(offsets)-1], self.scan(int(offsets[len(offsets)-1]))))
+        else:
+            self.offsets = self.scan(0)
+        self.writeIndex()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def scan(self, start):
+        if self.size == 0:
+            return np.zeros(0, dtype = np.int64)
+        openedFile = open(self.path, 'rb')
+        fileMap = mmap.mmap(openedFile.fileno(), 0, access = mmap.ACCESS_READ)
+        offsets = findLineOffsets(fileMap, self.size, start)
+        fileMap.close()
+        openedFile.close()
+        return offsets
+
+    """
+    Returns a checksum of the bytes before the byte offset end
+    """
+    def findTail(self, end):
+        openedFile = open(self.path, 'rb')
+        openedFile.seek(max(0, end-indexTailSize))
+        tail = zlib.crc32(openedFile.read(end-max(0, end-indexTailSize))) & 0xffffffff
+        openedFile.close()
+        return tail
+
+    def readIndex(self):
+        if not os.path.exists(self.indexPath):
+            return None, None
+        try:
+            indexFile = open(self.indexPath, 'rb')
+            if indexFile.read(len(indexMagic)) != indexMagic:
+                indexFile.close()
+                return None, None
+            headerLength = struct.unpack('<Q', indexFile.read(8))[0]
+            header = json.loads(indexFile.read(headerLength))
+            offsets = np.fromfile(indexFile, dtype = '<i8', count = header['count']).astype(np.int64)
+            indexFile.close()
+            if len(offsets) != header['count'] or header['version'] != indexVersion:
+                return None, None
+            return header, offsets
+        except (IOError, ValueError, KeyError, struct.error):
+            return None, None
+
+    """
+    Saves the index next to the text file, leaving the file without a saved index if its directory is read only
+    """
+    def writeIndex(self):
+        tail = 0
+        if len(self.offsets) != 0:
+            tail = self.findTail(self.offsets[len(self.offsets)-1])
+        text = json.dumps({'version': indexVersion, 'size': self.size, 'mtime': self.mtime, 'count': len(self.offsets), 'tail': tail})
+        text = text.ljust(len(text)+(-(len(indexMagic)+8+len(text)) % 8))
+        try:
+            indexFile = open(self.indexPath, 'wb')
+            indexFile.write(indexMagic)
+            indexFile.write(struct.pack('<Q', len(text)))
+            indexFile.write(text)
+            self.offsets.astype('<i8').tofile(indexFile)
+            indexFile.close()
+        except IOError:
+            pass
+
+"""
+Returns the path of the store kept alongside a text database file
+"""
+def storePathFor(textPath):
+    return ''.join((os.path.splitext(textPath)[0], storeExtension))
+
+"""
+Read access to a store
+The samples, offsets and starts are memory mapped, so opening a store reads only its header,
+and every waveform, or range of waveforms, is a view into the mapped sample buffer
+Waveforms are numbered from 0
+"""
+class WaveformStore():
+    def __init__(self, path):
+        self.path = path
+        storeFile = open(path, 'rb')
+        if storeFile.read(len(magic)) != magic:
+            storeFile.close()
+            raise ValueError('{} is not a waveform store'.format(path))
+        storeFile.seek(-8-len(magic), os.SEEK_END)
+        headerLength = struct.unpack('<Q', storeFile.read(8))[0]
+        storeFile.seek(-8-len(magic)-headerLength, os.SEEK_END)
+        self.header = json.loads(storeFile.read(headerLength))
+        self.filtersApplied = str(self.header['filtersApplied'])
+        self.dtype = np.dtype(str(self.header['dtype']))
+        self.decimals = self.header.get('decimals', 0)
+        self.scale = 10**self.decimals
+        self.offsets = self.readArray(storeFile, self.header['offsetsAt'], '<i8', self.header['count']+1)
+        self.starts = self.readArray(storeFile, self.header['startsAt'], str(self.header['startsDtype']), self.header['count'])
+        self.samples = self.readArray(storeFile, self.header['samplesAt'], self.dtype, self.header['samples'])
+        self.negativeZeros = self.readArray(storeFile, self.header.get('negativeZerosAt', 0), '<i8', self.header.get('negativeZeros', 0))
+        storeFile.close()
+
+    def readArray(self, storeFile, position, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype = dtype)
+        return np.memmap(self.path, dtype = dtype, mode = 'r', offset = position, shape = (count,))
+
+    """
+    Checks whether the store was imported from the current version of a text database file
+    """
+    def matchesSource(self, textPath):
+        return self.header.get('sourceSize') == os.path.getsize(textPath) and self.header.get('sourceMtime') == os.path.getmtime(textPath)
+
+    def __len__(self):
+        return len(self.starts)
+
+    """
+    Returns the values and start of a waveform, with whole starts as integers, as parseRecord reads them
+    The values are a view into the sample buffer, unless the store is scaled, when they are the samples divided by the scale
+    """
+    def getWaveform(self, index):
+        start = self.starts[index].item()
+        if start == int(start):
+            start = int(start)
+        values = self.samples[self.offsets[index]:self.offsets[index+1]]
+        if self.decimals != 0:
+            values = values/float(self.scale)
+            first, last = np.searchsorted(self.negativeZeros, (self.offsets[index], self.offsets[index+1]))
+            values[self.negativeZeros[first:last]-self.offsets[index]] = -0.0
+        return values, start
+
+    """
+    Returns the samples of waveforms first to last-1 as one view into the sample buffer, the offsets of each waveform
+    within it, and their starts
+    The values of a scaled store are the samples divided by self.scale
+    """
+    def getWaveforms(self, first, last):
+        return self.samples[self.offsets[first]:self.offsets[last]], self.offsets[first:last+1]-self.offsets[first], self.starts[first:last]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.getWaveform(index)
+
+"""
+Writes waveforms to a new store one at a time, holding only a block of them in memory
+Values are stored scaled by 10**decimals
+"""
+class StoreWriter():
+    def __init__(self, path, dtype = 'float64', decimals = 0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.decimals = decimals
+        self.storeFile = open(path, 'wb')
+        self.storeFile.write(magic)
+        self.lengths, self.starts = list(), list()
+        self.block = list()
+        self.samples = 0
+        self.negativeZeros = list()
+
+    def write(self, values, start):
+        if self.decimals != 0:
+            values = np.asarray(values, dtype = np.float64)
+            self.negativeZeros.append(np.flatnonzero((values == 0) & np.signbit(values))+self.samples)
+            values = np.round(values*10**self.decimals)
+        self.block.append(np.asarray(values, dtype = self.dtype))
+        self.lengths.append(len(values))
+        self.samples += len(values)
+        self.starts.append(start)
+        if len(self.block) >= writeBlockSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.block) != 0:
+            np.concatenate(self.block).astype(self.dtype.newbyteorder('<')).tofile(self.storeFile)
+        self.block = list()
+
+    def pad(self):
+        self.storeFile.write('\0'*(-self.storeFile.tell() % 8))
+
+    """
+    Writes the index and header, and closes the store
+    """
+    def close(self, filtersApplied = 'None', header = dict()):
+        self.flush()
+        self.pad()
+        offsetsAt = self.storeFile.tell()
+        np.concatenate(([0], np.cumsum(self.lengths, dtype = np.int64))).astype('<i8').tofile(self.storeFile)
+        startsAt = self.storeFile.tell()
+        starts = np.array(self.starts, dtype = np.float64)
+        if np.all(starts == np.round(starts)):
+            starts = starts.astype('<i8')
+        else:
+            starts = starts.astype('<f8')
+        starts.tofile(self.storeFile)
+        negativeZerosAt = self.storeFile.tell()
+        negativeZeros = np.concatenate([np.zeros(0, dtype = np.int64)]+self.negativeZeros).astype('<i8')
+        negativeZeros.tofile(self.storeFile)
+        header = dict(header)
+        header.update({'version': storeVersion, 'dtype': self.dtype.newbyteorder('<').str, 'decimals': self.decimals, 'count': len(self.lengths), 'samples': self.samples,
+                       'samplesAt': len(magic), 'offsetsAt': offsetsAt, 'startsAt': startsAt, 'startsDtype': starts.dtype.str,
+                       'negativeZerosAt': negativeZerosAt, 'negativeZeros': len(negativeZeros),
+                       'filtersApplied': filtersApplied})
+        header = json.dumps(header)
+        self.storeFile.write(header)
+        self.storeFile.write(struct.pack('<Q', len(header)))
+        self.storeFile.write(magic)
+        self.storeFile.close()
+
+"""
+Returns the format of the store of a text database file: the smallest sample type which holds every value of it exactly,
+scaled by the fewest decimals which do so, falling back to float64 for values with more than maxDecimals decimals
+or too large to scale, which read back from it as they do from the text file,
+whether every value and every start of it is written as a decimal, and its line ending
+"""
+def findStoreFormat(textPath):
+    openedFile = open(textPath, 'rb')
+    minimum, maximum, decimals = 0, 0, 0
+    textFormat = {'lineEnding': '\n', 'floatValues': True, 'floatStarts': True}
+    for line in openedFile:
+        if ':' not in line:
+            break
+        if line.endswith('\r\n'):
+            textFormat['lineEnding'] = '\r\n'
+        data, start = line.split(':')
+        textFormat['floatValues'] = textFormat['floatValues'] and (data == '' or data.count('.') == data.count(',')+1)
+        textFormat['floatStarts'] = textFormat['floatStarts'] and '.' in start
+        values = parseRecord(line)[0]
+        if len(values) == 0:
+            continue
+        minimum, maximum = min(minimum, values.min()), max(maximum, values.max())
+        while decimals != None and np.any(np.round(values*10**decimals)/float(10**decimals) != values):
+            decimals += 1
+            if decimals > maxDecimals:
+                decimals = None
+    openedFile.close()
+    textFormat['dtype'], textFormat['decimals'] = 'float64', 0
+    if decimals != None:
+        minimum, maximum = round(minimum*10**decimals), round(maximum*10**decimals)
+        for dtype in ('uint8', 'int16', 'int32'):
+            if minimum >= np.iinfo(dtype).min and maximum <= np.iinfo(dtype).max:
+                textFormat['dtype'], textFormat['decimals'] = dtype, decimals
+                break
+    return textFormat
+
+"""
+Converts a text database file to a store, next to the text file unless storePath is given
+dtype is the sample type of the store, chosen with its scale by findStoreFormat if not given, and holding values unscaled if given
+The store is written as (storePath).partial and only replaces any old store once it is finished, and records
+the text file as it was when the import started, so a text file changed meanwhile does not match it
+If compactOnly is set, a file whose values would be stored as float64, and so take more space than the text file,
+is not imported, and any old store of it is removed
+Returns the path of the store, or None if it was not imported
+"""
+def importText(textPath, storePath = None, dtype = None, compactOnly = False):
+    if storePath == None:
+        storePath = storePathFor(textPath)
+    header = {'sourceSize': os.path.getsize(textPath), 'sourceMtime': os.path.getmtime(textPath)}
+    header.update(findStoreFormat(textPath))
+    if dtype != None:
+        header['dtype'], header['decimals'] = dtype, 0
+    if compactOnly and np.dtype(header['dtype']).kind == 'f':
+        if os.path.exists(storePath):
+            os.remove(storePath)
+        return None
+    openedFile = open(textPath, 'rb')
+    reader = RecordReader(openedFile)
+    writer = StoreWriter(partialPathFor(storePath), header.pop('dtype'), header.pop('decimals'))
+    for values, start in reader:
+        writer.write(values, start)
+    openedFile.close()
+    filtersApplied = reader.filtersApplied
+    if filtersApplied == None:
+        filtersApplied = 'None'
+        header['trailer'] = ''
+    else:
+        header['trailer'] = filtersApplied
+    writer.close(filtersApplied.rstrip('\r\n'), header)
+    replaceFile(partialPathFor(storePath), storePath)
+    return storePath
+
+"""
+Opens the store of a text database file, or returns None if it is missing, of another version,
+or the text file has changed since it was imported
+"""
+def findLayer(textPath):
+    storePath = storePathFor(textPath)
+    if os.path.exists(storePath):
+        try:
+            store = WaveformStore(storePath)
+            if store.header.get('version') == storeVersion and store.matchesSource(textPath):
+                return store
+        except ValueError:
+            pass
+    return None
+
+"""
+Converts a store back to the text database file it was imported from, written as that file wrote its values,
+starts, line endings and filters applied line
+"""
+def exportText(storePath, textPath):
+    store = WaveformStore(storePath)
+    formatSample, formatStart = formatValue, formatValue
+    if store.header.get('floatValues'):
+        formatSample = lambda value: repr(float(value))
+    if store.header.get('floatStarts'):
+        formatStart = lambda start: repr(float(start))
+    lineEnding = str(store.header.get('lineEnding', '\n'))
+    textFile = open(textPath, 'wb')
+    lines = list()
+    for values, start in store:
+        lines.append(''.join((','.join([formatSample(value) for value in values.tolist()]), ':', formatStart(start), lineEnding)))
+        if len(lines) >= writeBlockSize:
+            textFile.write(''.join(lines))
+            lines = list()
+    textFile.write(''.join(lines))
+    textFile.write(str(store.header.get('trailer', store.filtersApplied)))
+    textFile.close()
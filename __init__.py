@@ -5,7 +5,19 @@ Created on Mon Aug 15 09:48:58 2016
 @author: tkammerer
 """
 import Analysis
+import BulkFilter
+import Calibration
+import Checkpoint
 import Display
 import FileExporter
+import Filters
+import Headless
+import Incremental
+import Ingest
+import ModelSelection
+import ResultCache
 import Svmgen
-import WaveformReader
\ No newline at end of file
+import SvmModel
+import Templates
+import WaveformReader
+import WaveformStore
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Tests of the disk cache of filter results
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import ResultCache
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    """
+    Writes a file of size bytes outside the cache, and returns its path
+    """
+    def writeFile(self, name, size):
+        path = os.path.join(self.dirName, name)
+        openedFile = open(path, 'wb')
+        openedFile.write('0'*size)
+        openedFile.close()
+        return path
+
+    def testLinkedEntryUsedOftenSurvives(self):
+        cache = ResultCache.ResultCache(self.dirName, limit = 3000)
+        for name in ('a', 'b', 'c'):
+            self.assertTrue(cache.add(name, self.writeFile('{}.txt'.format(name), 1000)))
+            time.sleep(.01)
+        self.assertTrue(os.stat(cache.get('a')).st_nlink > 1)
+        for n in range(3):
+            time.sleep(.01)
+            self.assertNotEqual(cache.get('a'), None)
+        time.sleep(.01)
+        cache.add('d', self.writeFile('d.txt', 1000))
+        self.assertNotEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), None)
+        self.assertNotEqual(cache.get('c'), None)
+        self.assertNotEqual(cache.get('d'), None)
+
+    def testLastUseKeptAcrossCaches(self):
+        cache = ResultCache.ResultCache(self.dirName, limit = 2000)
+        cache.add('a', self.writeFile('a.txt', 1000))
+        time.sleep(.01)
+        cache.add('b', self.writeFile('b.txt', 1000))
+        time.sleep(.01)
+        cache.get('a')
+        time.sleep(.01)
+        cache = ResultCache.ResultCache(self.dirName, limit = 2000)
+        cache.add('c', self.writeFile('c.txt', 1000))
+        self.assertNotEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), None)
+
+    def testEntryOverLimitNotAdded(self):
+        cache = ResultCache.ResultCache(self.dirName, limit = 1000)
+        self.assertFalse(cache.add('a', self.writeFile('a.txt', 1001)))
+        self.assertEqual(cache.get('a'), None)
+
+    def testRecordKey(self):
+        path = self.writeFile('raw_data.txt', 1000)
+        key = ResultCache.findRecordKey(path, 3, ['Noise_Reduction'])
+        self.assertEqual(key, ResultCache.findRecordKey(path, 3, ['Noise_Reduction']))
+        self.assertNotEqual(key, ResultCache.findRecordKey(path, 4, ['Noise_Reduction']))
+        self.assertNotEqual(key, ResultCache.findRecordKey(path, 3, ['Lowpass']))
+        self.assertNotEqual(key, ResultCache.findRecordKey(self.writeFile('other.txt', 1000), 3, ['Noise_Reduction']))
+        openedFile = open(path, 'ab')
+        openedFile.write('0')
+        openedFile.close()
+        self.assertNotEqual(key, ResultCache.findRecordKey(path, 3, ['Noise_Reduction']))
+
+    def testStoreAndLoad(self):
+        cache = ResultCache.ResultCache(self.dirName)
+        cache.store('a', ([1.5, 2.0], 3, [4]))
+        self.assertEqual(ResultCache.ResultCache(self.dirName).load('a'), ([1.5, 2.0], 3, [4]))
+        self.assertEqual(cache.load('b'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Tests of reading and writing waveform stores
+Run with python -m unittest discover tests from the root directory
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import WaveformStore
+from BulkFilter import formatRecord
+from Ingest import convertLine
+
+class TestWaveformStore(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.random = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    """
+    Writes lines to a text database file, and returns its path
+    """
+    def writeText(self, name, lines, filtersApplied):
+        path = os.path.join(self.dirName, '{}.txt'.format(name))
+        textFile = open(path, 'wb')
+        textFile.write(''.join(lines))
+        textFile.write(filtersApplied)
+        textFile.close()
+        return path
+
+    """
+    Returns the text of a database file after importing it to a store and exporting the store again
+    """
+    def roundTrip(self, path):
+        storePath = WaveformStore.importText(path)
+        exportPath = os.path.join(self.dirName, 'exported.txt')
+        WaveformStore.exportText(storePath, exportPath)
+        return open(exportPath, 'rb').read()
+
+    def testRoundTripRaw(self):
+        lines = list()
+        for n in range(200):
+            values = self.random.randint(0, 256, size = self.random.randint(1, 300))
+            lines.append(''.join((convertLine(','.join(['0', '0']+[str(value) for value in values])), '\r\n')))
+        path = self.writeText('raw_data', lines, 'None')
+        self.assertEqual(self.roundTrip(path), open(path, 'rb').read())
+
+    def testRoundTripFiltered(self):
+        lines = list()
+        for n in range(200):
+            values = self.random.uniform(-300, 300, size = self.random.randint(1, 300))
+            lines.append(formatRecord(values, self.random.randint(0, 50)+0.5*(n % 2)))
+        path = self.writeText('raw_data_Noise_Reduction', lines, 'None,Noise_Reduction\n')
+        self.assertEqual(self.roundTrip(path), open(path, 'rb').read())
+
+    def testRoundTripExact(self):
+        lines = [formatRecord(self.random.normal(size = 100), n, exact = True) for n in range(200)]
+        path = self.writeText('raw_data_Smooth', lines, 'None,Smooth')
+        self.assertEqual(self.roundTrip(path), open(path, 'rb').read())
+
+    def testFilteredStoreSize(self):
+        lines = list()
+        for n in range(200):
+            values = self.random.uniform(-300, 300, size = self.random.randint(100, 400))
+            values[::50] = -0.0
+            lines.append(formatRecord(values, n))
+        path = self.writeText('raw_data_Noise_Reduction', lines, 'None,Noise_Reduction')
+        store = WaveformStore.WaveformStore(WaveformStore.importText(path))
+        self.assertEqual(store.dtype, np.dtype('int16'))
+        self.assertLessEqual(3*os.path.getsize(store.path), os.path.getsize(path))
+        for line, (values, start) in zip(lines, store):
+            self.assertEqual(repr(values.tolist()), repr(WaveformStore.parseRecord(line)[0].tolist()))
+
+    def testWaveformRange(self):
+        lines = [formatRecord(self.random.uniform(-300, 300, size = self.random.randint(1, 300)), n) for n in range(3000)]
+        path = self.writeText('raw_data_Noise_Reduction', lines, 'None,Noise_Reduction')
+        store = WaveformStore.WaveformStore(WaveformStore.importText(path))
+        samples, offsets, starts = store.getWaveforms(1000, 2000)
+        self.assertTrue(np.shares_memory(samples, store.samples))
+        self.assertEqual(len(offsets), 1001)
+        self.assertEqual(starts.tolist(), range(1000, 2000))
+        for n in range(1000, 2000):
+            values = samples[offsets[n-1000]:offsets[n-999]]/float(store.scale)
+            self.assertEqual(values.tolist(), WaveformStore.parseRecord(lines[n])[0].tolist())
+
+    def testCompactOnly(self):
+        path = self.writeText('raw_data_Smooth', [formatRecord(self.random.normal(size = 100), n, exact = True) for n in range(20)], 'None,Smooth')
+        self.assertEqual(WaveformStore.importText(path, compactOnly = True), None)
+        self.assertFalse(os.path.exists(WaveformStore.storePathFor(path)))
+        path = self.writeText('raw_data_Noise_Reduction', [formatRecord(self.random.normal(size = 100), n) for n in range(20)], 'None,Noise_Reduction')
+        self.assertEqual(WaveformStore.importText(path, compactOnly = True), WaveformStore.storePathFor(path))
+
+if __name__ == '__main__':
+    unittest.main()